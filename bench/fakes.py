@@ -0,0 +1,471 @@
+# Локальные заменители внешнего мира для бенчмарков: Telegram (FakeBot),
+# Binance (тикер и свечи), CryptoPay и Postgres (FakeStore — DB-хелперы bot.py
+# поверх словарей с теми же индексами, что в схеме). Сеть и БД не нужны.
+#
+# install(bot, store) подменяет функции модуля bot: хендлеры зовут их по имени
+# из глобалов модуля, поэтому работает настоящий код хендлеров.
+# FakeBotApiServer — тот же Telegram, но по HTTP: для настоящего Application.
+
+import asyncio
+import bisect
+import collections
+import itertools
+import json
+import random
+import re
+import time
+import types
+
+import numpy as np
+
+MINUTE_MS = 60_000
+
+
+# ------------------ TELEGRAM ------------------
+
+class FakeBot:
+    # Минимум Bot API, который зовут хендлеры. latency — имитация RTT до Telegram.
+
+    def __init__(self, latency: float = 0.0, username: str = "tonmetric_bench_bot"):
+        self.latency = latency
+        self.username = username
+        self.calls: dict[str, int] = {}
+        self.uploads = 0
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+
+    async def _call(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _message(self, chat_id: int, text: str = None, photo=None):
+        return types.SimpleNamespace(message_id=next(self.message_ids), chat_id=chat_id, text=text, photo=photo)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await self._call("sendMessage")
+        return self._message(chat_id, text)
+
+    async def send_photo(self, chat_id: int, photo, **kwargs):
+        await self._call("sendPhoto")
+        if not isinstance(photo, str):
+            self.uploads += 1
+            photo = f"file-{next(self.file_ids)}"
+        return self._message(chat_id, photo=[types.SimpleNamespace(file_id=photo)])
+
+    async def send_document(self, chat_id: int, document, **kwargs):
+        await self._call("sendDocument")
+        return self._message(chat_id)
+
+    async def edit_message_media(self, *args, **kwargs):
+        await self._call("editMessageMedia")
+        return self._message(0, photo=[types.SimpleNamespace(file_id=f"file-{next(self.file_ids)}")])
+
+    async def get_chat(self, chat_id: int):
+        await self._call("getChat")
+        return types.SimpleNamespace(username=f"user{chat_id}", full_name=f"User {chat_id}")
+
+    async def get_me(self):
+        await self._call("getMe")
+        return types.SimpleNamespace(username=self.username)
+
+
+class FakeBotApiServer:
+    # Bot API на 127.0.0.1: Application ходит сюда через свой httpx-клиент, как в
+    # проде в api.telegram.org. latency — задержка ответа на каждый вызов.
+
+    CHAT_ID = re.compile(rb'chat_id(?:=|"\r\n\r\n)(-?\d+)')
+    MESSAGE_METHODS = ("sendMessage", "sendPhoto", "sendDocument", "editMessageMedia", "editMessageText")
+
+    def __init__(self, latency: float = 0.0, username: str = "tonmetric_bench_bot"):
+        self.latency = latency
+        self.username = username
+        self.calls: collections.Counter = collections.Counter()
+        self.uploads = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+        self.server = None
+
+    @property
+    def base_url(self) -> str:
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/bot"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        # HTTP/1.1 keep-alive: httpx держит пул соединений и шлёт запросы подряд
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+                headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in head[1:] if line)}
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method = head[0].split(" ")[1].rsplit("/", 1)[-1]
+
+                self.calls[method] += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                try:
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    payload = json.dumps({"ok": True, "result": self._result(method, body)}).encode()
+                finally:
+                    self.in_flight -= 1
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(payload), payload))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _result(self, method: str, body: bytes):
+        match = self.CHAT_ID.search(body)
+        chat_id = int(match.group(1)) if match else 0
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "TON Metric", "username": self.username,
+                    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": True}
+        if method == "getChat":
+            return {"id": chat_id, "type": "private", "username": f"user{chat_id}", "first_name": f"User {chat_id}"}
+        if method in self.MESSAGE_METHODS:
+            message = {"message_id": next(self.message_ids), "date": int(time.time()),
+                       "chat": {"id": chat_id, "type": "private"}}
+            if method in ("sendPhoto", "editMessageMedia"):
+                if b"filename=" in body:
+                    self.uploads += 1
+                file_id = f"file-{next(self.file_ids)}"
+                message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720}]
+            return message
+        return True  # answerCallbackQuery, answerInlineQuery и прочее
+
+
+class FakeMessage:
+    def __init__(self, bot: FakeBot, chat_id: int, text: str = ""):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.text = text
+
+    async def reply_text(self, text: str, **kwargs):
+        return await self.bot.send_message(self.chat_id, text, **kwargs)
+
+    async def reply_photo(self, photo, **kwargs):
+        return await self.bot.send_photo(self.chat_id, photo, **kwargs)
+
+    async def edit_media(self, media, **kwargs):
+        return await self.bot.edit_message_media(media, **kwargs)
+
+
+class FakeQuery:
+    def __init__(self, bot: FakeBot, user_id: int, data: str):
+        self.data = data
+        self.from_user = types.SimpleNamespace(id=user_id)
+        self.message = FakeMessage(bot, user_id)
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.scheduled: list[tuple] = []
+
+    def run_once(self, callback, when, *args, **kwargs):
+        self.scheduled.append((getattr(callback, "__name__", "?"), when))
+
+
+def make_update(bot: FakeBot, user_id: int, text: str = "", callback_data: str = None):
+    user = types.SimpleNamespace(id=user_id)
+    update = types.SimpleNamespace(
+        effective_user=user,
+        effective_chat=types.SimpleNamespace(id=user_id),
+        message=FakeMessage(bot, user_id, text),
+        callback_query=None,
+    )
+    if callback_data is not None:
+        update.callback_query = FakeQuery(bot, user_id, callback_data)
+    return update
+
+
+def make_context(bot: FakeBot, args: list = None, job_queue: FakeJobQueue = None):
+    return types.SimpleNamespace(
+        bot=bot,
+        args=args or [],
+        job_queue=job_queue or FakeJobQueue(),
+        application=types.SimpleNamespace(create_task=asyncio.ensure_future),
+    )
+
+
+# ------------------ BINANCE ------------------
+
+class FakeBinance:
+    # Случайное блуждание цены; свечи любого интервала строятся из того же ряда.
+
+    def __init__(self, symbols: list[str], seed: int = 1):
+        self.rng = random.Random(seed)
+        self.prices = {s: 2.5 * (10 ** i) for i, s in enumerate(symbols)}
+        self.calls = {"ticker": 0, "klines": 0}
+
+    def ticker(self) -> dict:
+        self.calls["ticker"] += 1
+        return dict(self.prices)
+
+    def klines(self, interval: str, limit: int, start_time=None, symbol: str = None, step_ms: int = None) -> list:
+        self.calls["klines"] += 1
+        end = int(time.time() * 1000) // step_ms * step_ms
+        start = end - (limit - 1) * step_ms if start_time is None else start_time // step_ms * step_ms
+        base = self.prices.get(symbol, 1.0)
+        opens = np.arange(start, end + 1, step_ms)[:limit]
+        rng = np.random.default_rng(int(start // step_ms) % 2**32)
+        closes = base * np.exp(np.cumsum(rng.normal(0, 0.002, len(opens))))
+        return [[int(t), c, c * 1.001, c * 0.999, c, 0] for t, c in zip(opens, closes)]
+
+
+# ------------------ CRYPTOPAY / MEMELANDIA ------------------
+
+class FakeCryptoPay:
+    def __init__(self, first_id: int = 10**9):
+        self.invoices: dict[int, dict] = {}
+        self.ids = itertools.count(first_id)
+
+    def create_invoice(self, user_id: int, tickets: int, amount_ton: float) -> dict:
+        invoice_id = next(self.ids)
+        self.invoices[invoice_id] = {"invoice_id": invoice_id, "status": "active", "amount": str(amount_ton),
+                                     "pay_url": f"https://t.me/CryptoBot?start=IV{invoice_id}"}
+        return dict(self.invoices[invoice_id])
+
+    def get_invoice(self, invoice_id: int) -> dict:
+        if invoice_id not in self.invoices:
+            raise RuntimeError("Invoice not found in CryptoPay")
+        return dict(self.invoices[invoice_id])
+
+    def pay(self, invoice_id: int):
+        self.invoices[invoice_id]["status"] = "paid"
+
+
+# уже разобранный ответ fetch_memelandia_top
+MEMELANDIA_TOP = [
+    {"index": i, "symbol": symbol, "price": price, "change_24": change, "change_7d": change * 3,
+     "holders": 1000 * (6 - i), "market_cap": price * 10**9}
+    for i, (symbol, price, change) in enumerate(
+        [("PUMP", 0.012, 4.2), ("DOGS", 0.0007, -1.5), ("NOT", 0.008, 0.3), ("REDO", 0.4, 12.0), ("FISH", 0.03, -7.1)],
+        start=1)
+]
+
+
+# ------------------ POSTGRES ------------------
+
+class FakeStore:
+    # Состояние таблиц в памяти. Лидерборд держим отсортированным, как индекс
+    # по total_ton: запрос top-N стоит O(N), а не скан всех пользователей.
+
+    def __init__(self):
+        self.ticket_users: dict[int, list] = {}  # user_id -> [tickets, total_ton]
+        self.ranking: list[tuple] = []  # (-total_ton, user_id)
+        self.invoices: dict[int, str] = {}
+        self.referrals: dict[int, int] = {}  # referrer -> count
+        self.referred: set[int] = set()
+        self.top_referrer = None  # как материализованный топ: не сканируем на каждый запрос
+        self.subscribers: list[dict] = []
+        self.subscriptions: dict[tuple, dict] = {}  # (user_id, symbol) -> строка subscribers
+        self.outbox: dict[str, dict] = {}
+        self.outbox_queue: collections.deque = collections.deque()  # pending, по порядку id
+        self.outbox_deferred: list[dict] = []  # pending с next_attempt_at в будущем
+        self.outbox_ids = itertools.count(1)
+        self.queries = 0
+        # побочные эффекты настоящих хелперов в памяти процесса (индекс триггеров)
+        self.on_subscribe = None
+        self.on_delivered = None
+
+    def seed(self, ticket_users: int = 10_000, subscribers: int = 10_000, referrers: int = 1_000,
+             price: float = 2.5, symbol: str = "TONUSDT", seed: int = 1):
+        rng = random.Random(seed)
+        for uid in range(1, ticket_users + 1):
+            tickets = rng.randint(1, 50)
+            self.ticket_users[uid] = [tickets, float(tickets)]
+        self.ranking = sorted((-v[1], uid) for uid, v in self.ticket_users.items())
+        for _ in range(referrers * 5):
+            ref = rng.randint(1, referrers)
+            self.referrals[ref] = self.referrals.get(ref, 0) + 1
+        if self.referrals:
+            referrer_id, count = max(self.referrals.items(), key=lambda kv: kv[1])
+            self.top_referrer = {"referrer_id": referrer_id, "count": count}
+        langs = ("ru", "en", "uk")
+        # базы вокруг цены: малое движение цены пересекает небольшую долю порогов
+        self.subscribers = [
+            {"user_id": uid, "symbol": symbol, "lang": langs[uid % 3],
+             "base_price": price * (1 + rng.uniform(-0.095, 0.095))}
+            for uid in range(1, subscribers + 1)
+        ]
+        self.subscriptions = {(row["user_id"], row["symbol"]): row for row in self.subscribers}
+
+    # --- хелперы с сигнатурами из bot.py
+
+    def get_active_subscribers(self):
+        self.queries += 1
+        return list(self.subscribers)
+
+    def get_subscription(self, user_id: int, symbol: str):
+        self.queries += 1
+        row = self.subscriptions.get((user_id, symbol))
+        return dict(row, active=True) if row else None
+
+    def subscribe_user_db(self, user_id: int, lang: str, base_price: float, symbol: str):
+        self.queries += 1
+        row = self.subscriptions.get((user_id, symbol))
+        if row is None:
+            row = self.subscriptions[(user_id, symbol)] = {"user_id": user_id, "symbol": symbol}
+            self.subscribers.append(row)
+        row.update(lang=lang, base_price=base_price)
+        if self.on_subscribe:
+            self.on_subscribe(user_id, lang, base_price, symbol)
+
+    def get_active_targets(self):
+        self.queries += 1
+        return []
+
+    def get_leaderboard(self, limit: int = 100):
+        self.queries += 1
+        return [{"user_id": uid, "tickets": self.ticket_users[uid][0], "total_ton": -neg}
+                for neg, uid in self.ranking[:limit]]
+
+    def get_user_ticket_stats(self, user_id: int):
+        self.queries += 1
+        tickets, total = self.ticket_users.get(user_id, (0, 0.0))
+        return {"tickets": int(tickets), "total_ton": float(total)}
+
+    def add_tickets_to_user(self, user_id: int, tickets: int, amount_ton: float):
+        self.queries += 1
+        row = self.ticket_users.get(user_id)
+        if row is not None:
+            i = bisect.bisect_left(self.ranking, (-row[1], user_id))
+            del self.ranking[i]
+        else:
+            row = self.ticket_users[user_id] = [0, 0.0]
+        row[0] += tickets
+        row[1] += amount_ton
+        bisect.insort(self.ranking, (-row[1], user_id))
+
+    def save_invoice(self, invoice_id: int, user_id: int, tickets: int, amount_ton: float, status: str):
+        self.queries += 1
+        self.invoices[invoice_id] = status
+
+    def get_invoice_status(self, invoice_id: int):
+        self.queries += 1
+        return self.invoices.get(invoice_id)
+
+    def get_user_referral_count(self, user_id: int) -> int:
+        self.queries += 1
+        return self.referrals.get(user_id, 0)
+
+    def get_top_referrer(self):
+        self.queries += 1
+        return self.top_referrer
+
+    def add_referral(self, referrer_id: int, referred_id: int):
+        self.queries += 1
+        if referrer_id == referred_id or referred_id in self.referred:
+            return
+        self.referred.add(referred_id)
+        count = self.referrals[referrer_id] = self.referrals.get(referrer_id, 0) + 1
+        if self.top_referrer is None or count > self.top_referrer["count"]:
+            self.top_referrer = {"referrer_id": referrer_id, "count": count}
+
+    # --- outbox: pending -> sending -> sent, как в alert_outbox
+
+    def enqueue_alerts(self, alerts: list[dict]) -> set:
+        self.queries += 1
+        new = set()
+        for alert in alerts:
+            if alert["idem_key"] not in self.outbox:
+                row = dict(alert, id=next(self.outbox_ids), status="pending", attempts=0)
+                self.outbox[alert["idem_key"]] = row
+                self.outbox_queue.append(row)
+                new.add(alert["idem_key"])
+        return new
+
+    def claim_outbox_batch(self, limit: int = 200) -> list[dict]:
+        self.queries += 1
+        now = time.monotonic()
+        due = [row for row in self.outbox_deferred if row["next_attempt_at"] <= now]
+        if due:
+            self.outbox_deferred = [row for row in self.outbox_deferred if row["next_attempt_at"] > now]
+            self.outbox_queue.extendleft(sorted(due, key=lambda row: row["id"], reverse=True))
+        batch = []
+        while self.outbox_queue and len(batch) < limit:
+            row = self.outbox_queue.popleft()
+            row["status"] = "sending"
+            batch.append(dict(row))
+        return batch
+
+    def complete_outbox_deliveries(self, delivered: list[dict]):
+        self.queries += 1
+        for d in delivered:
+            self.outbox[d["idem_key"]]["status"] = "sent"
+            row = self.subscriptions.get((d["ref_id"], d["symbol"])) if d["ref_kind"] == "sub" else None
+            if row is not None and row["base_price"] == d["old_base"]:
+                row["base_price"] = d["new_base"]
+            if self.on_delivered:
+                self.on_delivered(d)
+
+    def _defer(self, idem_key: str, delay: float, attempts: int = None):
+        row = self.outbox[idem_key]
+        row["status"] = "pending"
+        row["next_attempt_at"] = time.monotonic() + delay
+        if attempts is not None:
+            row["attempts"] = attempts
+        self.outbox_deferred.append(row)
+
+    def fail_outbox_delivery(self, row: dict, error: str, retry_after: float = None):
+        self.queries += 1
+        attempts = row["attempts"] + 1
+        if attempts >= 8:
+            self.outbox[row["idem_key"]]["status"] = "failed"
+            return
+        self._defer(row["idem_key"], retry_after if retry_after is not None else 5 * 2 ** (attempts - 1), attempts)
+
+    def release_outbox_rows(self, rows: list[dict], delay: float):
+        self.queries += 1
+        for row in rows:
+            self._defer(row["idem_key"], delay)
+
+    def reset_outbox(self):
+        self.outbox.clear()
+        self.outbox_queue.clear()
+        self.outbox_deferred.clear()
+
+    def outbox_counts(self) -> dict:
+        return dict(collections.Counter(row["status"] for row in self.outbox.values()))
+
+
+STORE_HELPERS = (
+    "get_active_subscribers", "get_subscription", "subscribe_user_db", "get_active_targets",
+    "get_leaderboard", "get_user_ticket_stats", "add_tickets_to_user", "save_invoice", "get_invoice_status",
+    "get_user_referral_count", "get_top_referrer", "add_referral", "enqueue_alerts", "claim_outbox_batch",
+    "complete_outbox_deliveries", "fail_outbox_delivery", "release_outbox_rows",
+)
+
+
+def install(bot, store: FakeStore, binance: FakeBinance, cryptopay: FakeCryptoPay = None):
+    for name in STORE_HELPERS:
+        setattr(bot, name, getattr(store, name))
+    store.on_subscribe = bot.index_subscriber
+    store.on_delivered = bot.settle_index_after_delivery
+    bot.has_db = lambda: True
+    bot.owns_price_watch = lambda: True
+    bot.is_leader = lambda: True
+    bot.deactivate_unreachable_users = lambda user_ids: None
+    bot.price_service.fetch = binance.ticker
+    bot.fetch_klines = lambda interval, limit, start_time=None, symbol=bot.SYMBOL: binance.klines(
+        interval, limit, start_time, symbol, bot.LEVEL_MS[interval])
+    bot.fetch_memelandia_top = lambda limit=5: MEMELANDIA_TOP[:limit]
+    if cryptopay is not None:
+        bot.create_ticket_invoice_api = cryptopay.create_invoice
+        bot.get_invoice_api = cryptopay.get_invoice
+        bot.CRYPTOBOT_TOKEN = "bench"
@@ -0,0 +1,350 @@
+# Нагрузочный стенд: настоящий Application (хендлеры из bot.register_handlers,
+# JobQueue, httpx-клиент Bot API) получает поток апдейтов с заданной частотой,
+# а отвечает ему FakeBotApiServer на 127.0.0.1. Postgres, Binance, CryptoPay и
+# Мемляндия — заменители из bench/fakes.py.
+#
+# Поток похож на живой: кнопки меню на трёх языках, /start с рефкой и без,
+# смена языка, переключение таймфрейма, «шторм» нажатий «Проверить оплату»
+# по одному счёту, и тики цены, которые будят рассылку по большой базе подписчиков.
+# Генератор открытый (open loop): апдейты идут по расписанию, даже если бот
+# не успевает, — поэтому видно и рост очереди, и хвост задержек.
+#
+#   python bench/loadgen.py --rate 50,100,200 --duration 20 --api-latency 0.03
+#   python bench/loadgen.py --rate 200 --concurrent 16 --subscribers 100000
+#
+# Задержка апдейта — от постановки в update_queue до выхода из process_update.
+# Ёмкость — наибольшая частота, при которой p99 укладывается в --slo-ms, а
+# обработано не меньше 95% отправленного.
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application, ApplicationBuilder, CallbackContext  # noqa: E402
+
+import bot  # noqa: E402
+import fakes  # noqa: E402
+import logconfig  # noqa: E402
+
+LANGS = ("ru", "en", "uk")
+DEFAULT_MIX = "button=55,invoice=20,start=10,lang=5,chart=5,command=5"
+# какие кнопки меню жмут чаще
+BUTTON_WEIGHTS = {"price_ton": 40, "leaderboard": 15, "referrals": 12, "buy_tickets": 12,
+                  "notify": 10, "wallet": 8, "memland": 3}
+COMMANDS = ("/price", "/price all", "/mytickets", "/top", "/reflink")
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class LoadTestApplication(Application):
+    # process_update — единственная точка, через которую проходит каждый апдейт:
+    # здесь и меряем. Подкласс без __slots__ заодно даёт weakref для JobQueue.
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.enqueued: dict[int, tuple] = {}  # update_id -> (kind, perf_counter)
+        self.latencies: dict[str, list] = {}
+        self.completed = 0
+        self.errors = 0
+        self.last_done = 0.0
+
+    def submit(self, update: Update, kind: str):
+        self.enqueued[update.update_id] = (kind, time.perf_counter())
+        self.update_queue.put_nowait(update)
+
+    async def process_update(self, update: object) -> None:
+        try:
+            await super().process_update(update)
+        finally:
+            kind, started = self.enqueued.pop(update.update_id, ("other", None))
+            if started is not None:
+                self.last_done = time.perf_counter()
+                self.latencies.setdefault(kind, []).append((self.last_done - started) * 1000)
+                self.completed += 1
+
+
+# ------------------ ПОТОК АПДЕЙТОВ ------------------
+
+class UpdateStream:
+    def __init__(self, users: int, mix: dict, cryptopay: fakes.FakeCryptoPay, seed: int = 1):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.kinds = list(mix)
+        self.weights = list(mix.values())
+        self.cryptopay = cryptopay
+        self.ids = iter(range(1, 10**12))
+        self.pending: list[tuple] = []  # очередь шторма: (kind, dict)
+        self.buttons = list(BUTTON_WEIGHTS)
+        self.button_weights = list(BUTTON_WEIGHTS.values())
+
+    def user(self) -> tuple[int, str]:
+        user_id = self.rng.randint(1, self.users)
+        return user_id, LANGS[user_id % 3]
+
+    def _user_json(self, user_id: int, lang: str) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "language_code": lang}
+
+    def message(self, user_id: int, lang: str, text: str) -> dict:
+        update_id = next(self.ids)
+        message = {"message_id": update_id, "date": int(time.time()), "text": text,
+                   "chat": {"id": user_id, "type": "private"}, "from": self._user_json(user_id, lang)}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, user_id: int, lang: str, data: str) -> dict:
+        update_id = next(self.ids)
+        message = {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"}}
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": self._user_json(user_id, lang), "chat_instance": str(user_id),
+            "data": data, "message": message}}
+
+    def next(self) -> tuple[str, dict]:
+        if self.pending:
+            return self.pending.pop()
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        user_id, lang = self.user()
+
+        if kind == "button":
+            key = self.rng.choices(self.buttons, self.button_weights)[0]
+            return kind, self.message(user_id, lang, bot.get_button_texts(lang)[key])
+        if kind == "start":
+            text = "/start"
+            if self.rng.random() < 0.5:
+                text += f" {self.rng.randint(1, self.users)}"
+            return kind, self.message(user_id, lang, text)
+        if kind == "lang":
+            return kind, self.callback(user_id, lang, f"lang_{self.rng.choice(LANGS)}")
+        if kind == "chart":
+            timeframe = self.rng.choice(list(bot.CHART_TIMEFRAMES))
+            return kind, self.callback(user_id, lang, f"chart:{bot.SYMBOL}:{timeframe}")
+        if kind == "command":
+            return kind, self.message(user_id, lang, self.rng.choice(COMMANDS))
+
+        # шторм: счёт создан, пользователь жмёт «Проверить оплату» 3–8 раз подряд;
+        # где-то в середине CryptoPay отмечает счёт оплаченным
+        invoice_id = self.cryptopay.create_invoice(user_id, 1, 1.0)["invoice_id"]
+        presses = self.rng.randint(3, 8)
+        paid_after = self.rng.randint(1, presses)
+        storm = []
+        for i in range(presses):
+            update = self.callback(user_id, lang, f"check_invoice:{invoice_id}")
+            if i == paid_after:
+                update["pay"] = invoice_id
+            storm.append((kind, update))
+        self.pending = storm[::-1]
+        return self.pending.pop()
+
+
+# ------------------ ПРОГОН ------------------
+
+async def price_tick(context: CallbackContext):
+    # как check_price_job, но с шагом цены от стенда и без самопланирования
+    env = context.job.data
+    env["tick"] += 1
+    env["binance"].prices[bot.SYMBOL] = env["base"] * (1 + env["move"] * (1 if env["tick"] % 2 else -1))
+    bot.price_service.fetched_at = 0.0
+    started = time.perf_counter()
+    await bot.run_price_check(context)
+    env["tick_ms"].append((time.perf_counter() - started) * 1000)
+
+
+async def run_stage(args, rate: float) -> dict:
+    api = fakes.FakeBotApiServer(latency=args.api_latency)
+    await api.start()
+
+    binance = fakes.FakeBinance(bot.PRICE_SYMBOLS)
+    store = fakes.FakeStore()
+    store.seed(ticket_users=args.users, subscribers=args.subscribers, referrers=max(100, args.users // 10),
+               price=binance.prices[bot.SYMBOL], symbol=bot.SYMBOL)
+    cryptopay = fakes.FakeCryptoPay()
+    fakes.install(bot, store, binance, cryptopay)
+    for cache in (bot.chart_cache, bot.chart_file_ids, bot.profile_cache, bot.outbox_pending,
+                  bot.alert_indexes, bot.candle_archives, bot.user_lang):
+        cache.clear()
+    bot.price_service.prices = {}
+    bot.price_service.fetched_at = 0.0
+    bot.user_lang.update((uid, LANGS[uid % 3]) for uid in range(1, args.users + 1))
+    bot.load_alert_index()
+    # как warmup() после старта: графики по умолчанию уже отрисованы
+    await asyncio.to_thread(bot.prewarm_charts)
+
+    # как в main(), только без Updater: апдейты кладём в update_queue сами
+    builder = (
+        ApplicationBuilder()
+        .token(os.environ["BOT_TOKEN"])
+        .base_url(api.base_url)
+        .base_file_url(api.base_url)
+        .application_class(LoadTestApplication)
+        .updater(None)
+    )
+    if args.concurrent > 1:
+        builder = builder.concurrent_updates(args.concurrent)
+    app = builder.build()
+    bot.register_handlers(app)
+
+    async def count_error(update, context):
+        app.errors += 1
+    app.add_error_handler(count_error)
+
+    stream = UpdateStream(args.users, args.mix, cryptopay, seed=args.seed)
+    tick_env = {"binance": binance, "base": binance.prices[bot.SYMBOL], "move": args.tick_move,
+                "tick": 0, "tick_ms": []}
+
+    await app.initialize()
+    await app.start()
+    if args.tick_interval:
+        app.job_queue.run_repeating(price_tick, interval=args.tick_interval, first=args.tick_interval,
+                                    data=tick_env)
+
+    depths = []  # update_queue: ждут, пока fetcher их заберёт
+    backlog = []  # в очереди или в обработке — при concurrent_updates важнее глубины очереди
+    sent = 0
+    started = time.perf_counter()
+    deadline = started + args.duration
+    try:
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            # догоняем расписание: если loop был занят, отправляем пачкой
+            due = int((now - started) * rate) - sent
+            for _ in range(due):
+                kind, data = stream.next()
+                invoice_id = data.pop("pay", None)
+                if invoice_id is not None:
+                    cryptopay.pay(invoice_id)
+                app.submit(Update.de_json(data, app.bot), kind)
+                sent += 1
+            depths.append(app.update_queue.qsize())
+            backlog.append(len(app.enqueued))
+            await asyncio.sleep(min(0.01, 1 / rate))
+        send_window = time.perf_counter() - started
+        window_outbox = store.outbox_counts()
+
+        # дожидаемся хвоста апдейтов и рассылки алертов, но не бесконечно
+        drain_started = time.perf_counter()
+        while (app.enqueued or store.outbox_queue or bot.outbox_lock.locked()) \
+                and time.perf_counter() < drain_started + args.drain_timeout:
+            depths.append(app.update_queue.qsize())
+            backlog.append(len(app.enqueued))
+            await asyncio.sleep(0.05)
+        drain_s = time.perf_counter() - drain_started
+    finally:
+        await app.stop()
+        await app.shutdown()
+        await api.stop()
+
+    latencies = [ms for values in app.latencies.values() for ms in values]
+    busy = max(app.last_done - started, 1e-9)
+    return {
+        "rate": rate,
+        "sent": sent,
+        "completed": app.completed,
+        "lost": len(app.enqueued),
+        "errors": app.errors,
+        "offered_per_s": sent / send_window,
+        "updates_per_s": app.completed / busy,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies, default=0.0),
+        "depth_p95": percentile(depths, 0.95),
+        "depth_max": max(depths, default=0),
+        "backlog_max": max(backlog, default=0),
+        "by_kind": {kind: (len(v), percentile(v, 0.50), percentile(v, 0.99)) for kind, v in sorted(app.latencies.items())},
+        "api_calls": dict(api.calls),
+        "api_max_in_flight": api.max_in_flight,
+        "uploads": api.uploads,
+        "ticks": len(tick_env["tick_ms"]),
+        "tick_p50": percentile(tick_env["tick_ms"], 0.50),
+        "tick_max": max(tick_env["tick_ms"], default=0.0),
+        "outbox_window": window_outbox,
+        "outbox": store.outbox_counts(),
+        "drain_s": drain_s,
+    }
+
+
+def print_stage(result: dict, verbose: bool):
+    print(f"{result['rate']:>7.0f}{result['offered_per_s']:>9.1f}{result['updates_per_s']:>9.1f}"
+          f"{result['sent']:>7}{result['lost']:>6}{result['errors']:>5}"
+          f"{result['p50']:>9.1f}{result['p95']:>9.1f}{result['p99']:>9.1f}{result['max']:>9.1f}"
+          f"{result['depth_p95']:>7}{result['depth_max']:>7}{result['backlog_max']:>9}")
+    if not verbose:
+        return
+    for kind, (count, p50, p99) in result["by_kind"].items():
+        print(f"         {kind:<10}{count:>7} updates  p50 {p50:8.1f} ms  p99 {p99:8.1f} ms")
+    calls = ", ".join(f"{method} {count}" for method, count in sorted(result["api_calls"].items(), key=lambda kv: -kv[1]))
+    print(f"         Bot API: {calls}; max in flight {result['api_max_in_flight']}, uploads {result['uploads']}")
+    if result["ticks"]:
+        print(f"         price ticks: {result['ticks']}, p50 {result['tick_p50']:.1f} ms, max {result['tick_max']:.1f} ms")
+        print(f"         alert outbox: {result['outbox_window']} at end of window, {result['outbox']} "
+              f"after {result['drain_s']:.1f} s drain")
+
+
+async def run(args) -> int:
+    # логи — как в проде, через очередь, но в stderr: stdout занят таблицей
+    logconfig.setup(stream=sys.stderr)
+    print(f"-- users {args.users}, subscribers {args.subscribers}, Bot API latency {args.api_latency * 1000:.0f} ms, "
+          f"concurrent_updates {args.concurrent}, tick every {args.tick_interval or '-'} s")
+    print(f"{'rate':>7}{'offered':>9}{'upd/s':>9}{'sent':>7}{'lost':>6}{'err':>5}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'q p95':>7}{'q max':>7}{'backlog':>9}")
+    capacity = None
+    for rate in args.rate:
+        result = await run_stage(args, rate)
+        print_stage(result, args.verbose)
+        if result["p99"] <= args.slo_ms and result["completed"] >= 0.95 * result["sent"]:
+            capacity = max(capacity or 0, result["updates_per_s"])
+    if capacity is None:
+        print(f"capacity: no stage met p99 <= {args.slo_ms:.0f} ms")
+        return 1
+    print(f"capacity: ~{capacity:.0f} updates/s at p99 <= {args.slo_ms:.0f} ms")
+    return 0
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight)
+    unknown = set(mix) - {"button", "invoice", "start", "lang", "chart", "command"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown update kinds: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=lambda v: [float(x) for x in v.split(",")], default=[50.0],
+                        help="апдейтов в секунду; через запятую — ступени")
+    parser.add_argument("--duration", type=float, default=15.0, help="секунд на ступень")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--subscribers", type=int, default=10_000)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--api-latency", type=float, default=0.03, help="ответ Bot API, сек")
+    parser.add_argument("--concurrent", type=int, default=1, help="concurrent_updates (1 — как в main)")
+    parser.add_argument("--tick-interval", type=float, default=5.0, help="тик цены, сек (0 — без тиков)")
+    parser.add_argument("--tick-move", type=float, default=0.015, help="шаг цены на тик, доля")
+    parser.add_argument("--slo-ms", type=float, default=1000.0)
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
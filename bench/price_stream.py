@@ -0,0 +1,188 @@
+# Поток цен против локального фейкового сервера в формате комбинированного
+# потока Binance (aggTrade + kline_1m). Меряем задержку от события «на бирже»
+# до постановки алерта в outbox, проверяем переподключение и дозаливку
+# пропуска, считаем REST-запросы. Сеть и БД не нужны.
+#
+#   python bench/price_stream.py [--trades 3000] [--rate 500] [--targets 200] [--drop-after 1000]
+#   python bench/price_stream.py --serve [--port 8765]   # только сервер, для ручной проверки бота
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+
+import websockets  # noqa: E402
+
+import bot  # noqa: E402
+
+SYMBOL = "TONUSDT"
+MINUTE_MS = 60_000
+
+
+class FakeStream:
+    # Случайное блуждание цены; каждая сделка — aggTrade, раз в 20 сделок — kline_1m.
+    # drop_after: один раз рвём соединение посреди потока, как это делает Binance.
+
+    def __init__(self, price: float = 2.5, rate: float = 500, drop_after: int = 0, drift: float = 0.0):
+        self.price = price
+        self.rate = rate
+        self.drop_after = drop_after
+        self.drift = drift
+        self.sent = 0
+        self.dropped = False
+        self.minute = int(time.time() * 1000) // MINUTE_MS * MINUTE_MS
+        self.candle = None
+
+    def trade(self) -> dict:
+        self.price *= 1 + random.gauss(self.drift, 0.0005)
+        return {"stream": f"{SYMBOL.lower()}@aggTrade", "data": {
+            "e": "aggTrade", "E": int(time.time() * 1000), "s": SYMBOL, "p": f"{self.price:.6f}", "q": "1"}}
+
+    def kline(self) -> dict:
+        now = int(time.time() * 1000) // MINUTE_MS * MINUTE_MS
+        if self.candle is None or now != self.minute:
+            self.minute = now
+            self.candle = {"o": self.price, "h": self.price, "l": self.price}
+        c = self.candle
+        c["h"], c["l"] = max(c["h"], self.price), min(c["l"], self.price)
+        return {"stream": f"{SYMBOL.lower()}@kline_1m", "data": {
+            "e": "kline", "E": int(time.time() * 1000), "s": SYMBOL,
+            "k": {"t": self.minute, "o": str(c["o"]), "h": str(c["h"]), "l": str(c["l"]),
+                  "c": str(self.price), "x": False}}}
+
+    async def handler(self, ws, path=None):
+        try:
+            while True:
+                await ws.send(json.dumps(self.trade()))
+                self.sent += 1
+                if self.sent % 20 == 0:
+                    await ws.send(json.dumps(self.kline()))
+                if self.drop_after and not self.dropped and self.sent >= self.drop_after:
+                    self.dropped = True
+                    await ws.close()
+                    return
+                await asyncio.sleep(1 / self.rate)
+        except websockets.ConnectionClosed:
+            pass
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(args):
+    fake = FakeStream(rate=args.rate, drop_after=args.drop_after, drift=0.0002)
+    server = await websockets.serve(fake.handler, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    rest = {"ticker": 0, "klines": 0}
+
+    def fake_klines(interval, limit, start_time=None, symbol=SYMBOL):
+        rest["klines"] += 1
+        step = bot.LEVEL_MS[interval]
+        end = int(time.time() * 1000) // step * step
+        start = end - (limit - 1) * step if start_time is None else start_time // step * step
+        return [[t, 2.5, 2.5, 2.5, 2.5, 0] for t in range(start, end + 1, step)][:limit]
+
+    def fake_ticker():
+        rest["ticker"] += 1
+        return {s: fake.price for s in bot.PRICE_SYMBOLS}
+
+    latencies = []
+
+    def record(alerts):
+        now = time.time() * 1000
+        latencies.extend(now - a["event_ms"] for a in alerts)
+        return {a["idem_key"] for a in alerts}
+
+    bot.fetch_klines = fake_klines
+    bot.price_service.fetch = fake_ticker
+    bot.has_db = lambda: True
+    bot.owns_price_watch = lambda: True
+    bot.enqueue_alerts = record
+
+    # цели выше текущей цены: блуждание с дрейфом вверх пересекает их по одной
+    for i in range(args.targets):
+        bot.index_target({"id": i, "user_id": i, "symbol": SYMBOL, "lang": "ru", "kind": "above",
+                          "value": fake.price * (1.0005 + i * 0.0005), "base_price": None})
+    bot.get_candles(SYMBOL).sync(max_age=0)  # архив «используется» — дозаливка его касается
+    rest["klines"] = 0
+
+    # время события протаскиваем в алерт, чтобы enqueue знал, от чего считать задержку
+    collect = bot.collect_alerts
+    event_ms = {"v": 0}
+
+    def collect_with_event(symbol, price):
+        return [dict(a, event_ms=event_ms["v"]) for a in collect(symbol, price)]
+
+    on_trade = bot.price_stream.on_trade
+
+    def on_trade_with_event(app, symbol, price, ms):
+        event_ms["v"] = ms
+        on_trade(app, symbol, price, ms)
+
+    bot.collect_alerts = collect_with_event
+    bot.price_stream.on_trade = on_trade_with_event
+
+    # фейковый сервер шлёт только TON
+    bot.price_service.symbols = [SYMBOL]
+    stream = bot.price_stream
+    stream.symbols = [SYMBOL]
+    stream.url = f"ws://127.0.0.1:{port}/stream"
+    app = types.SimpleNamespace(job_queue=types.SimpleNamespace(run_once=lambda *a, **k: None))
+    task = asyncio.create_task(stream.run(app))
+
+    started = time.perf_counter()
+    while stream.stats["messages"] < args.trades and time.perf_counter() - started < args.timeout:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    prices_before = dict(rest)
+    for _ in range(100):
+        bot.get_price_usd(SYMBOL)  # при живом потоке — без REST
+    task.cancel()
+    server.close()
+
+    print(f"messages {stream.stats['messages']} in {elapsed:.1f} s, connects {stream.stats['connects']}, "
+          f"backfills {stream.stats['backfills']}, errors {stream.stats['errors']}")
+    print(f"alerts {len(latencies)} of {args.targets} targets")
+    if latencies:
+        print(f"event -> outbox latency: p50 {percentile(latencies, 0.5):.1f} ms, "
+              f"p99 {percentile(latencies, 0.99):.1f} ms, max {max(latencies):.1f} ms")
+    print(f"REST during stream: ticker {prices_before['ticker']}, klines {prices_before['klines']}; "
+          f"100 price reads after: +{rest['ticker'] - prices_before['ticker']} ticker")
+
+
+async def serve(port: int, rate: float):
+    fake = FakeStream(rate=rate)
+    async with websockets.serve(fake.handler, "127.0.0.1", port):
+        print(f"fake stream on ws://127.0.0.1:{port}/stream — BINANCE_STREAM_URL для бота")
+        await asyncio.Future()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trades", type=int, default=3000)
+    parser.add_argument("--rate", type=float, default=500)
+    parser.add_argument("--targets", type=int, default=200)
+    parser.add_argument("--drop-after", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve(args.port, args.rate))
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
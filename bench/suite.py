@@ -0,0 +1,252 @@
+# Бенчмарки настоящих хендлеров против локальных заменителей (bench/fakes.py):
+# Telegram, Binance, CryptoPay и Postgres — в памяти, сеть и БД не нужны.
+# Для каждого сценария: пропускная способность, p50/p95/p99 и аллокации на операцию
+# (отдельный проход под tracemalloc, чтобы не искажать время). Результаты сверяются
+# с bench/baselines.json; --save-baseline перезаписывает базу.
+#
+#   python bench/suite.py [--sizes 10000,100000] [--ops 300] [--only top,check_invoice]
+#   python bench/suite.py --save-baseline
+#
+# Код возврата 1 — есть регрессия больше --tolerance.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+
+import bot  # noqa: E402
+import fakes  # noqa: E402
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+NOISE_FLOOR_MS = 0.05  # меньше — не регрессия, а шум таймера
+SCENARIOS: dict = {}
+
+
+def scenario(name: str, max_ops: int = None):
+    def register(factory):
+        SCENARIOS[name] = (factory, max_ops)
+        return factory
+    return register
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Env:
+    def __init__(self, size: int, latency: float):
+        self.size = size
+        self.bot = fakes.FakeBot(latency=latency)
+        self.binance = fakes.FakeBinance(bot.PRICE_SYMBOLS)
+        self.store = fakes.FakeStore()
+        self.store.seed(ticket_users=size, subscribers=size, referrers=max(100, size // 10),
+                        price=self.binance.prices[bot.SYMBOL], symbol=bot.SYMBOL)
+        self.cryptopay = fakes.FakeCryptoPay()
+        fakes.install(bot, self.store, self.binance, self.cryptopay)
+
+        for cache in (bot.chart_cache, bot.chart_file_ids, bot.profile_cache, bot.outbox_pending,
+                      bot.alert_indexes, bot.candle_archives):
+            cache.clear()
+        bot.price_service.prices = {}
+        bot.price_service.fetched_at = 0.0
+        bot.load_alert_index()
+
+    def user(self, i: int) -> int:
+        return 1 + i % self.size
+
+    def context(self, args: list = None):
+        return fakes.make_context(self.bot, args)
+
+
+# ------------------ СЦЕНАРИИ ------------------
+
+@scenario("price_chart")
+def price_chart(env: Env):
+    # кнопка «Курс $TON»: цена + график; картинка из кеша, дальше по file_id
+    async def op(i):
+        await bot.send_price_and_chart(env.user(i), "ru", env.context())
+    return op
+
+
+@scenario("price_chart_cold", max_ops=30)
+def price_chart_cold(env: Env):
+    # то же, но кеши графика сброшены: рендер на каждый запрос
+    async def op(i):
+        bot.chart_cache.clear()
+        bot.chart_file_ids.clear()
+        await bot.send_price_and_chart(env.user(i), "ru", env.context())
+    return op
+
+
+@scenario("top")
+def top(env: Env):
+    async def op(i):
+        await bot.top_cmd(fakes.make_update(env.bot, env.user(i)), env.context())
+    return op
+
+
+@scenario("referrals")
+def referrals(env: Env):
+    async def op(i):
+        await bot.referrals_cmd(fakes.make_update(env.bot, env.user(i)), env.context())
+    return op
+
+
+@scenario("check_price_idle")
+def check_price_idle(env: Env):
+    # тик без пересечений: поиск в индексе, fan-out 0
+    async def op(i):
+        bot.price_service.fetched_at = 0.0
+        await bot.check_price_job(env.context())
+    return op
+
+
+@scenario("check_price_move", max_ops=100)
+def check_price_move(env: Env):
+    # цена ±1.5% — пересекает около 9% порогов: алерты, тексты, постановка в outbox
+    base = env.binance.prices[bot.SYMBOL]
+
+    async def op(i):
+        env.binance.prices[bot.SYMBOL] = base * (1.015 if i % 2 else 0.985)
+        bot.price_service.fetched_at = 0.0
+        bot.outbox_pending.clear()
+        env.store.reset_outbox()
+        await bot.check_price_job(env.context())
+    return op
+
+
+@scenario("check_invoice")
+def check_invoice(env: Env):
+    # поток «Проверить оплату»: новые оплаты, повторные нажатия и неоплаченные счета
+    async def op(i):
+        user_id = env.user(i)
+        if i % 5 == 4:
+            invoice_id = 10**9 + i
+            env.cryptopay.invoices[invoice_id] = {"status": "active", "amount": "1"}
+        elif i % 4 == 3:
+            invoice_id = 10**9 + i - 1  # уже зачисленный
+        else:
+            invoice_id = 10**9 + i
+            env.cryptopay.invoices[invoice_id] = {"status": "paid", "amount": "1"}
+        update = fakes.make_update(env.bot, user_id, callback_data=f"check_invoice:{invoice_id}")
+        await bot.callback_handler(update, env.context())
+    return op
+
+
+# ------------------ ЗАМЕР ------------------
+
+async def measure(op, ops: int, alloc_ops: int, warmup: int = 3) -> dict:
+    for i in range(warmup):
+        await op(i)
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(warmup, warmup + ops):
+        t = time.perf_counter()
+        await op(i)
+        latencies.append((time.perf_counter() - t) * 1000)
+    elapsed = time.perf_counter() - started
+
+    allocs = []
+    tracemalloc.start()
+    try:
+        for i in range(warmup + ops, warmup + ops + alloc_ops):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            await op(i)
+            allocs.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ops": ops,
+        "ops_per_s": round(ops / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "alloc_kib": round(sum(allocs) / max(1, len(allocs)) / 1024, 1),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    problems = []
+    for key in ("p50_ms", "p95_ms"):
+        if result[key] > baseline[key] * (1 + tolerance) and result[key] - baseline[key] > NOISE_FLOOR_MS:
+            problems.append(f"{key} {baseline[key]} -> {result[key]}")
+    if result["ops_per_s"] < baseline["ops_per_s"] / (1 + tolerance):
+        problems.append(f"ops/s {baseline['ops_per_s']} -> {result['ops_per_s']}")
+    if result["alloc_kib"] > baseline["alloc_kib"] * (1 + tolerance) + 1:
+        problems.append(f"alloc {baseline['alloc_kib']} -> {result['alloc_kib']} KiB")
+    return problems
+
+
+async def run(args) -> int:
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    results = {}
+    regressions = 0
+    for size in args.sizes:
+        started = time.perf_counter()
+        env = Env(size, args.latency)
+        print(f"-- seeded {size} subscribers / ticket users in {time.perf_counter() - started:.1f} s")
+        print(f"{'scenario':<22}{'size':>9}{'ops':>6}{'ops/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'KiB/op':>9}")
+        for name in names:
+            factory, max_ops = SCENARIOS[name]
+            ops = min(args.ops, max_ops or args.ops)
+            result = await measure(factory(env), ops, min(ops, args.alloc_ops))
+            key = f"{name}@{size}"
+            results[key] = result
+            line = (f"{name:<22}{size:>9}{ops:>6}{result['ops_per_s']:>10}{result['p50_ms']:>9.3f}"
+                    f"{result['p95_ms']:>9.3f}{result['p99_ms']:>9.3f}{result['alloc_kib']:>9.1f}")
+            if key in baselines and not args.save_baseline:
+                problems = compare(result, baselines[key], args.tolerance)
+                if problems:
+                    regressions += 1
+                    line += "  REGRESSION: " + "; ".join(problems)
+            print(line)
+
+    if args.save_baseline:
+        baselines.update(results)
+        baselines["_machine"] = {"node": platform.node(), "python": platform.python_version(),
+                                 "processor": platform.processor() or platform.machine()}
+        with open(BASELINES_PATH, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"baselines saved to {BASELINES_PATH}")
+    elif regressions:
+        print(f"{regressions} regression(s) against {BASELINES_PATH} (tolerance {args.tolerance:.0%})")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=[10_000])
+    parser.add_argument("--ops", type=int, default=300)
+    parser.add_argument("--alloc-ops", type=int, default=30)
+    parser.add_argument("--only", default="")
+    parser.add_argument("--latency", type=float, default=0.0, help="имитация RTT Bot API, сек")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,252 @@
 import os
-import io
 import html
-from datetime import datetime
-from decimal import Decimal
+import json
+import math
+import time
+import statistics
+import bisect
+import asyncio
+import random
+import threading
+import functools
+from datetime import datetime, timezone, time as dtime
 from typing import Optional, List, Dict, Any
 
+BOOT_STARTED = time.perf_counter()
+
+import numpy as np
 import requests
 import psycopg2
 
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from sparkline import render_sparkline
+import metrics
+import logconfig
+import snapshot
+import storage
+from messages import LANGS, DEFAULT_LANG, msg, normalize_lang, format_price, price_decimals
 
 from telegram import (
     Update,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
+    InputMediaPhoto,
     ReplyKeyboardMarkup,
     KeyboardButton,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InputTextMessageContent,
 )
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
+    TypeHandler,
     ContextTypes,
     CallbackQueryHandler,
+    InlineQueryHandler,
     MessageHandler,
     filters,
 )
+from telegram.error import RetryAfter, Forbidden, BadRequest
+
+# ------------------ ЛОГИ ------------------
+
+# по логгеру на подсистему: уровни задаёт LOG_LEVELS="price=DEBUG,outbox=WARNING" (logconfig.py)
+log_startup = logconfig.get_logger("startup")
+log_db = logconfig.get_logger("db")
+log_price = logconfig.get_logger("price")
+log_chart = logconfig.get_logger("chart")
+log_outbox = logconfig.get_logger("outbox")
+log_users = logconfig.get_logger("users")
+log_payments = logconfig.get_logger("payments")
+log_memelandia = logconfig.get_logger("memelandia")
+log_leader = logconfig.get_logger("leader")
+log_digest = logconfig.get_logger("digest")
+log_stream = logconfig.get_logger("stream")
+log_profile = logconfig.get_logger("profile")
+log_handlers = logconfig.get_logger("handlers")
+log_snapshot = logconfig.get_logger("snapshot")
+log_changes = logconfig.get_logger("changes")
 
 # ------------------ ENV ------------------
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# без DATABASE_URL — встроенная база в файле (один процесс); пустая строка — без БД
+SQLITE_PATH = os.getenv("SQLITE_PATH", "tonmetric.db")
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "4"))  # свободных соединений с Postgres в пуле
+# несрочные записи копятся до WRITE_BUFFER_DELAY сек или WRITE_BUFFER_MAX строк
+WRITE_BUFFER_DELAY = float(os.getenv("WRITE_BUFFER_DELAY", "0.02"))
+WRITE_BUFFER_MAX = int(os.getenv("WRITE_BUFFER_MAX", "500"))
 CRYPTOBOT_TOKEN = os.getenv("CRYPTOBOT_TOKEN")
 
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN не задан в переменных окружения")
 
 if not CRYPTOBOT_TOKEN:
-    print("WARN: CRYPTOBOT_TOKEN не задан, покупка тикетов не будет работать")
+    log_payments.warning("CRYPTOBOT_TOKEN не задан, покупка тикетов не будет работать")
+
+# user_id администраторов через запятую (служебные команды)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+
+# /profile: окно профилирования, сек (по умолчанию / максимум) и порог медленного
+# колбэка, мс; порог не ниже 1 мс — иначе «медленным» оказывается каждый колбэк
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_SLOW_MS = max(1.0, float(os.getenv("PROFILE_SLOW_MS", "100")))
 
 # ------------------ BINANCE API ------------------
 
 BINANCE_TICKER = "https://api.binance.com/api/v3/ticker/price"
 BINANCE_KLINES = "https://api.binance.com/api/v3/klines"
-SYMBOL = "TONUSDT"
+SYMBOL = "TONUSDT"  # основной символ: кнопки меню и команды без аргумента
+QUOTE_ASSET = "USDT"
+# отслеживаемые пары; цены всех приходят одним батч-запросом тикера
+PRICE_SYMBOLS = list(dict.fromkeys(
+    [SYMBOL] + [s.strip().upper() for s in os.getenv("PRICE_SYMBOLS", "TONUSDT,BTCUSDT,ETHUSDT").split(",") if s.strip()]
+))
+PRICE_CACHE_TTL = 10  # сек: /price, графики и проверка алертов делят один снимок цен
+
+# ------------------ ПОТОК ЦЕН (WEBSOCKET) ------------------
+
+# aggTrade — каждая сделка (последняя цена), kline_1m — текущая минутная свеча
+PRICE_STREAM_ENABLED = os.getenv("PRICE_STREAM", "1") == "1"
+BINANCE_STREAM_URL = os.getenv("BINANCE_STREAM_URL", "wss://stream.binance.com:9443/stream")
+STREAM_STALE_AFTER = 30  # сек без сообщений — переподключаемся, цены снова берём по REST
+STREAM_RECONNECT_MIN = 1  # сек, удваивается до STREAM_RECONNECT_MAX
+STREAM_RECONNECT_MAX = 60
+
+# ------------------ ГРАФИКИ: ТАЙМФРЕЙМЫ ------------------
+
+CHART_POINT_BUDGET = 300  # точек на графике после даунсэмплинга
+CANDLE_SYNC_MIN_AGE = 30  # не чаще раза в N сек ходим за новыми 1m свечами
+# timeframe -> уровень архива, окно (сек), TTL готовой картинки (сек)
+CHART_TIMEFRAMES = {
+    "1d": {"level": "1m", "span": 86400, "ttl": 60},
+    "3d": {"level": "1h", "span": 72 * 3600, "ttl": 300},
+    "7d": {"level": "1h", "span": 7 * 86400, "ttl": 600},
+    "30d": {"level": "1h", "span": 30 * 86400, "ttl": 1800},
+    "1y": {"level": "1d", "span": 365 * 86400, "ttl": 3600},
+}
+DEFAULT_TIMEFRAME = "3d"  # прежний вид: 72 часа
+
+# ------------------ INLINE-РЕЖИМ ------------------
+
+# сколько Telegram кеширует ответ на одинаковый inline-запрос у себя
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "10"))
+# служебный чат (например, приватный канал с ботом): туда загружаем график,
+# чтобы получить file_id для inline-ответа, если в личке его ещё никто не открывал
+INLINE_CACHE_CHAT_ID = int(os.getenv("INLINE_CACHE_CHAT_ID", "0") or 0)
+
+# ------------------ ГРАФИКИ: ПРОФИЛИ ВЫВОДА ------------------
+
+# width — ширина в пикселях (высота — по пропорциям графика), colors — палитра PNG
+# (0 — без квантования), compress_level — zlib 0..9 (None — по умолчанию PIL),
+# quality — для jpeg/webp
+CHART_PROFILES = {
+    # прежний вывод: 9 дюймов x 250 DPI
+    "hd": {"width": 2250, "dpi": 250, "format": "png", "compress_level": None, "colors": 0, "quality": 90},
+    "standard": {"width": 1280, "dpi": 160, "format": "png", "compress_level": 6, "colors": 256, "quality": 90},
+    "compact": {"width": 960, "dpi": 120, "format": "jpeg", "compress_level": None, "colors": 0, "quality": 82},
+    "webp": {"width": 1280, "dpi": 160, "format": "webp", "compress_level": None, "colors": 0, "quality": 80},
+}
+
+
+def load_chart_profile() -> dict:
+    name = os.getenv("CHART_PROFILE", "hd")
+    if name not in CHART_PROFILES:
+        log_chart.warning("Unknown CHART_PROFILE, using 'hd'", extra={"profile": name})
+        name = "hd"
+    profile = dict(CHART_PROFILES[name], name=name)
+
+    # точечные переопределения для конкретного деплоя
+    overrides = {
+        "width": ("CHART_WIDTH", int),
+        "dpi": ("CHART_DPI", int),
+        "format": ("CHART_FORMAT", str),
+        "compress_level": ("CHART_PNG_COMPRESS", int),
+        "colors": ("CHART_PNG_COLORS", int),
+        "quality": ("CHART_QUALITY", int),
+    }
+    for key, (env, cast) in overrides.items():
+        raw = os.getenv(env)
+        if raw:
+            profile[key] = cast(raw)
+    if profile["format"] not in ("png", "jpeg", "webp"):
+        raise RuntimeError(f"CHART_FORMAT {profile['format']!r} не поддерживается")
+    return profile
+
+
+CHART_PROFILE = load_chart_profile()
+
+# 72h-вид рисуем без matplotlib (sparkline.py); matplotlib — для остальных
+CHART_FAST_PATH = os.getenv("CHART_FAST_PATH", "1") == "1"
+SPARKLINE_MAX_WIDTH = 1280  # Telegram всё равно ужимает фото до ~1280 px
+BINANCE_REF_CAPTION = "[Binance](https://www.binance.com/referral/earn-together/refer2earn-usdc/claim?hl=en&ref=GRO_28502_1C1WM&utm_source=default)"
+
+# ------------------ PRICE WATCH ------------------
+
+PRICE_ALERT_THRESHOLD = 0.10  # ±10% от base_price
+MAX_TARGETS_PER_USER = 20
+PRICE_CHECK_MIN_INTERVAL = int(os.getenv("PRICE_CHECK_MIN_INTERVAL", "30"))
+PRICE_CHECK_MAX_INTERVAL = int(os.getenv("PRICE_CHECK_MAX_INTERVAL", "900"))
+PRICE_CHECK_RETRY_INTERVAL = 60  # если Binance не ответил
+PRICE_CHECK_SIGMAS = 3.0  # запас в сигмах до ближайшего триггера
+VOLATILITY_WINDOW_HOURS = 24
+VOLATILITY_KLINES_TTL = 1800  # часовые свечи для волатильности, сек
+
+# ------------------ ALERT OUTBOX ------------------
+
+OUTBOX_POLL_INTERVAL = 5  # сек
+OUTBOX_BATCH_SIZE = 200
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE = 5  # сек, удваивается с каждой попыткой
+OUTBOX_BACKOFF_MAX = 900
+OUTBOX_SENDING_LEASE = 120  # зависшие в 'sending' после падения возвращаются в очередь
+OUTBOX_COMPLETE_CHUNK = 20  # отметки 'sent' коммитим по столько строк, не раз на пачку
+
+PROFILE_CACHE_TTL = 6 * 3600  # имена в лидерборде, сек
+
+# ------------------ ЕЖЕДНЕВНЫЙ ДАЙДЖЕСТ ------------------
+
+DIGEST_HOUR_UTC = int(os.getenv("DIGEST_HOUR_UTC", "9"))
+DIGEST_WINDOW = int(os.getenv("DIGEST_WINDOW", "1800"))  # сек: рассылку растягиваем на окно
+DIGEST_MAX_RATE = 25  # сообщений/сек — с запасом ниже глобального лимита Bot API (~30)
+DIGEST_TIMEFRAME = "1d"  # мини-график за сутки
+DIGEST_MOVERS = 3  # монет Мемляндии с самым сильным движением за 24h
+DIGEST_MOVERS_POOL = 20  # из скольких верхних монет выбираем
+DIGEST_MARK_BATCH = 200  # отметки «отправлено» пишем пачками
+
+# ------------------ ЛИДЕР И ШАРДЫ ------------------
+
+LEADER_LOCK_KEY = 0x746F6E6D  # advisory lock фоновых джобов ('tonm')
+LEADER_HEARTBEAT_INTERVAL = 10  # сек
+LEADER_LEASE = 30  # без успешного heartbeat дольше — лидерство потеряно
+LEADER_CONNECT_TIMEOUT = 5  # сек на подключение сессии замков: недоступный Postgres не держит heartbeat
+# >0 — подписчики делятся между репликами по хешу user_id
+PRICE_WATCH_SHARDS = int(os.getenv("PRICE_WATCH_SHARDS", "0"))
+WORKER_REPLICAS = max(1, int(os.getenv("WORKER_REPLICAS", "1")))
+SHARD_REBALANCE_AFTER = 300  # лишние (сверх честной доли) шарды отпускаем для новых реплик
+
+# ------------------ ЛЕНТА ИЗМЕНЕНИЙ (LISTEN/NOTIFY) ------------------
+# Записи одной реплики (подписки, цели, тикеты, рефералы, язык) рассылаются
+# остальным через NOTIFY; каждая реплика слушает канал на выделенном соединении
+# и точечно обновляет свои кеши и индекс триггеров.
+
+CHANGE_FEED_ENABLED = os.getenv("CHANGE_FEED", "1") == "1"
+CHANGE_CHANNEL = "tonmetric_changes"
+CHANGE_FEED_PING = 15  # сек: проверка, что сессия LISTEN жива
+REPLICA_ID = os.urandom(4).hex()  # свои события уже применены локально — пропускаем
+LEADERBOARD_SIZE = 100
+
+# ------------------ СНИМОК СОСТОЯНИЯ ------------------
+
+# тёплый рестарт: языки, цены, свечи, графики с file_id и имена лидерборда
+# пишутся в локальный файл при остановке и раз в SNAPSHOT_INTERVAL; "" — выключено
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "tonmetric_state.snap")
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "300"))  # сек
+SNAPSHOT_MAX_AGE = 24 * 3600  # снимок старше — поднимаем только языки пользователей
+SNAPSHOT_VERSION = 1  # поднимать при смене раскладки снимка: кеши чужой раскладки не поднимаем
 
 # ------------------ MEMELANDIA API ------------------
 
@@ -54,201 +256,145 @@ MEMELANDIA_API_URL = "https://memelandia.okhlopkov.com/api/leaderboard"
 
 CRYPTOPAY_API_URL = "https://pay.crypt.bot/api/"
 
+# ------------------ МЕТРИКИ ------------------
+
+# /metrics в формате Prometheus; 0 — без HTTP-эндпоинта (метрики всё равно копятся)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+HANDLER_SECONDS = metrics.Histogram(
+    "tonmetric_handler_seconds", "Время обработки апдейта", ("handler", "action"))
+HANDLER_ERRORS = metrics.Counter(
+    "tonmetric_handler_errors_total", "Исключения в хендлерах", ("handler", "action"))
+UPSTREAM_SECONDS = metrics.Histogram(
+    "tonmetric_upstream_seconds", "Запросы к внешним API", ("upstream", "method"))
+UPSTREAM_ERRORS = metrics.Counter(
+    "tonmetric_upstream_errors_total", "Ошибки внешних API", ("upstream", "method"))
+DB_SECONDS = metrics.Histogram("tonmetric_db_seconds", "DB-хелперы", ("op",))
+DB_ERRORS = metrics.Counter("tonmetric_db_errors_total", "Ошибки DB-хелперов", ("op",))
+CHART_RENDER_SECONDS = metrics.Histogram("tonmetric_chart_render_seconds", "Рендер графиков", ("chart",))
+CHART_BYTES = metrics.Histogram(
+    "tonmetric_chart_bytes", "Размер картинки графика", ("chart",), buckets=metrics.SIZE_BUCKETS)
+CACHE_REQUESTS = metrics.Counter(
+    "tonmetric_cache_requests_total", "Обращения к кешам: result=hit|miss", ("cache", "result"))
+PRICE_CHECK_SECONDS = metrics.Histogram("tonmetric_price_check_seconds", "Тик check_price_job")
+PRICE_CHECK_ALERTS = metrics.Histogram(
+    "tonmetric_price_check_alerts", "Уведомлений на тик (fan-out)", buckets=metrics.COUNT_BUCKETS)
+PRICE_CHECK_TRIGGERS = metrics.Gauge("tonmetric_price_check_triggers", "Триггеров в индексе", ("symbol",))
+PRICE_CHECK_DELAY = metrics.Gauge("tonmetric_price_check_delay_seconds", "Задержка до следующей проверки")
+OUTBOX_MESSAGES = metrics.Counter(
+    "tonmetric_outbox_messages_total", "Доставка уведомлений из outbox", ("result",))
+
+
+def db_op(func):
+    return metrics.timed(DB_SECONDS, DB_ERRORS, op=func.__name__)(func)
+
+
+def cache_hit(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def instrument_handler(name: str, action=None):
+    # action(update) -> ветка хендлера: кнопка футера, тип callback'а
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            label = action(update) if action else ""
+            user = update.effective_user
+            # всё, что залогируется внутри (и в задачах, созданных внутри), несёт user_id/handler/action
+            with logconfig.bind(user_id=user.id if user else None, handler=name, action=label):
+                try:
+                    with HANDLER_SECONDS.time(HANDLER_ERRORS, handler=name, action=label):
+                        return await func(update, context)
+                except Exception:
+                    log_handlers.error("Handler error", exc_info=True)
+                    raise
+                finally:
+                    log_handlers.debug("Update handled")
+        return wrapper
+    return decorator
+
 # ------------------ ЯЗЫК ------------------
 
 user_lang: dict[int, str] = {}  # user_id -> 'ru' | 'en' | 'uk'
 
 
 def get_user_language(user_id: int) -> str:
-    return user_lang.get(user_id, "ru")
-
-
-def text_lang_confirm(lang: str) -> str:
-    if lang == "en":
-        return "Language: English ✅\nLoading TON price and chart…"
-    elif lang == "uk":
-        return "Мова: Українська ✅\nЗавантажую курс та графік TON…"
-    else:
-        return "Язык: Русский ✅\nЗагружаю курс и график TON…"
-
-
-def text_price_ok(lang: str, price: float) -> str:
-    return f"1 TON = {price:.3f} $"
-
-
-def text_price_error(lang: str) -> str:
-    if lang == "en":
-        return "Can't get TON price now 🙈"
-    elif lang == "uk":
-        return "Не можу отримати курс TON 🙈"
-    else:
-        return "Не могу получить курс TON 🙈"
-
-
-def text_chart_build(lang: str) -> str:
-    if lang == "en":
-        return "Building TON chart… 📈"
-    elif lang == "uk":
-        return "Будую графік TON… 📈"
-    else:
-        return "Строю график TON… 📈"
+    return user_lang.get(user_id, DEFAULT_LANG)
 
 
-def text_chart_error(lang: str) -> str:
-    if lang == "en":
-        return "Can't build chart 🙈"
-    elif lang == "uk":
-        return "Не вдалося побудувати графік 🙈"
-    else:
-        return "Не удалось построить график 🙈"
+def coin_name(symbol: str) -> str:
+    return symbol[:-len(QUOTE_ASSET)] if symbol.endswith(QUOTE_ASSET) else symbol
 
 
-def text_menu_prompt(lang: str) -> str:
-    if lang == "en":
-        return "Choose an action:"
-    elif lang == "uk":
-        return "Оберіть дію:"
-    else:
-        return "Выберите действие:"
+def parse_symbol(value: Optional[str]) -> Optional[str]:
+    # "btc", "$BTC", "btcusdt" -> "BTCUSDT"; None — не отслеживаем
+    if not value:
+        return None
+    value = value.strip().lstrip("$").upper()
+    if not value.endswith(QUOTE_ASSET):
+        value += QUOTE_ASSET
+    return value if value in PRICE_SYMBOLS else None
 
 
-def text_subscribed(lang: str, base_price: float) -> str:
-    if lang == "en":
-        return (
-            f"Notifications are ON ✅\n\n"
-            f"We will notify you when TON price changes more than 10% "
-            f"from {base_price:.3f} $.\n\n"
-            f"To stop notifications, press «Unsubscribe»."
-        )
-    elif lang == "uk":
-        return (
-            f"Сповіщення увімкнено ✅\n\n"
-            f"Ми повідомимо, коли ціна TON зміниться більш ніж на 10% "
-            f"від {base_price:.3f} $.\n\n"
-            f"Щоб вимкнути сповіщення, натисніть «Відписатися»."
-        )
-    else:
-        return (
-            f"Уведомления включены ✅\n\n"
-            f"Мы сообщим, когда цена TON изменится более чем на 10% "
-            f"от {base_price:.3f} $.\n\n"
-            f"Чтобы выключить уведомления, нажмите «Отписаться»."
-        )
+# ------------------ ТЕКСТЫ ------------------
+# Шаблоны — в messages.py; здесь только тексты, которые собираются из нескольких сообщений.
 
+def text_prices(lang: str, prices: dict) -> str:
+    return "\n".join(
+        msg("price_ok", lang, coin=coin_name(s), price=prices[s]) for s in PRICE_SYMBOLS if s in prices
+    )
 
-def text_already_subscribed(lang: str) -> str:
-    if lang == "en":
-        return "Notifications are already ON ✅"
-    elif lang == "uk":
-        return "Сповіщення вже увімкнено ✅"
-    else:
-        return "Уведомления уже включены ✅"
 
+def text_price_usage(lang: str) -> str:
+    coins = " | ".join(coin_name(s).lower() for s in PRICE_SYMBOLS)
+    return msg("price_usage", lang, coins=coins, timeframes=" | ".join(CHART_TIMEFRAMES))
 
-def text_subscriptions_disabled(lang: str) -> str:
-    if lang == "en":
-        return "Notifications are temporarily unavailable 🙈"
-    elif lang == "uk":
-        return "Сповіщення тимчасово недоступні 🙈"
-    else:
-        return "Уведомления временно недоступны 🙈"
 
+def text_price_alert(lang: str, old: float, new: float, diff_percent: float, coin: str = "TON") -> str:
+    arrow = "⬆️" if new > old else "⬇️"
+    return msg("price_alert", lang, arrow=arrow, coin=coin, diff=diff_percent, old=old, new=new)
 
-def text_unsubscribed(lang: str) -> str:
-    if lang == "en":
-        return "Notifications are OFF ❌"
-    elif lang == "uk":
-        return "Сповіщення вимкнено ❌"
-    else:
-        return "Уведомления отключены ❌"
 
+def text_target_reached(lang: str, kind: str, target: float, new: float, coin: str = "TON") -> str:
+    arrow = "⬆️" if kind == "above" else "⬇️"
+    return msg("target_reached", lang, arrow=arrow, coin=coin, new=new, target=target)
 
-def text_price_alert(lang: str, old: float, new: float, diff_percent: float) -> str:
-    arrow = "⬆️" if new > old else "⬇️"
-    if lang == "en":
-        return (
-            f"{arrow} TON price changed by {diff_percent:.1f}%\n\n"
-            f"Was: {old:.3f} $\n"
-            f"Now: {new:.3f} $"
-        )
-    elif lang == "uk":
-        return (
-            f"{arrow} Ціна TON змінилася на {diff_percent:.1f}%\n\n"
-            f"Було: {old:.3f} $\n"
-            f"Зараз: {new:.3f} $"
-        )
-    else:
-        return (
-            f"{arrow} Цена TON изменилась на {diff_percent:.1f}%\n\n"
-            f"Было: {old:.3f} $\n"
-            f"Сейчас: {new:.3f} $"
-        )
 
+def format_target(lang: str, target: dict) -> str:
+    coin = coin_name(target["symbol"])
+    if target["kind"] == "pct":
+        return msg("target_pct", lang, coin=coin, value=target["value"], base=target["base_price"] or 0)
+    arrow = "≥" if target["kind"] == "above" else "≤"
+    return msg("target_level", lang, coin=coin, arrow=arrow, value=target["value"])
 
-def unsubscribe_button_text(lang: str) -> str:
-    if lang == "en":
-        return "Unsubscribe"
-    elif lang == "uk":
-        return "Відписатися"
-    else:
-        return "Отписаться"
 
+def text_target_added(lang: str, target: dict) -> str:
+    return msg("target_added", lang, id=target["id"], desc=format_target(lang, target))
 
-# -------- ТЕКСТЫ ДЛЯ МЕМЛЯНДИИ --------
 
-def text_memlandia_header(lang: str) -> str:
-    if lang == "en":
-        return "Top-5 Memelandia 🦄"
-    elif lang == "uk":
-        return "ТОП-5 Мемляндії 🦄"
-    else:
-        return "ТОП-5 Мемляндии 🦄"
+def text_targets_list(lang: str, targets: list[dict]) -> str:
+    if not targets:
+        return msg("targets_empty", lang)
+    lines = [msg("targets_header", lang), ""]
+    for target in targets:
+        lines.append(msg("targets_item", lang, id=target["id"], desc=format_target(lang, target)))
+    return "\n".join(lines)
 
 
-def text_memlandia_error(lang: str) -> str:
-    if lang == "en":
-        return "Can't get Memelandia data now 🙈"
-    elif lang == "uk":
-        return "Не вдалось отримати дані Мемляндії 🙈"
-    else:
-        return "Не удалось получить данные Мемляндии 🙈"
+def text_ticket_stats(lang: str, stats: dict) -> str:
+    return msg("ticket_stats", lang, tickets=stats["tickets"], total_ton=stats["total_ton"])
 
 
 # ------------------ ТЕКСТЫ КНОПОК ------------------
 
-BUTTON_TEXTS = {
-    "ru": {
-        "price_ton": "Курс $TON",
-        "notify": "Уведомления",
-        "wallet": "Кошелёк",
-        "referrals": "Рефералы",
-        "memland": "Мемляндия🦄",
-        "buy_tickets": "Купить тикеты 🎫",
-        "leaderboard": "🏆",
-    },
-    "en": {
-        "price_ton": "TON price $",
-        "notify": "Notifications",
-        "wallet": "Wallet",
-        "referrals": "Referrals",
-        "memland": "Memelandia🦄",
-        "buy_tickets": "Buy tickets 🎫",
-        "leaderboard": "🏆",
-    },
-    "uk": {
-        "price_ton": "Курс $TON",
-        "notify": "Сповіщення",
-        "wallet": "Гаманець",
-        "referrals": "Реферали",
-        "memland": "Мемляндія🦄",
-        "buy_tickets": "Купити квитки 🎫",
-        "leaderboard": "🏆",
-    },
-}
+BUTTON_KEYS = ("price_ton", "notify", "wallet", "referrals", "memland", "buy_tickets", "leaderboard")
+# собираем один раз: footer_buttons_handler сверяет с ними каждое сообщение
+BUTTON_TEXTS = {lang: {key: msg(f"btn_{key}", lang) for key in BUTTON_KEYS} for lang in LANGS}
 
 
 def get_button_texts(lang: str) -> dict:
-    return BUTTON_TEXTS.get(lang, BUTTON_TEXTS["ru"])
+    return BUTTON_TEXTS.get(lang) or BUTTON_TEXTS[normalize_lang(lang)]
 
 
 def footer_buttons(lang: str) -> ReplyKeyboardMarkup:
@@ -266,147 +412,232 @@ def footer_buttons(lang: str) -> ReplyKeyboardMarkup:
 
 # ------------------ РАБОТА С БД ------------------
 
+store: Optional[storage.Storage] = None  # открывается в main(): open_store()
+
+
 def has_db() -> bool:
-    return bool(DATABASE_URL)
+    return store is not None
+
 
+def open_store() -> Optional[storage.Storage]:
+    # Postgres, если задана DATABASE_URL; иначе встроенный SQLite (SQLITE_PATH="" — без БД)
+    if DATABASE_URL:
+        return storage.PostgresStorage(DATABASE_URL, channel=CHANGE_CHANNEL, pool_size=PG_POOL_SIZE,
+                                       encode=encode_changes if CHANGE_FEED_ENABLED else None)
+    if SQLITE_PATH:
+        return storage.SqliteStorage(SQLITE_PATH)
+    return None
 
-def get_conn():
-    if not DATABASE_URL:
-        raise RuntimeError("DATABASE_URL не задана")
-    return psycopg2.connect(DATABASE_URL)
 
+def encode_change(kind: str, fields: dict) -> str:
+    return json.dumps(dict(fields, e=kind, o=REPLICA_ID), separators=(",", ":"))
 
+
+def encode_changes(events: list) -> list:
+    # store шлёт их NOTIFY в транзакции записи: реплики получат события только
+    # после COMMIT, при откате — не получат вовсе
+    change_feed.stats["published"] += len(events)
+    return [encode_change(kind, fields) for kind, fields in events]
+
+
+@db_op
 def init_db():
-    if not DATABASE_URL:
-        print("DATABASE_URL не задана — подписки и тикеты отключены")
+    if not has_db():
+        log_db.warning("БД не настроена (DATABASE_URL и SQLITE_PATH пусты) — подписки и тикеты отключены")
         return
 
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            # подписки по цене
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS subscribers (
-                    user_id    BIGINT PRIMARY KEY,
-                    lang       TEXT NOT NULL,
-                    base_price NUMERIC,
-                    active     BOOLEAN NOT NULL DEFAULT TRUE,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                );
-                """
-            )
-            # тикеты и статистика
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS ticket_users (
-                    user_id       BIGINT PRIMARY KEY,
-                    total_ton     NUMERIC NOT NULL DEFAULT 0,
-                    total_tickets INTEGER NOT NULL DEFAULT 0,
-                    created_at    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                    updated_at    TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS ticket_invoices (
-                    invoice_id BIGINT PRIMARY KEY,
-                    user_id    BIGINT NOT NULL,
-                    tickets    INTEGER NOT NULL,
-                    amount_ton NUMERIC NOT NULL,
-                    status     TEXT   NOT NULL,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                );
-                """
-            )
-            # рефералы
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS referrals (
-                    referrer_id BIGINT NOT NULL,
-                    referred_id BIGINT PRIMARY KEY,
-                    created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                );
-                """
-            )
+    store.init()
+    log_db.info("DB: tables ensured", extra={"backend": store.name})
+
 
-    print("DB: tables ensured")
+def text_db_stats() -> str:
+    if not has_db():
+        return "БД: выключена"
+    line = f"БД: {store.name}"
+    if isinstance(store, storage.SqliteStorage):
+        st = store.stats
+        line += f", чтений {st['reads']}, записей {st['writes']} за {st['commits']} коммитов"
+    elif isinstance(store, storage.PostgresStorage):
+        st = store.stats
+        line += (f", соединений открыто {st['connects']} (в пуле {len(store.idle)}, сброшено {st['discarded']}), "
+                 f"запросов {st['executes']}, подготовлено {st['prepares']}")
+    st = write_buffer.stats
+    line += (f"\nБуфер записей: строк {st['rows']} (схлопнуто {st['coalesced']}), "
+             f"сбросов {st['flushes']}, ошибок {st['errors']}, выброшено строк {st['dropped']}")
+    return line
+
+
+class WriteBuffer:
+    # Несрочные записи копятся delay сек или до max_rows строк и уходят одним
+    # многострочным запросом на вид. Повтор ключа схлопывается: побеждает
+    # последняя строка, а для видов из keep_first — первая (как ON CONFLICT DO NOTHING).
+    # Чтения и прямые записи тех же таблиц сперва зовут flush(вид) — порядок
+    # операций в БД остаётся тем же, что без буфера. Без event loop пишем сразу;
+    # сброс по таймеру уходит в поток, чтобы запрос не держал event loop.
+    # Если пачка не записалась, пишем её по строке: строка с ошибкой в данных
+    # выбрасывается, а при недоступной базе строки возвращаются в буфер.
+
+    def __init__(self, delay: float, max_rows: int, flushers: dict, keep_first=()):
+        self.delay = delay
+        self.max_rows = max_rows
+        self.flushers = flushers  # вид -> fn(rows)
+        self.keep_first = set(keep_first)
+        self.pending: dict[str, dict] = {}  # вид -> ключ -> строка
+        self.size = 0
+        self.timer = None
+        self.urgent = False  # таймер поставлен на немедленный сброс
+        self.loop = None  # loop, на котором ставим таймер повторного сброса из потоков
+        self.lock = threading.Lock()  # pending/size/timer; запросы к БД под ним не идут
+        self.io_lock = threading.RLock()  # сбросы по очереди: flush(вид) ждёт и фоновый
+        self.stats = {"rows": 0, "coalesced": 0, "flushes": 0, "errors": 0, "dropped": 0}
+
+    def add(self, kind: str, key, row: tuple):
+        with self.lock:
+            rows = self.pending.setdefault(kind, {})
+            self.stats["rows"] += 1
+            if key in rows:
+                self.stats["coalesced"] += 1
+                if kind in self.keep_first:
+                    return
+            else:
+                self.size += 1
+            rows[key] = row
+            full = self.size >= self.max_rows
+        if not self.schedule(now=full):
+            self.flush()
+
+    def schedule(self, now: bool = False) -> bool:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        with self.lock:
+            self.loop = loop
+            if self.timer is not None and (self.urgent or not now):
+                return True
+            if self.timer is not None:
+                self.timer.cancel()
+            self.urgent = now
+            self.timer = loop.call_later(0 if now else self.delay, self.flush_in_thread)
+        return True
+
+    def flush_in_thread(self):
+        asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    def flush(self, *kinds: str):
+        # io_lock держим на время запроса: чтение после flush(вид) видит и то,
+        # что в этот момент дописывает фоновый сброс; add() запроса не ждёт
+        with self.io_lock:
+            with self.lock:
+                if not kinds:
+                    self.timer = None
+                    self.urgent = False
+                batches = []
+                for kind in kinds or list(self.pending):
+                    rows = self.pending.pop(kind, None)
+                    if rows:
+                        self.size -= len(rows)
+                        batches.append((kind, rows))
+            for kind, rows in batches:
+                self.write(kind, rows)
+
+    def write(self, kind: str, rows: dict):
+        flusher = self.flushers[kind]
+        try:
+            flusher(list(rows.values()))
+            self.stats["flushes"] += 1
+            return
+        except storage.UNAVAILABLE_ERRORS as e:
+            self.stats["errors"] += 1
+            log_db.error("Write buffer flush error", extra={"error": e, "kind": kind, "rows": len(rows)})
+            failed = rows
+        except Exception as e:
+            self.stats["errors"] += 1
+            log_db.error("Write buffer flush error, writing row by row",
+                         extra={"error": e, "kind": kind, "rows": len(rows)})
+            failed = {}
+            for key, row in rows.items():
+                try:
+                    flusher([row])
+                except storage.UNAVAILABLE_ERRORS:
+                    failed[key] = row
+                except Exception as row_error:
+                    self.stats["dropped"] += 1
+                    log_db.error("Write buffer row dropped", extra={"error": row_error, "kind": kind, "key": key})
+            self.stats["flushes"] += 1
+            if not failed:
+                return
+        self.requeue(kind, failed)
+
+    def requeue(self, kind: str, rows: dict):
+        # вернём в буфер до следующего сброса, не перетирая более свежие строки
+        with self.lock:
+            if self.size >= self.max_rows * 20:
+                self.stats["dropped"] += len(rows)
+                log_db.error("Write buffer overflow, rows dropped", extra={"kind": kind, "rows": len(rows)})
+                return
+            pending = self.pending.setdefault(kind, {})
+            for key, row in rows.items():
+                if key not in pending:
+                    pending[key] = row
+                    self.size += 1
+            loop = self.loop
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(self.schedule)
 
 
 # --- подписки по цене
 
-def subscribe_user_db(user_id: int, lang: str, base_price: float):
+@db_op
+def subscribe_user_db(user_id: int, lang: str, base_price: float, symbol: str = SYMBOL):
     if not has_db():
         return
 
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO subscribers (user_id, lang, base_price, active, created_at, updated_at)
-                VALUES (%s, %s, %s, TRUE, NOW(), NOW())
-                ON CONFLICT (user_id) DO UPDATE
-                SET lang = EXCLUDED.lang,
-                    base_price = EXCLUDED.base_price,
-                    active = TRUE,
-                    updated_at = NOW();
-                """,
-                (user_id, lang, base_price),
-            )
+    write_buffer.add("sub", (user_id, symbol), (user_id, symbol, lang, base_price))
+    index_subscriber(user_id, lang, base_price, symbol)
 
 
-def get_subscription(user_id: int):
+@db_op
+def get_subscription(user_id: int, symbol: str = SYMBOL):
     if not has_db():
         return None
 
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT user_id, lang, base_price, active FROM subscribers WHERE user_id = %s;",
-                (user_id,),
-            )
-            row = cur.fetchone()
-            if not row:
-                return None
+    write_buffer.flush("sub")
+    row = store.get_subscription(user_id, symbol)
+    if not row:
+        return None
 
-            return {
-                "user_id": row[0],
-                "lang": row[1],
-                "base_price": float(row[2]) if row[2] is not None else None,
-                "active": bool(row[3]),
-            }
+    return {
+        "user_id": row[0],
+        "symbol": symbol,
+        "lang": row[1],
+        "base_price": float(row[2]) if row[2] is not None else None,
+        "active": bool(row[3]),
+    }
 
 
-def unsubscribe_user_db(user_id: int):
+@db_op
+def unsubscribe_user_db(user_id: int, symbol: str = SYMBOL):
     if not has_db():
         return
 
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE subscribers SET active = FALSE, updated_at = NOW() WHERE user_id = %s;",
-                (user_id,),
-            )
+    write_buffer.flush("sub")
+    store.unsubscribe(user_id, symbol)
+    unindex(("sub", user_id, symbol))
 
 
+@db_op
 def get_active_subscribers():
     if not has_db():
         return []
 
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT user_id, lang, base_price FROM subscribers WHERE active = TRUE;"
-            )
-            rows = cur.fetchall()
-
+    write_buffer.flush("sub")
     result = []
-    for user_id, lang, base_price in rows:
+    for user_id, symbol, lang, base_price in store.active_subscribers():
         result.append(
             {
                 "user_id": int(user_id),
+                "symbol": symbol,
                 "lang": lang,
                 "base_price": float(base_price) if base_price is not None else None,
             }
@@ -414,111 +645,296 @@ def get_active_subscribers():
     return result
 
 
-def update_base_price(user_id: int, new_price: float):
+# --- пользовательские пороги и цели
+
+def _target_from_row(row) -> Dict[str, Any]:
+    return {
+        "id": int(row[0]),
+        "user_id": int(row[1]),
+        "lang": row[2],
+        "kind": row[3],
+        "value": float(row[4]),
+        "base_price": float(row[5]) if row[5] is not None else None,
+        "symbol": row[6],
+    }
+
+
+@db_op
+def add_price_target(user_id: int, lang: str, kind: str, value: float,
+                     base_price: Optional[float], symbol: str = SYMBOL) -> Optional[Dict[str, Any]]:
+    if not has_db():
+        return None
+
+    target = _target_from_row(store.add_target(user_id, lang, kind, value, base_price, symbol))
+    index_target(target)
+    return target
+
+
+@db_op
+def get_user_targets(user_id: int) -> List[Dict[str, Any]]:
+    if not has_db():
+        return []
+
+    return [_target_from_row(row) for row in store.user_targets(user_id)]
+
+
+@db_op
+def get_active_targets() -> List[Dict[str, Any]]:
+    if not has_db():
+        return []
+
+    return [_target_from_row(row) for row in store.active_targets()]
+
+
+@db_op
+def delete_user_targets(user_id: int, target_id: Optional[int] = None) -> int:
+    # target_id=None — удалить все цели пользователя
+    if not has_db():
+        return 0
+
+    removed = store.delete_targets(user_id, target_id)
+    for tid in removed:
+        unindex(("target", tid))
+    return len(removed)
+
+
+# --- очередь уведомлений (outbox)
+
+# index key -> idem_key для уведомлений, которые ещё не доставлены
+outbox_pending: dict = {}
+# index key -> idem_key эпизодов, чья строка уже есть в outbox и больше не уйдёт
+# (например, 'failed' после всех попыток): пока idem_key тот же, триггер не ставим
+# заново. Новая база у процентных триггеров даёт новый idem_key — и новый эпизод.
+outbox_muted: dict = {}
+
+
+def alert_idem_key(entry: dict) -> str:
+    # один триггер = одна запись: для процентных порогов эпизод задаёт base_price
+    kind = entry["kind"]
+    if kind == "sub":
+        return f"sub:{entry['symbol']}:{entry['user_id']}:{entry['base_price']:.8f}"
+    if kind == "pct":
+        return f"pct:{entry['id']}:{entry['base_price']:.8f}"
+    return f"{kind}:{entry['id']}"
+
+
+@db_op
+def enqueue_alerts(alerts: list[dict]) -> set:
+    # alerts: dict(idem_key, user_id, symbol, text, ref_kind, ref_id, old_base, new_base)
+    # -> idem_key действительно вставленных строк
+    if not has_db() or not alerts:
+        return set()
+
+    return set(store.enqueue_alerts([
+        (a["idem_key"], a["user_id"], a["symbol"], a["text"], a["ref_kind"], a["ref_id"],
+         a["old_base"], a["new_base"])
+        for a in alerts
+    ]))
+
+
+@db_op
+def claim_outbox_batch(limit: int = OUTBOX_BATCH_SIZE) -> List[Dict[str, Any]]:
+    if not has_db():
+        return []
+
+    if PRICE_WATCH_SHARDS > 0:
+        # outbox разбирает владелец шарда: он же поставил триггер в outbox_pending
+        # и после доставки должен снять пометку и сдвинуть базу в своём индексе
+        rows = store.claim_outbox(limit, OUTBOX_SENDING_LEASE, sorted(owned_shards()), PRICE_WATCH_SHARDS)
+    else:
+        rows = store.claim_outbox(limit, OUTBOX_SENDING_LEASE)
+    result = []
+    for row in sorted(rows):
+        result.append(
+            {
+                "id": int(row[0]),
+                "idem_key": row[1],
+                "user_id": int(row[2]),
+                "text": row[3],
+                "ref_kind": row[4],
+                "ref_id": int(row[5]),
+                "old_base": float(row[6]) if row[6] is not None else None,
+                "new_base": float(row[7]) if row[7] is not None else None,
+                "attempts": int(row[8]),
+                "symbol": row[9],
+            }
+        )
+    return result
+
+
+@db_op
+def complete_outbox_deliveries(delivered: list[dict]):
+    # одна транзакция: строки outbox -> sent и новые base_price/цели
+    if not has_db() or not delivered:
+        return
+
+    subs = [(d["ref_id"], d["symbol"], d["new_base"], d["old_base"]) for d in delivered if d["ref_kind"] == "sub"]
+    pcts = [(d["ref_id"], d["new_base"], d["old_base"]) for d in delivered if d["ref_kind"] == "pct"]
+    done = [d["ref_id"] for d in delivered if d["ref_kind"] in ("above", "below")]
+    write_buffer.flush("sub")
+    store.complete_outbox([d["id"] for d in delivered], subs, pcts, done)
+
+    for d in delivered:
+        settle_index_after_delivery(d)
+
+
+@db_op
+def fail_outbox_delivery(row: dict, error: str, retry_after: Optional[float] = None):
     if not has_db():
         return
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE subscribers SET base_price = %s, updated_at = NOW() WHERE user_id = %s;",
-                (new_price, user_id),
-            )
+
+    attempts = row["attempts"] + 1
+    if retry_after is not None:
+        delay = retry_after
+    else:
+        delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+    status = "failed" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+
+    store.fail_outbox(row["id"], status, attempts, error[:500], delay)
+
+    if status == "failed":
+        key = _outbox_index_key(row)
+        outbox_pending.pop(key, None)
+        outbox_muted[key] = row["idem_key"]
+
+
+@db_op
+def release_outbox_rows(rows: list[dict], delay: float):
+    if not has_db() or not rows:
+        return
+
+    store.release_outbox([r["id"] for r in rows], delay)
+
+
+@db_op
+def get_pending_outbox() -> list:
+    if not has_db():
+        return []
+
+    return store.pending_outbox()
+
+
+def load_outbox_pending(rows: Optional[list] = None):
+    if not has_db():
+        return
+
+    if rows is None:
+        rows = get_pending_outbox()
+    outbox_pending.clear()
+    for idem_key, ref_kind, ref_id, symbol in rows:
+        row = {"ref_kind": ref_kind, "ref_id": int(ref_id), "symbol": symbol}
+        outbox_pending[_outbox_index_key(row)] = idem_key
+
+
+@db_op
+def deactivate_unreachable_users(user_ids: list[int]):
+    # пользователь заблокировал бота или удалил аккаунт
+    if not has_db() or not user_ids:
+        return
+
+    write_buffer.flush("sub")
+    pruned = store.deactivate_users(user_ids)
+    unreachable_stats["pruned_subscribers"] += len(pruned["subs"])
+    unreachable_stats["pruned_targets"] += len(pruned["targets"])
+    unreachable_stats["dropped_alerts"] += pruned["dropped_alerts"]
+    unreachable_stats["pruned_digests"] += pruned["pruned_digests"]
+
+    keys = [("sub", user_id, symbol) for user_id, symbol in pruned["subs"]]
+    keys += [("target", target_id) for target_id in pruned["targets"]]
+    for key in keys:
+        unindex(key)
+        outbox_pending.pop(key, None)
+
+
+# --- дайджест
+
+@db_op
+def set_digest_subscription(user_id: int, lang: str, active: bool):
+    if not has_db():
+        return
+
+    store.set_digest(user_id, lang, active)
+
+
+@db_op
+def get_digest_recipients(day) -> List[tuple]:
+    # [(user_id, lang)] — кому сегодняшний дайджест ещё не ушёл
+    if not has_db():
+        return []
+
+    return [(int(user_id), lang) for user_id, lang in store.digest_recipients(day)]
+
+
+@db_op
+def mark_digest_sent(user_ids: list[int], day):
+    if not has_db() or not user_ids:
+        return
+
+    store.mark_digest_sent(user_ids, day)
 
 
 # --- тикеты
 
+@db_op
 def add_tickets_to_user(user_id: int, tickets: int, amount_ton: float):
     if not has_db():
         return
 
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO ticket_users (user_id, total_ton, total_tickets, created_at, updated_at)
-                VALUES (%s, %s, %s, NOW(), NOW())
-                ON CONFLICT (user_id) DO UPDATE
-                SET total_ton = ticket_users.total_ton + EXCLUDED.total_ton,
-                    total_tickets = ticket_users.total_tickets + EXCLUDED.total_tickets,
-                    updated_at = NOW();
-                """,
-                (user_id, Decimal(str(amount_ton)), tickets),
-            )
+    total_tickets, total_ton = store.add_tickets(user_id, tickets, amount_ton)
+    apply_tickets_change(user_id, total_tickets, total_ton)
 
 
+@db_op
 def save_invoice(invoice_id: int, user_id: int, tickets: int, amount_ton: float, status: str):
     if not has_db():
         return
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO ticket_invoices (invoice_id, user_id, tickets, amount_ton, status)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (invoice_id) DO UPDATE
-                SET status = EXCLUDED.status,
-                    updated_at = NOW();
-                """,
-                (invoice_id, user_id, tickets, Decimal(str(amount_ton)), status),
-            )
+    row = (invoice_id, user_id, tickets, amount_ton, status)
+    if status != "paid":
+        write_buffer.add("invoice", invoice_id, row)
+        return
+    # оплата — рядом с зачислением тикетов: пишем сразу, после отложенного создания
+    write_buffer.flush("invoice")
+    store.save_invoices([row])
+
 
+@db_op
+def get_invoice_status(invoice_id: int) -> Optional[str]:
+    if not has_db():
+        return None
+    write_buffer.flush("invoice")
+    return store.invoice_status(invoice_id)
 
+
+@db_op
 def mark_invoice_paid(invoice_id: int):
     if not has_db():
         return
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE ticket_invoices SET status = 'paid', updated_at = NOW() WHERE invoice_id = %s;",
-                (invoice_id,),
-            )
+    store.mark_invoice_paid(invoice_id)
 
 
+@db_op
 def get_user_ticket_stats(user_id: int) -> Dict[str, float]:
     if not has_db():
         return {"tickets": 0, "total_ton": 0.0}
 
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT total_tickets, total_ton
-                FROM ticket_users
-                WHERE user_id = %s;
-                """,
-                (user_id,),
-            )
-            row = cur.fetchone()
-            if not row:
-                return {"tickets": 0, "total_ton": 0.0}
+    row = store.ticket_stats(user_id)
+    if not row:
+        return {"tickets": 0, "total_ton": 0.0}
 
-            tickets, total_ton = row
-            return {
-                "tickets": int(tickets),
-                "total_ton": float(total_ton or 0),
-            }
+    tickets, total_ton = row
+    return {
+        "tickets": int(tickets),
+        "total_ton": float(total_ton or 0),
+    }
 
 
+@db_op
 def get_leaderboard(limit: int = 100) -> List[Dict[str, Any]]:
     if not has_db():
         return []
 
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT user_id, total_tickets, total_ton
-                FROM ticket_users
-                WHERE total_ton > 0
-                ORDER BY total_ton DESC
-                LIMIT %s;
-                """,
-                (limit,),
-            )
-            rows = cur.fetchall()
-
     result = []
-    for user_id, total_tickets, total_ton in rows:
+    for user_id, total_tickets, total_ton in store.leaderboard(limit):
         result.append(
             {
                 "user_id": int(user_id),
@@ -531,65 +947,63 @@ def get_leaderboard(limit: int = 100) -> List[Dict[str, Any]]:
 
 # --- рефералы
 
+@db_op
 def add_referral(referrer_id: int, referred_id: int):
     if not has_db():
         return
     if referrer_id == referred_id:
         return
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO referrals (referrer_id, referred_id)
-                VALUES (%s, %s)
-                ON CONFLICT (referred_id) DO NOTHING;
-                """,
-                (referrer_id, referred_id),
-            )
+    write_buffer.add("referral", referred_id, (referrer_id, referred_id))
 
 
+def flush_referrals(rows: list):
+    for referrer_id, count in store.add_referrals(rows).items():
+        apply_referral_change(int(referrer_id), int(count))
+
+
+@db_op
 def get_user_referral_count(user_id: int) -> int:
     if not has_db():
         return 0
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT COUNT(*) FROM referrals WHERE referrer_id = %s;",
-                (user_id,),
-            )
-            row = cur.fetchone()
-            return int(row[0]) if row else 0
+    write_buffer.flush("referral")
+    return int(store.referral_count(user_id))
 
 
+@db_op
 def get_top_referrer() -> Optional[Dict[str, Any]]:
     if not has_db():
         return None
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT referrer_id, COUNT(*) AS cnt
-                FROM referrals
-                GROUP BY referrer_id
-                ORDER BY cnt DESC
-                LIMIT 1;
-                """
-            )
-            row = cur.fetchone()
-            if not row:
-                return None
-            return {"referrer_id": int(row[0]), "count": int(row[1])}
+    write_buffer.flush("referral")
+    row = store.top_referrer()
+    if not row:
+        return None
+    return {"referrer_id": int(row[0]), "count": int(row[1])}
+
+
+# ключ подписки — (user_id, symbol), счёта — invoice_id, реферала — referred_id:
+# реферал засчитывается первому пригласившему
+write_buffer = WriteBuffer(
+    WRITE_BUFFER_DELAY,
+    WRITE_BUFFER_MAX,
+    flushers={
+        "sub": lambda rows: store.subscribe_many(rows),
+        "invoice": lambda rows: store.save_invoices(rows),
+        "referral": flush_referrals,
+    },
+    keep_first=("referral",),
+)
 
 
 # ------------------ MEMELANDIA HELPERS ------------------
 
 def fetch_memelandia_top(limit: int = 5):
     try:
-        r = requests.get(MEMELANDIA_API_URL, timeout=10)
-        r.raise_for_status()
-        data = r.json()
+        with UPSTREAM_SECONDS.time(UPSTREAM_ERRORS, upstream="memelandia", method="leaderboard"):
+            r = requests.get(MEMELANDIA_API_URL, timeout=10)
+            r.raise_for_status()
+            data = r.json()
     except Exception as e:
-        print("Memelandia API error:", e)
+        log_memelandia.warning("Memelandia API error", extra={"error": e})
         return None
 
     items = None
@@ -609,7 +1023,7 @@ def fetch_memelandia_top(limit: int = 5):
                     break
 
     if not items:
-        print("Memelandia: no items in response")
+        log_memelandia.warning("Memelandia: no items in response")
         return None
 
     if any(isinstance(x, dict) and "rank" in x for x in items):
@@ -679,199 +1093,631 @@ def fetch_memelandia_top(limit: int = 5):
 
 
 def format_memelandia_top(lang: str, coins: list[dict]) -> str:
-    header = text_memlandia_header(lang)
-    lines = [header, ""]
+    lines = [msg("memelandia_header", lang), ""]
 
     for c in coins:
-        idx = c["index"]
-        sym = c["symbol"]
-        price = c["price"]
+        parts = [msg("memelandia_coin", lang, idx=c["index"], symbol=c["symbol"], price=c["price"],
+                     ch24=c["change_24"], ch7=c["change_7d"])]
+        if c["holders"] is not None:
+            parts.append(msg("memelandia_holders", lang, holders=c["holders"]))
+        if c["market_cap"] is not None and c["market_cap"] > 0:
+            parts.append(msg("memelandia_mcap", lang, mcap=c["market_cap"]))
+        lines.append("\n".join(parts))
 
-        ch24 = c["change_24"]
-        ch7 = c["change_7d"]
-        holders = c["holders"]
-        mc = c["market_cap"]
+    return "\n".join(lines)
 
-        def fmt_pct(x: float) -> str:
-            sign = "+" if x > 0 else ""
-            return f"{sign}{x:.1f}%"
 
-        line = f"{idx}. {sym}\n"
-        line += f"   price: {price:.6f} $\n"
-        line += f"   24h: {fmt_pct(ch24)}, 7d: {fmt_pct(ch7)}\n"
+# chart name -> последний рендер: размер, время, формат
+chart_render_stats: dict[str, dict] = {}
 
-        if holders is not None:
-            line += f"   holders: {holders}\n"
-        if mc is not None and mc > 0:
-            line += f"   mcap: {mc:,.0f} $\n"
 
-        lines.append(line.rstrip())
+def record_chart_render(name: str, img: bytes, started: float):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    CHART_RENDER_SECONDS.observe(elapsed_ms / 1000, chart=name)
+    CHART_BYTES.observe(len(img), chart=name)
+    stats = chart_render_stats.setdefault(name, {"count": 0})
+    stats["count"] += 1
+    stats["bytes"] = len(img)
+    stats["ms"] = round(elapsed_ms, 1)
+    stats["profile"] = CHART_PROFILE["name"]
+    stats["format"] = CHART_PROFILE["format"]
+    if stats["count"] == 1:
+        log_chart.info("Chart rendered", extra={"chart": name, "bytes": len(img), "render_ms": round(elapsed_ms),
+                                                "profile": CHART_PROFILE["name"]})
 
-    return "\n".join(lines)
 
+def text_chart_stats() -> str:
+    lines = [f"Chart profile: {CHART_PROFILE['name']} ({CHART_PROFILE['width']}px @ {CHART_PROFILE['dpi']} DPI, {CHART_PROFILE['format']})"]
+    for name, stats in chart_render_stats.items():
+        lines.append(f"{name}: {stats['bytes'] / 1024:.0f} KiB, {stats['ms']} ms, renders: {stats['count']}")
+    return "\n".join(lines)
 
-def create_memelandia_bar_chart(coins: list[dict]) -> bytes:
-    labels = [c["symbol"] for c in coins]
-    values = [c["change_24"] for c in coins]
 
-    colors = ["#EF4444" if v < 0 else "#22C55E" for v in values]
+memelandia_renderer = None
 
-    fig, ax = plt.subplots(figsize=(9, 5), dpi=250)
-    fig.patch.set_facecolor("#FFFFFF")
-    ax.set_facecolor("#F5FAFF")
 
-    positions = range(len(labels))
-    ax.barh(positions, values, color=colors)
-    ax.set_yticks(positions)
-    ax.set_yticklabels(labels)
+def get_charts():
+    # matplotlib грузится только здесь: при первом сложном графике или в прогреве
+    import charts
 
-    ax.axvline(0, color="#9CA3AF", linewidth=0.8)
-    ax.set_xlabel("24h %")
-    ax.set_title("Memelandia Top-5 — 24h change")
+    return charts
 
-    for i, v in enumerate(values):
-        ax.text(v + (0.3 if v >= 0 else -0.3), i, f"{v:+.1f}%", va="center",
-                ha="left" if v >= 0 else "right", fontsize=8)
 
-    fig.tight_layout()
+renderers_lock = threading.Lock()
+# рендерят только потоки (хендлеры через asyncio.to_thread, inline, дайджест,
+# прогрев): фигуры matplotlib переиспользуются — рисуем по одному. Event loop
+# этот замок не берёт, сеть под ним не ходит.
+render_lock = threading.RLock()
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight")
-    plt.close()
-    buf.seek(0)
-    return buf.getvalue()
 
+def get_memelandia_renderer():
+    global memelandia_renderer
+    with renderers_lock:
+        if memelandia_renderer is None:
+            memelandia_renderer = get_charts().MemelandiaChartRenderer(CHART_PROFILE)
+        return memelandia_renderer
 
-# ------------------ ДАННЫЕ TON ------------------
 
-def get_ton_price_usd() -> Optional[float]:
-    try:
-        r = requests.get(BINANCE_TICKER, params={"symbol": SYMBOL}, timeout=8)
-        data = r.json()
-        return float(data["price"])
-    except Exception as e:
-        print("Price error:", e)
-        return None
+def get_price_renderer():
+    # одна фигура на все символы: данные и подпись меняются на каждый рендер
+    global price_renderer
+    with renderers_lock:
+        if price_renderer is None:
+            price_renderer = get_charts().PriceChartRenderer(CHART_PROFILE)
+        return price_renderer
 
 
-def get_ton_history(hours: int = 72):
-    try:
-        r = requests.get(
-            BINANCE_KLINES,
-            params={"symbol": SYMBOL, "interval": "1h", "limit": hours},
-            timeout=10,
-        )
-        klines = r.json()
-        if not isinstance(klines, list):
-            return [], []
+def prewarm_charts():
+    # фон: импорт matplotlib, шрифты и первый (выброшенный) рендер каждого шаблона
+    started = time.perf_counter()
+    now_ms = int(time.time() * 1000)
+    times = (np.arange(72, dtype=np.int64) * 3_600_000 + now_ms).astype("datetime64[ms]")
+    prices = 1.0 + np.sin(np.arange(72) / 8.0) * 0.05
+    with render_lock:
+        get_price_renderer().render(times, prices, "1 TON = 1.000 $")
+        get_memelandia_renderer().render([{"symbol": "TON", "change_24": 1.0}])
+    render_sparkline(times.astype(np.int64), prices, label="1 TON = 1.000 $")
+    return (time.perf_counter() - started) * 1000
 
-        times = [datetime.fromtimestamp(k[0] / 1000) for k in klines]
-        prices = [float(k[4]) for k in klines]
-        return times, prices
-    except Exception as e:
-        print("History error:", e)
-        return [], []
 
+def create_memelandia_bar_chart(coins: list[dict]) -> bytes:
+    started = time.perf_counter()
+    with render_lock:
+        img = get_memelandia_renderer().render(coins)
+    record_chart_render("memelandia", img, started)
+    return img
+
+
+# ------------------ ЦЕНЫ (BINANCE) ------------------
+
+class PriceService:
+    # Один снимок цен на все символы: тикер Binance принимает список symbols,
+    # поэтому новая монета не добавляет запросов на каждый тик.
+
+    def __init__(self, symbols: list[str], ttl: float = PRICE_CACHE_TTL):
+        self.symbols = list(symbols)
+        self.ttl = ttl
+        self.prices: dict[str, float] = {}
+        self.fetched_at = 0.0
+        self.streamed_at = 0.0  # последнее событие из websocket-потока
+        self.lock = threading.Lock()  # только снимок: update() зовут на event loop
+        self.fetch_lock = threading.Lock()  # один запрос тикера за раз
+        self.stats = {"requests": 0, "errors": 0}
+
+    def fetch(self) -> dict[str, float]:
+        self.stats["requests"] += 1
+        params = {"symbols": json.dumps(self.symbols, separators=(",", ":"))}
+        with UPSTREAM_SECONDS.time(UPSTREAM_ERRORS, upstream="binance", method="ticker"):
+            r = requests.get(BINANCE_TICKER, params=params, timeout=8)
+            data = r.json()
+            if not isinstance(data, list):
+                # неизвестный символ в списке ломает весь батч — видно по msg
+                raise RuntimeError(f"ticker error: {data}")
+        return {item["symbol"]: float(item["price"]) for item in data}
+
+    def update(self, symbol: str, price: float):
+        # цена из потока: пока поток жив, REST не нужен
+        with self.lock:
+            self.prices[symbol] = price
+            self.streamed_at = time.monotonic()
+
+    def streaming(self) -> bool:
+        return time.monotonic() - self.streamed_at < STREAM_STALE_AFTER
+
+    def stale(self, max_age: Optional[float] = None) -> bool:
+        # get_all(max_age) пойдёт в REST
+        max_age = self.ttl if max_age is None else max_age
+        fresh = self.streaming() and len(self.prices) == len(self.symbols)
+        return not fresh and time.monotonic() - self.fetched_at >= max_age
+
+    def get_all(self, max_age: Optional[float] = None) -> dict[str, float]:
+        # {} — Binance не ответил, а снимок устарел. Может сходить в REST:
+        # из async-джобов — через asyncio.to_thread
+        max_age = self.ttl if max_age is None else max_age
+        with self.lock:
+            fetch = self.stale(max_age)
+            cache_hit("prices", not fetch)
+            if not fetch:
+                return dict(self.prices)
+
+        # запрос — без self.lock: update() из потока цен его не ждёт
+        with self.fetch_lock:
+            with self.lock:
+                if not self.stale(max_age):
+                    return dict(self.prices)  # пока ждали, снимок обновил другой поток
+            try:
+                prices = self.fetch()
+            except Exception as e:
+                self.stats["errors"] += 1
+                log_price.warning("Price error", extra={"error": e})
+                return {}
+            with self.lock:
+                self.prices = prices
+                self.fetched_at = time.monotonic()
+                return dict(self.prices)
 
-# ------------------ ГРАФИК TON ------------------
+    def get(self, symbol: str = SYMBOL) -> Optional[float]:
+        return self.get_all().get(symbol)
 
-def create_ton_chart() -> bytes:
-    times, prices = get_ton_history(72)
-    if not times or not prices:
-        raise RuntimeError("No chart data")
 
-    current_price = prices[-1]
+price_service = PriceService(PRICE_SYMBOLS)
 
-    plt.style.use("default")
-    fig, ax = plt.subplots(figsize=(9, 6), dpi=250)
 
-    fig.patch.set_facecolor("#FFFFFF")
-    ax.set_facecolor("#F5FAFF")
+def get_price_usd(symbol: str = SYMBOL) -> Optional[float]:
+    return price_service.get(symbol)
 
-    line_color = "#3B82F6"
-    ax.plot(times, prices, linewidth=2.3, color=line_color)
-    ax.fill_between(times, prices, min(prices), color=line_color, alpha=0.22)
 
-    ax.grid(True, linewidth=0.3, alpha=0.25)
+def fetch_klines(interval: str, limit: int, start_time: Optional[int] = None, symbol: str = SYMBOL) -> list:
+    params = {"symbol": symbol, "interval": interval, "limit": limit}
+    if start_time is not None:
+        params["startTime"] = start_time
+    try:
+        with UPSTREAM_SECONDS.time(UPSTREAM_ERRORS, upstream="binance", method="klines"):
+            r = requests.get(BINANCE_KLINES, params=params, timeout=10)
+            klines = r.json()
+            if not isinstance(klines, list):
+                raise RuntimeError(f"klines error: {klines}")
+        return klines
+    except Exception as e:
+        log_price.warning("History error", extra={"error": e})
+        return []
 
-    ax.spines["top"].set_visible(False)
-    ax.spines["right"].set_visible(False)
-    ax.spines["bottom"].set_color("#D0D7E2")
-    ax.spines["left"].set_color("#D0D7E2")
 
-    ax.tick_params(axis="x", colors="#6B7280", labelsize=8)
-    ax.tick_params(axis="y", colors="#6B7280", labelsize=8)
+# ------------------ АРХИВ СВЕЧЕЙ ------------------
 
-    fig.text(
-        0.01, -0.04, f"1 TON = {current_price:.3f} $", fontsize=12, color="#111827", ha="left"
-    )
+LEVEL_MS = {"1m": 60_000, "1h": 3_600_000, "1d": 86_400_000}
+LEVEL_KEEP = {"1m": 2 * 1440, "1h": 32 * 24, "1d": 400}  # сколько свечей храним
+LEVEL_SEED = {"1m": 1000, "1h": 32 * 24, "1d": 400}  # лимит одного запроса к Binance при старте
 
-    fig.tight_layout(pad=1.5)
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight")
-    plt.close()
-    buf.seek(0)
-    return buf.getvalue()
+def empty_candles() -> dict:
+    return {
+        "t": np.empty(0, dtype=np.int64),
+        "o": np.empty(0),
+        "h": np.empty(0),
+        "l": np.empty(0),
+        "c": np.empty(0),
+    }
 
 
-# ----------- ОТПРАВКА ЦЕНЫ + ГРАФИКА ------------
+def candles_from_klines(klines: list) -> dict:
+    if not klines:
+        return empty_candles()
+    arr = np.array([k[:5] for k in klines], dtype=np.float64)
+    return {
+        "t": arr[:, 0].astype(np.int64),
+        "o": arr[:, 1],
+        "h": arr[:, 2],
+        "l": arr[:, 3],
+        "c": arr[:, 4],
+    }
 
-async def send_price_and_chart(chat_id: int, lang: str, context: ContextTypes.DEFAULT_TYPE):
-    price = get_ton_price_usd()
-    if price is None:
-        await context.bot.send_message(chat_id, text_price_error(lang))
-        return
 
-    await context.bot.send_message(chat_id, text_price_ok(lang, price))
+def rollup_candles(candles: dict, bucket_ms: int) -> dict:
+    # OHLC одного уровня -> более крупный; вход отсортирован по времени
+    if len(candles["t"]) == 0:
+        return empty_candles()
+    buckets = candles["t"] // bucket_ms * bucket_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+    return {
+        "t": buckets[starts],
+        "o": candles["o"][starts],
+        "h": np.maximum.reduceat(candles["h"], starts),
+        "l": np.minimum.reduceat(candles["l"], starts),
+        "c": candles["c"][ends],
+    }
 
-    try:
-        img = create_ton_chart()
-        await context.bot.send_photo(
-            chat_id,
-            img,
-            caption="[Binance](https://www.binance.com/referral/earn-together/refer2earn-usdc/claim?hl=en&ref=GRO_28502_1C1WM&utm_source=default)",
-            parse_mode="Markdown",
-        )
-    except Exception as e:
-        print("Chart error:", e)
-        await context.bot.send_message(chat_id, text_chart_error(lang))
 
+def merge_candles(old: dict, new: dict, keep: int) -> dict:
+    # new начинается не раньше последней свечи old; перекрытие сливаем по OHLC
+    if len(new["t"]) == 0:
+        return old
+    if len(old["t"]) == 0:
+        return {k: v[-keep:] for k, v in new.items()}
+
+    cut = np.searchsorted(old["t"], new["t"][0])
+    head = {k: v[:cut] for k, v in old.items()}
+    if cut < len(old["t"]) and old["t"][cut] == new["t"][0]:
+        # незакрытая свеча: open оставляем старый, экстремумы объединяем
+        new = {k: v.copy() for k, v in new.items()}
+        new["o"][0] = old["o"][cut]
+        new["h"][0] = max(new["h"][0], old["h"][cut:].max())
+        new["l"][0] = min(new["l"][0], old["l"][cut:].min())
+
+    return {k: np.concatenate([head[k], new[k]])[-keep:] for k in head}
+
+
+class CandleArchive:
+    # Локальный архив одного символа: 1m берём у Binance инкрементально,
+    # 1h и 1d досчитываются из новых минут без повторной загрузки истории.
+
+    def __init__(self, symbol: str = SYMBOL):
+        self.symbol = symbol
+        self.levels = {level: empty_candles() for level in LEVEL_MS}
+        self.synced_at = 0.0
+        # lock — только на правку levels (apply_kline зовут на event loop);
+        # sync_lock — один поход в REST за раз, замок данных на время сети не держим
+        self.lock = threading.RLock()
+        self.sync_lock = threading.Lock()
+
+    def seed(self):
+        levels = {}
+        for level in LEVEL_MS:
+            levels[level] = candles_from_klines(fetch_klines(level, LEVEL_SEED[level], symbol=self.symbol))
+
+        # 1m: Binance отдаёт максимум 1000 свечей, а для «1d» нужны сутки целиком
+        start = int(time.time() * 1000) - LEVEL_KEEP["1m"] // 2 * LEVEL_MS["1m"]
+        klines = []
+        while True:
+            page = fetch_klines("1m", LEVEL_SEED["1m"], start_time=start, symbol=self.symbol)
+            klines.extend(page)
+            if len(page) < LEVEL_SEED["1m"]:
+                break
+            start = int(page[-1][0]) + LEVEL_MS["1m"]
+        if klines:
+            levels["1m"] = candles_from_klines(klines)
+        with self.lock:
+            self.levels.update(levels)
+
+    def stale(self, max_age: float = CANDLE_SYNC_MIN_AGE) -> bool:
+        # sync(max_age) пойдёт в REST
+        return time.monotonic() - self.synced_at >= max_age
+
+    def sync(self, max_age: float = CANDLE_SYNC_MIN_AGE):
+        if not self.stale(max_age):
+            return
+        with self.sync_lock:
+            self._sync(max_age)
+
+    def _sync(self, max_age: float):
+        now = time.monotonic()
+        if now - self.synced_at < max_age:
+            return  # пока ждали замок, досинхронизировал другой поток
+
+        minutes = self.levels["1m"]
+        if len(minutes["t"]) == 0:
+            self.seed()
+            if len(self.levels["1m"]["t"]):
+                self.synced_at = now
+            return
 
-# ------------------ CryptoPay helpers ------------------
+        last = int(minutes["t"][-1])
+        gap_minutes = (time.time() * 1000 - last) / LEVEL_MS["1m"]
+        if gap_minutes >= LEVEL_SEED["1m"]:
+            # долго не синхронизировались — дешевле перезалить всё
+            self.seed()
+            self.synced_at = now
+            return
 
-def cryptopay_request(method: str, data: Optional[dict] = None) -> dict:
-    if not CRYPTOBOT_TOKEN:
-        raise RuntimeError("CRYPTOBOT_TOKEN not set")
+        fresh = candles_from_klines(fetch_klines("1m", LEVEL_SEED["1m"], start_time=last, symbol=self.symbol))
+        if len(fresh["t"]) == 0:
+            return
 
-    url = CRYPTOPAY_API_URL + method
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
-        "Content-Type": "application/json",
-    }
+        with self.lock:
+            self._merge_minutes(fresh)
+            self.synced_at = now
+
+    def _merge_minutes(self, fresh: dict):
+        self.levels["1m"] = merge_candles(self.levels["1m"], fresh, LEVEL_KEEP["1m"])
+        hours = rollup_candles(fresh, LEVEL_MS["1h"])
+        self.levels["1h"] = merge_candles(self.levels["1h"], hours, LEVEL_KEEP["1h"])
+        days = rollup_candles(hours, LEVEL_MS["1d"])
+        self.levels["1d"] = merge_candles(self.levels["1d"], days, LEVEL_KEEP["1d"])
+
+    def apply_kline(self, kline: dict) -> bool:
+        # текущая 1m свеча из потока; False — между архивом и свечой дыра,
+        # её надо дозалить по REST
+        with self.lock:
+            return self._apply_kline(kline)
+
+    def _apply_kline(self, kline: dict) -> bool:
+        minutes = self.levels["1m"]
+        if len(minutes["t"]) == 0:
+            return True  # архив ещё не нужен никому — засеется по запросу
+        start, last = int(kline["t"]), int(minutes["t"][-1])
+        if start < last:
+            return True
+        if start - last > LEVEL_MS["1m"]:
+            return False
+
+        candle = {
+            "t": np.array([start], dtype=np.int64),
+            "o": np.array([float(kline["o"])]),
+            "h": np.array([float(kline["h"])]),
+            "l": np.array([float(kline["l"])]),
+            "c": np.array([float(kline["c"])]),
+        }
+        self._merge_minutes(candle)
+        # архив актуален без похода в REST
+        self.synced_at = time.monotonic()
+        return True
+
+    def closes(self, level: str, span_seconds: Optional[int] = None):
+        candles = self.levels[level]
+        t, c = candles["t"], candles["c"]
+        if span_seconds is not None and len(t):
+            start = np.searchsorted(t, t[-1] - span_seconds * 1000, side="right")
+            t, c = t[start:], c[start:]
+        return t, c
+
+
+# symbol -> архив; свечи грузятся только для символов, которые кто-то смотрит
+candle_archives: dict[str, CandleArchive] = {}
+
+
+def get_candles(symbol: str = SYMBOL) -> CandleArchive:
+    archive = candle_archives.get(symbol)
+    if archive is None:
+        archive = candle_archives[symbol] = CandleArchive(symbol)
+    return archive
+
+
+def get_history_cached(symbol: str = SYMBOL, hours: int = VOLATILITY_WINDOW_HOURS) -> List[float]:
+    # часовые закрытия из локального архива
+    archive = get_candles(symbol)
     try:
-        resp = requests.post(url, json=data or {}, headers=headers, timeout=15)
-        j = resp.json()
+        archive.sync(max_age=VOLATILITY_KLINES_TTL)
     except Exception as e:
-        print("CryptoPay request error:", e)
-        raise
+        log_price.warning("Candle sync error", extra={"error": e})
+    _, closes = archive.closes("1h")
+    return closes[-hours:].tolist()
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int):
+    # Largest-Triangle-Three-Buckets: сохраняет форму ряда (пики и провалы)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    xf = x.astype(np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # средние точки корзин считаем сразу для всех корзин
+    sums_x = np.add.reduceat(xf[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.r_[sums_x / counts, xf[-1]]
+    avg_y = np.r_[sums_y / counts, y[-1]]
+
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # площадь треугольника (a, кандидат, среднее следующей корзины)
+        area = np.abs(
+            (xf[a] - avg_x[i + 1]) * (y[lo:hi] - y[a])
+            - (xf[a] - xf[lo:hi]) * (avg_y[i + 1] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        picked[i + 1] = a
+    return x[picked], y[picked]
 
-    if not j.get("ok"):
-        raise RuntimeError(f"CryptoPay API error: {j}")
-    return j["result"]
 
+def get_chart_series(symbol: str, timeframe: str):
+    tf = CHART_TIMEFRAMES[timeframe]
+    archive = get_candles(symbol)
+    archive.sync()
+    t, closes = archive.closes(tf["level"], tf["span"])
+    if len(t) == 0:
+        return [], []
+    t, closes = lttb(t, closes, CHART_POINT_BUDGET)
+    return t.astype("datetime64[ms]"), closes
 
-def create_ticket_invoice_api(user_id: int, tickets: int, amount_ton: float) -> dict:
-    payload = f"user_{user_id}_tickets_{tickets}"
-    data = {
-        "asset": "TON",
-        "amount": str(amount_ton),
-        "description": "Покупка тикетов TON Metric",
-        "hidden_message": "Спасибо за поддержку пампа 🔥",
-        "payload": payload,
-    }
-    result = cryptopay_request("createInvoice", data)
-    return result
+
+# ------------------ ГРАФИК ЦЕНЫ ------------------
+
+# (symbol, timeframe) -> (monotonic ts, png)
+chart_cache: dict[tuple, tuple] = {}
+
+
+def parse_timeframe(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return DEFAULT_TIMEFRAME
+    value = value.lower().strip()
+    aliases = {"24h": "1d", "72h": "3d", "1w": "7d", "1m": "30d", "30": "30d", "365d": "1y"}
+    value = aliases.get(value, value)
+    return value if value in CHART_TIMEFRAMES else None
+
+
+def timeframe_keyboard(current: str, symbol: str = SYMBOL) -> InlineKeyboardMarkup:
+    buttons = []
+    for tf in CHART_TIMEFRAMES:
+        label = f"• {tf.upper()} •" if tf == current else tf.upper()
+        buttons.append(InlineKeyboardButton(label, callback_data=f"chart:{symbol}:{tf}"))
+    return InlineKeyboardMarkup([buttons])
+
+
+price_renderer = None
+
+
+def cached_chart(symbol: str, timeframe: str) -> Optional[bytes]:
+    cached = chart_cache.get((symbol, timeframe))
+    if cached and time.monotonic() - cached[0] < CHART_TIMEFRAMES[timeframe]["ttl"]:
+        return cached[1]
+    return None
+
+
+def create_price_chart(symbol: str = SYMBOL, timeframe: str = DEFAULT_TIMEFRAME) -> bytes:
+    return price_chart(symbol, timeframe)[0]
+
+
+def price_chart(symbol: str, timeframe: str) -> tuple[bytes, bool]:
+    # -> (картинка, отрисована ли этим вызовом)
+    # блокирующий (REST + рендер): из хендлеров — только через asyncio.to_thread
+    img = cached_chart(symbol, timeframe)
+    cache_hit("chart_png", img is not None)
+    if img is not None:
+        return img, False
+
+    # свечи тянем до render_lock: чужие рендеры не ждут сети
+    times, prices = get_chart_series(symbol, timeframe)
+    if len(times) == 0 or len(prices) == 0:
+        raise RuntimeError("No chart data")
+
+    with render_lock:
+        # пока ждали замок, эту картинку мог отрисовать другой поток
+        img = cached_chart(symbol, timeframe)
+        if img is not None:
+            return img, False
+        return _create_price_chart(symbol, timeframe, times, prices), True
+
+
+def _create_price_chart(symbol: str, timeframe: str, times, prices) -> bytes:
+    started = time.perf_counter()
+    label = f"1 {coin_name(symbol)} = {format_price(prices[-1])} $"
+    img = None
+    if CHART_FAST_PATH and timeframe == DEFAULT_TIMEFRAME:
+        try:
+            width = min(CHART_PROFILE["width"], SPARKLINE_MAX_WIDTH)
+            img = render_sparkline(
+                times.astype(np.int64),
+                prices,
+                width=width,
+                height=round(width * 2 / 3),
+                label=label,
+                compress_level=CHART_PROFILE["compress_level"] or 6,
+                fmt=CHART_PROFILE["format"],
+                quality=CHART_PROFILE["quality"],
+                # у дорогих пар копейки на оси не влезают в поле слева
+                tick_decimals=0 if prices.min() >= 1000 else price_decimals(float(prices.min())),
+            )
+        except Exception:
+            log_chart.warning("Sparkline error, falling back to matplotlib", exc_info=True)
+
+    if img is None:
+        img = get_price_renderer().render(times, prices, label)
+    record_chart_render(f"{coin_name(symbol).lower()}_{timeframe}", img, started)
+    chart_cache[(symbol, timeframe)] = (time.monotonic(), img)
+    return img
+
+
+# (symbol, timeframe) -> (monotonic ts рендера, file_id): однажды загруженная
+# картинка дальше ходит по file_id — в личку, в группы и в inline-ответы
+chart_file_ids: dict[tuple, tuple] = {}
+
+
+def cached_chart_file_id(symbol: str, timeframe: str) -> Optional[str]:
+    cached = chart_file_ids.get((symbol, timeframe))
+    rendered = chart_cache.get((symbol, timeframe))
+    # file_id годен, пока это та же картинка, что лежит в chart_cache, и она свежая
+    if cached and rendered and cached[0] == rendered[0] \
+            and time.monotonic() - cached[0] < CHART_TIMEFRAMES[timeframe]["ttl"]:
+        return cached[1]
+    return None
+
+
+def get_chart_photo(symbol: str, timeframe: str):
+    # file_id, если эту картинку уже загружали, иначе — png/jpeg байты;
+    # блокирующий, как create_price_chart: с event loop — через asyncio.to_thread
+    file_id = cached_chart_file_id(symbol, timeframe)
+    cache_hit("chart_file_id", file_id is not None)
+    return file_id or create_price_chart(symbol, timeframe)
+
+
+async def get_chart_photo_async(symbol: str, timeframe: str):
+    # для хендлеров: готовый file_id или картинку из кэша отдаём сразу,
+    # в поток уходим только за свечами и рендером
+    file_id = cached_chart_file_id(symbol, timeframe)
+    cache_hit("chart_file_id", file_id is not None)
+    if file_id:
+        return file_id
+    img = cached_chart(symbol, timeframe)
+    if img is not None:
+        cache_hit("chart_png", True)
+        return img
+    return await asyncio.to_thread(create_price_chart, symbol, timeframe)
+
+
+def remember_chart_file_id(symbol: str, timeframe: str, message):
+    rendered = chart_cache.get((symbol, timeframe))
+    photo = getattr(message, "photo", None)
+    if rendered and photo:
+        chart_file_ids[(symbol, timeframe)] = (rendered[0], photo[-1].file_id)
+
+
+# ----------- ОТПРАВКА ЦЕНЫ + ГРАФИКА ------------
+
+async def send_price_and_chart(chat_id: int, lang: str, context: ContextTypes.DEFAULT_TYPE,
+                               symbol: str = SYMBOL):
+    coin = coin_name(symbol)
+    price = get_price_usd(symbol)
+    if price is None:
+        await context.bot.send_message(chat_id, msg("price_error", lang, coin=coin))
+        return
+
+    await context.bot.send_message(chat_id, msg("price_ok", lang, coin=coin, price=price))
+
+    try:
+        sent = await context.bot.send_photo(
+            chat_id,
+            await get_chart_photo_async(symbol, DEFAULT_TIMEFRAME),
+            caption=BINANCE_REF_CAPTION,
+            parse_mode="Markdown",
+            reply_markup=timeframe_keyboard(DEFAULT_TIMEFRAME, symbol),
+        )
+        remember_chart_file_id(symbol, DEFAULT_TIMEFRAME, sent)
+    except Exception:
+        log_chart.warning("Chart error", exc_info=True)
+        await context.bot.send_message(chat_id, msg("chart_error", lang))
+
+
+# ------------------ CryptoPay helpers ------------------
+
+def cryptopay_request(method: str, data: Optional[dict] = None) -> dict:
+    if not CRYPTOBOT_TOKEN:
+        raise RuntimeError("CRYPTOBOT_TOKEN not set")
+
+    url = CRYPTOPAY_API_URL + method
+    headers = {
+        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
+        "Content-Type": "application/json",
+    }
+    with UPSTREAM_SECONDS.time(UPSTREAM_ERRORS, upstream="cryptopay", method=method):
+        try:
+            resp = requests.post(url, json=data or {}, headers=headers, timeout=15)
+            j = resp.json()
+        except Exception as e:
+            log_payments.warning("CryptoPay request error", extra={"error": e, "method": method})
+            raise
+
+        if not j.get("ok"):
+            raise RuntimeError(f"CryptoPay API error: {j}")
+    return j["result"]
+
+
+def create_ticket_invoice_api(user_id: int, tickets: int, amount_ton: float) -> dict:
+    payload = f"user_{user_id}_tickets_{tickets}"
+    data = {
+        "asset": "TON",
+        "amount": str(amount_ton),
+        "description": "Покупка тикетов TON Metric",
+        "hidden_message": "Спасибо за поддержку пампа 🔥",
+        "payload": payload,
+    }
+    result = cryptopay_request("createInvoice", data)
+    return result
 
 
 def get_invoice_api(invoice_id: int) -> dict:
@@ -882,11 +1728,128 @@ def get_invoice_api(invoice_id: int) -> dict:
     raise RuntimeError("Invoice not found in CryptoPay")
 
 
+# ------------------ НЕДОСТУПНЫЕ ПОЛЬЗОВАТЕЛИ ------------------
+
+unreachable_users: set[int] = set()
+prune_queue: set[int] = set()  # ждут пакетной деактивации
+unreachable_stats: dict[str, int] = {
+    "forbidden": 0,
+    "chat_not_found": 0,
+    "pruned_subscribers": 0,
+    "pruned_targets": 0,
+    "dropped_alerts": 0,
+    "pruned_digests": 0,
+    "profile_skips": 0,
+}
+
+# user_id -> (display_name | None, monotonic ts)
+profile_cache: dict[int, tuple] = {}
+
+
+def classify_unreachable(error: Exception) -> Optional[str]:
+    # None — ошибка временная, пользователя трогать не надо
+    if isinstance(error, Forbidden):
+        return "forbidden"
+    if isinstance(error, BadRequest):
+        message = str(error).lower()
+        if "chat not found" in message or "user not found" in message:
+            return "chat_not_found"
+    return None
+
+
+def mark_unreachable(user_id: int, reason: str):
+    unreachable_stats[reason] += 1
+    unreachable_users.add(user_id)
+    profile_cache.pop(user_id, None)
+    prune_queue.add(user_id)
+
+
+def flush_prune_queue():
+    if not prune_queue:
+        return
+    user_ids = sorted(prune_queue)
+    prune_queue.clear()
+    try:
+        deactivate_unreachable_users(user_ids)
+    except Exception as e:
+        log_users.error("Prune unreachable error", extra={"error": e, "users": len(user_ids)})
+        prune_queue.update(user_ids)
+
+
+def mark_reachable(user_id: int):
+    # пользователь снова написал боту — разблокировал
+    unreachable_users.discard(user_id)
+
+
+async def mark_reachable_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # любое обновление от пользователя — сообщение, кнопка, inline-запрос
+    user = update.effective_user
+    if user is not None and user.id in unreachable_users:
+        mark_reachable(user.id)
+
+
+async def fetch_display_name(bot, user_id: int) -> Optional[str]:
+    if user_id in unreachable_users:
+        unreachable_stats["profile_skips"] += 1
+        return None
+
+    cached = profile_cache.get(user_id)
+    fresh = bool(cached) and time.monotonic() - cached[1] < PROFILE_CACHE_TTL
+    cache_hit("profile", fresh)
+    if fresh:
+        return cached[0]
+
+    try:
+        with UPSTREAM_SECONDS.time(UPSTREAM_ERRORS, upstream="telegram", method="getChat"):
+            chat = await bot.get_chat(user_id)
+    except Exception as e:
+        log_users.warning("get_chat error", extra={"chat_id": user_id, "error": e})
+        reason = classify_unreachable(e)
+        if reason:
+            mark_unreachable(user_id, reason)
+        return None
+
+    display_name = None
+    if getattr(chat, "username", None):
+        display_name = f"@{chat.username}"
+    elif getattr(chat, "full_name", None):
+        display_name = chat.full_name
+
+    profile_cache[user_id] = (display_name, time.monotonic())
+    return display_name
+
+
+def text_unreachable_stats() -> str:
+    lines = ["Unreachable users:"]
+    lines.append(f"known: {len(unreachable_users)}, queued: {len(prune_queue)}")
+    for key, value in unreachable_stats.items():
+        lines.append(f"{key}: {value}")
+    return "\n".join(lines)
+
+
 # ------------------ ХЕНДЛЕРЫ ------------------
 
+CALLBACK_ACTIONS = ("lang", "chart", "unsubscribe", "check_invoice", "digest")
+# текст кнопки -> действие, сразу по всем языкам
+BUTTON_ACTIONS = {text: key for texts in BUTTON_TEXTS.values() for key, text in texts.items()}
+
+
+def callback_action(update: Update) -> str:
+    # callback_data присылает клиент — в метки берём только известные префиксы
+    data = update.callback_query.data or ""
+    prefix = "lang" if data.startswith("lang_") else data.split(":", 1)[0]
+    return prefix if prefix in CALLBACK_ACTIONS else "other"
+
+
+def footer_action(update: Update) -> str:
+    return BUTTON_ACTIONS.get((update.message.text or "").strip(), "other")
+
+
+@instrument_handler("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_lang[user_id] = "ru"
+    user_lang[user_id] = DEFAULT_LANG
+    await change_feed.publish("lang", u=user_id, l=DEFAULT_LANG)
 
     # рефералка: /start 123456789
     referrer_id = None
@@ -908,11 +1871,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
 
     await update.message.reply_text(
-        "Выберите язык / Select language / Оберіть мову:",
+        msg("choose_language", DEFAULT_LANG),
         reply_markup=InlineKeyboardMarkup(keyboard),
     )
 
 
+@instrument_handler("callback", callback_action)
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -925,25 +1889,62 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith("lang_"):
         lang = data.split("_", 1)[1]
         user_lang[user_id] = lang
+        await change_feed.publish("lang", u=user_id, l=lang)
 
-        await query.message.reply_text(text_lang_confirm(lang))
+        await query.message.reply_text(msg("lang_confirm", lang))
         await send_price_and_chart(chat_id, lang, context)
 
         await context.bot.send_message(
             chat_id,
-            text_menu_prompt(lang),
+            msg("menu_prompt", lang),
             reply_markup=footer_buttons(lang),
         )
         return
 
-    # отписка от уведомлений
-    if data == "unsubscribe":
+    # переключение таймфрейма графика: chart:<symbol>:<tf> (старые кнопки — chart:<tf>)
+    if data.startswith("chart:"):
+        parts = data.split(":")
+        symbol = parse_symbol(parts[1]) if len(parts) > 2 else SYMBOL
+        timeframe = parse_timeframe(parts[-1])
+        if symbol is None or timeframe is None:
+            return
+        lang = get_user_language(user_id)
+        try:
+            photo = await get_chart_photo_async(symbol, timeframe)
+            sent = await query.message.edit_media(
+                InputMediaPhoto(photo, caption=BINANCE_REF_CAPTION, parse_mode="Markdown"),
+                reply_markup=timeframe_keyboard(timeframe, symbol),
+            )
+            remember_chart_file_id(symbol, timeframe, sent)
+        except Exception:
+            log_chart.warning("Chart error", exc_info=True)
+            await query.message.reply_text(msg("chart_error", lang))
+        return
+
+    # отписка от дайджеста
+    if data == "digest:off":
+        lang = get_user_language(user_id)
+        if has_db():
+            set_digest_subscription(user_id, lang, False)
+            await query.message.reply_text(msg("digest_off", lang))
+        else:
+            await query.message.reply_text(msg("subscriptions_disabled", lang))
+        return
+
+    # отписка от уведомлений: unsubscribe:<symbol> (старые кнопки — без символа)
+    if data == "unsubscribe" or data.startswith("unsubscribe:"):
         lang = get_user_language(user_id)
+        raw_symbol = data.partition(":")[2]
+        symbol = parse_symbol(raw_symbol) if raw_symbol else SYMBOL
+        if symbol is None:
+            # монету убрали из PRICE_SYMBOLS: не подменяем её TON
+            await query.message.reply_text(msg("coin_not_tracked", lang, coin=coin_name(raw_symbol.upper())))
+            return
         if has_db():
-            unsubscribe_user_db(user_id)
-            await query.message.reply_text(text_unsubscribed(lang))
+            unsubscribe_user_db(user_id, symbol)
+            await query.message.reply_text(msg("unsubscribed", lang))
         else:
-            await query.message.reply_text(text_subscriptions_disabled(lang))
+            await query.message.reply_text(msg("subscriptions_disabled", lang))
         return
 
     # проверка оплаты тикетов
@@ -953,38 +1954,30 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             invoice_id = int(invoice_id_str)
         except ValueError:
-            await query.message.reply_text("Некорректный ID инвойса 🙈")
+            await query.message.reply_text(msg("invoice_bad_id", lang))
             return
 
         if not has_db():
-            await query.message.reply_text("База данных недоступна 🙈")
+            await query.message.reply_text(msg("db_unavailable", lang))
             return
 
         try:
             invoice = get_invoice_api(invoice_id)
         except Exception as e:
-            print("get_invoice_api error:", e)
-            await query.message.reply_text("Не удалось проверить оплату 🙈")
+            log_payments.warning("get_invoice_api error", extra={"error": e, "invoice_id": invoice_id})
+            await query.message.reply_text(msg("payment_check_error", lang))
             return
 
         status = invoice.get("status")
         amount = float(invoice.get("amount") or 0)
 
         if status != "paid":
-            await query.message.reply_text("Пока не оплачено. Попробуй через минуту ещё раз.")
+            await query.message.reply_text(msg("payment_pending", lang))
             return
 
         # проверяем, не зачисляли ли уже
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT status, user_id, tickets, amount_ton FROM ticket_invoices WHERE invoice_id = %s;",
-                    (invoice_id,),
-                )
-                row = cur.fetchone()
-
-        if row and row[0] == "paid":
-            await query.message.reply_text("Этот счёт уже был зачислен ✅")
+        if get_invoice_status(invoice_id) == "paid":
+            await query.message.reply_text(msg("invoice_already_paid", lang))
             return
 
         # считаем, что 1 TON = 1 тикет
@@ -993,15 +1986,14 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # обновляем БД
         save_invoice(invoice_id, user_id, tickets, amount, "paid")
         add_tickets_to_user(user_id, tickets, amount)
-        await query.message.reply_text(f"Оплата получена ✅\nТебе начислено: {tickets} тикетов.")
+        await query.message.reply_text(msg("payment_received", lang, tickets=tickets))
 
         stats = get_user_ticket_stats(user_id)
-        await query.message.reply_text(
-            f"Твои тикеты: {stats['tickets']}\nВсего куплено: {stats['total_ton']:.2f} TON"
-        )
+        await query.message.reply_text(text_ticket_stats(lang, stats))
         return
 
 
+@instrument_handler("footer", footer_action)
 async def footer_buttons_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     lang = get_user_language(user_id)
@@ -1015,37 +2007,12 @@ async def footer_buttons_handler(update: Update, context: ContextTypes.DEFAULT_T
 
     # Уведомления
     if text == t["notify"]:
-        if not has_db():
-            await update.message.reply_text(text_subscriptions_disabled(lang))
-            return
-
-        current_price = get_ton_price_usd()
-        if current_price is None:
-            await update.message.reply_text(text_price_error(lang))
-            return
-
-        sub = get_subscription(user_id)
-        if sub and sub["active"]:
-            await update.message.reply_text(text_already_subscribed(lang))
-        else:
-            subscribe_user_db(user_id, lang, current_price)
-            await update.message.reply_text(
-                text_subscribed(lang, current_price),
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton(unsubscribe_button_text(lang), callback_data="unsubscribe")]]
-                ),
-            )
+        await subscribe_to_symbol(update, lang, SYMBOL)
         return
 
     # Кошелёк
     if text == t["wallet"]:
-        if lang == "en":
-            msg = "Open wallet: http://t.me/send?start=r-71wfg"
-        elif lang == "uk":
-            msg = "Відкрити гаманець: http://t.me/send?start=r-71wfg"
-        else:
-            msg = "Открыть кошелёк: http://t.me/send?start=r-71wfg"
-        await update.message.reply_text(msg)
+        await update.message.reply_text(msg("wallet_link", lang))
         return
 
     # Рефералы
@@ -1057,24 +2024,23 @@ async def footer_buttons_handler(update: Update, context: ContextTypes.DEFAULT_T
     if text == t["memland"]:
         top = fetch_memelandia_top(limit=5)
         if not top:
-            await update.message.reply_text(text_memlandia_error(lang))
+            await update.message.reply_text(msg("memelandia_error", lang))
             return
 
-        msg = format_memelandia_top(lang, top)
-        await update.message.reply_text(msg)
+        await update.message.reply_text(format_memelandia_top(lang, top))
 
         # картинка
         try:
-            img = create_memelandia_bar_chart(top)
-            await update.message.reply_photo(img, caption="Top-5 Memelandia — 24h %")
-        except Exception as e:
-            print("Memelandia chart error:", e)
+            img = await asyncio.to_thread(create_memelandia_bar_chart, top)
+            await update.message.reply_photo(img, caption=msg("memelandia_caption", lang))
+        except Exception:
+            log_chart.warning("Memelandia chart error", exc_info=True)
         return
 
     # Купить тикеты
     if text == t["buy_tickets"]:
         if not (has_db() and CRYPTOBOT_TOKEN):
-            await update.message.reply_text("Покупка тикетов временно недоступна 🙈")
+            await update.message.reply_text(msg("tickets_unavailable", lang))
             return
 
         tickets = 1
@@ -1085,8 +2051,8 @@ async def footer_buttons_handler(update: Update, context: ContextTypes.DEFAULT_T
         try:
             invoice = create_ticket_invoice_api(user_id, tickets, amount_ton)
         except Exception as e:
-            print("create_ticket_invoice_api error:", e)
-            await update.message.reply_text("Не удалось создать счёт 🙈")
+            log_payments.warning("create_ticket_invoice_api error", extra={"error": e})
+            await update.message.reply_text(msg("invoice_create_error", lang))
             return
 
         invoice_id = int(invoice["invoice_id"])
@@ -1095,57 +2061,16 @@ async def footer_buttons_handler(update: Update, context: ContextTypes.DEFAULT_T
 
         save_invoice(invoice_id, user_id, tickets, amount_ton, status)
 
-        # текст в зависимости от языка
-        if lang == "en":
-            tagline = "Want to be on the leaderboard? Buy a ticket 🙂"
-            stats_text = (
-                f"Your tickets: {stats['tickets']}\n"
-                f"Total bought: {stats['total_ton']:.2f} TON"
-            )
-            text_invoice = (
-                "Invoice created ✅\n\n"
-                f"Amount: {amount_ton:.2f} TON\n"
-                f"Tickets: {tickets}\n\n"
-                "After payment press “Check payment”.\n\n"
-                f"{tagline}\n\n"
-                f"{stats_text}"
-            )
-        elif lang == "uk":
-            tagline = "Хочеш у лідерборд? Купи квиток 🙂"
-            stats_text = (
-                f"Твої квитки: {stats['tickets']}\n"
-                f"Всього куплено: {stats['total_ton']:.2f} TON"
-            )
-            text_invoice = (
-                "Рахунок створено ✅\n\n"
-                f"Сума: {amount_ton:.2f} TON\n"
-                f"Квитків: {tickets}\n\n"
-                "Після оплати натисни «Перевірити оплату».\n\n"
-                f"{tagline}\n\n"
-                f"{stats_text}"
-            )
-        else:
-            tagline = "Хочешь в лидерборд? Купи тикет 🙂"
-            stats_text = (
-                f"Твои тикеты: {stats['tickets']}\n"
-                f"Всего куплено: {stats['total_ton']:.2f} TON"
-            )
-            text_invoice = (
-                "Счёт создан ✅\n\n"
-                f"Сумма: {amount_ton:.2f} TON\n"
-                f"Тикетов: {tickets}\n\n"
-                "После оплаты нажми «Проверить оплату».\n\n"
-                f"{tagline}\n\n"
-                f"{stats_text}"
-            )
+        text_invoice = msg("invoice_created", lang, amount=amount_ton, tickets=tickets,
+                           stats=text_ticket_stats(lang, stats))
 
         kb = InlineKeyboardMarkup(
             [
                 [
-                    InlineKeyboardButton("Оплатить в CryptoBot", url=pay_url),
+                    InlineKeyboardButton(msg("btn_pay", lang), url=pay_url),
                 ],
                 [
-                    InlineKeyboardButton("Проверить оплату", callback_data=f"check_invoice:{invoice_id}"),
+                    InlineKeyboardButton(msg("btn_check_payment", lang), callback_data=f"check_invoice:{invoice_id}"),
                 ],
             ]
         )
@@ -1159,34 +2084,87 @@ async def footer_buttons_handler(update: Update, context: ContextTypes.DEFAULT_T
         return
 
 
+async def subscribe_to_symbol(update: Update, lang: str, symbol: str):
+    user_id = update.effective_user.id
+    coin = coin_name(symbol)
+    if not has_db():
+        await update.message.reply_text(msg("subscriptions_disabled", lang))
+        return
+
+    current_price = get_price_usd(symbol)
+    if current_price is None:
+        await update.message.reply_text(msg("price_error", lang, coin=coin))
+        return
+
+    sub = get_subscription(user_id, symbol)
+    if sub and sub["active"]:
+        await update.message.reply_text(msg("already_subscribed", lang))
+    else:
+        subscribe_user_db(user_id, lang, current_price, symbol)
+        await update.message.reply_text(
+            msg("subscribed", lang, coin=coin, base=current_price),
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton(msg("btn_unsubscribe", lang), callback_data=f"unsubscribe:{symbol}")]]
+            ),
+        )
+
+
 # отдельные команды (если кто-то захочет писать руками)
+@instrument_handler("price")
 async def price_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # оставляем /price для ручного вызова только курса
+    # /price — TON, /price btc — другая пара, /price all — все из одного снимка
     user_id = update.effective_user.id
     lang = get_user_language(user_id)
-    p = get_ton_price_usd()
+
+    arg = context.args[0].lower() if context.args else None
+    if arg == "all":
+        prices = price_service.get_all()
+        if prices:
+            await update.message.reply_text(text_prices(lang, prices))
+        else:
+            await update.message.reply_text(msg("price_error", lang, coin="TON"))
+        return
+
+    symbol = parse_symbol(arg) if arg else SYMBOL
+    if symbol is None:
+        await update.message.reply_text(text_price_usage(lang))
+        return
+
+    p = get_price_usd(symbol)
     if p:
-        await update.message.reply_text(text_price_ok(lang, p))
+        await update.message.reply_text(msg("price_ok", lang, coin=coin_name(symbol), price=p))
     else:
-        await update.message.reply_text(text_price_error(lang))
+        await update.message.reply_text(msg("price_error", lang, coin=coin_name(symbol)))
 
 
+@instrument_handler("chart")
 async def chart_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # оставляем /chart для ручного вызова только графика
+    # /chart [монета] [таймфрейм] — аргументы в любом порядке
     user_id = update.effective_user.id
     lang = get_user_language(user_id)
 
-    info = await update.message.reply_text(text_chart_build(lang))
+    symbol, timeframe = SYMBOL, DEFAULT_TIMEFRAME
+    for arg in context.args or []:
+        if parse_timeframe(arg):
+            timeframe = parse_timeframe(arg)
+        elif parse_symbol(arg):
+            symbol = parse_symbol(arg)
+        else:
+            await update.message.reply_text(text_price_usage(lang))
+            return
+
+    info = await update.message.reply_text(msg("chart_build", lang, coin=coin_name(symbol)))
     try:
-        img = create_ton_chart()
-        await update.message.reply_photo(
-            img,
-            caption="[Binance](https://www.binance.com/referral/earn-together/refer2earn-usdc/claim?hl=en&ref=GRO_28502_1C1WM&utm_source=default)",
+        sent = await update.message.reply_photo(
+            await get_chart_photo_async(symbol, timeframe),
+            caption=BINANCE_REF_CAPTION,
             parse_mode="Markdown",
+            reply_markup=timeframe_keyboard(timeframe, symbol),
         )
-    except Exception as e:
-        print("Chart error:", e)
-        await update.message.reply_text(text_chart_error(lang))
+        remember_chart_file_id(symbol, timeframe, sent)
+    except Exception:
+        log_chart.warning("Chart error", exc_info=True)
+        await update.message.reply_text(msg("chart_error", lang))
     finally:
         try:
             await info.delete()
@@ -1194,30 +2172,151 @@ async def chart_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
 
 
+# -------- INLINE --------
+
+async def inline_chart_file_id(context: ContextTypes.DEFAULT_TYPE, symbol: str, timeframe: str) -> Optional[str]:
+    file_id = cached_chart_file_id(symbol, timeframe)
+    if file_id or not INLINE_CACHE_CHAT_ID:
+        return file_id
+    # картинку ещё никто не открывал — рендерим один раз и загружаем в служебный чат
+    img = await asyncio.to_thread(create_price_chart, symbol, timeframe)
+    sent = await context.bot.send_photo(INLINE_CACHE_CHAT_ID, img, disable_notification=True)
+    remember_chart_file_id(symbol, timeframe, sent)
+    return cached_chart_file_id(symbol, timeframe)
+
+
+@instrument_handler("inline")
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # @bot ton | @bot btc 7d | @bot all — цена из общего снимка, график по file_id
+    query = update.inline_query
+    lang = get_user_language(query.from_user.id)
+
+    words = query.query.split()
+    if words and words[0].lower() == "all":
+        prices = price_service.get_all()
+        if not prices:
+            await query.answer([], cache_time=INLINE_CACHE_TIME)
+            return
+        text = text_prices(lang, prices)
+        results = [
+            InlineQueryResultArticle(
+                id="prices:all",
+                title=text.split("\n")[0] + " …",
+                description=text.replace("\n", " · "),
+                input_message_content=InputTextMessageContent(text),
+            )
+        ]
+        await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+        return
+
+    symbol, timeframe = SYMBOL, DEFAULT_TIMEFRAME
+    for word in words:
+        if parse_timeframe(word):
+            timeframe = parse_timeframe(word)
+        elif parse_symbol(word):
+            symbol = parse_symbol(word)
+
+    coin = coin_name(symbol)
+    price = get_price_usd(symbol)
+    if price is None:
+        await query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+
+    text = msg("price_ok", lang, coin=coin, price=price)
+    results = [
+        InlineQueryResultArticle(
+            id=f"price:{symbol}",
+            title=text,
+            description="Binance",
+            input_message_content=InputTextMessageContent(text),
+        )
+    ]
+    try:
+        file_id = await inline_chart_file_id(context, symbol, timeframe)
+    except Exception as e:
+        log_chart.warning("Inline chart error", extra={"error": e})
+        file_id = None
+    if file_id:
+        results.append(
+            InlineQueryResultCachedPhoto(
+                id=f"chart:{symbol}:{timeframe}",
+                photo_file_id=file_id,
+                title=f"{coin} {timeframe}",
+                caption=f"{text}\n{BINANCE_REF_CAPTION}",
+                parse_mode="Markdown",
+            )
+        )
+
+    # ответ одинаков для всех — Telegram может раздавать его из своего кеша
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+
+
+@instrument_handler("subscribe")
+async def subscribe_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /subscribe btc — уведомления о ±10% по любой отслеживаемой паре
+    lang = get_user_language(update.effective_user.id)
+    symbol = parse_symbol(context.args[0]) if context.args else SYMBOL
+    if symbol is None:
+        await update.message.reply_text(text_price_usage(lang))
+        return
+    await subscribe_to_symbol(update, lang, symbol)
+
+
+@instrument_handler("digest")
+async def digest_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /digest — включить, /digest off — выключить; /digest now — разослать сейчас (админ)
+    user_id = update.effective_user.id
+    lang = get_user_language(user_id)
+    if not has_db():
+        await update.message.reply_text(msg("subscriptions_disabled", lang))
+        return
+
+    arg = context.args[0].lower() if context.args else "on"
+    if arg == "now" and user_id in ADMIN_IDS:
+        # digest_job молча выходит на ведомой реплике — говорим об этом сразу
+        if not is_leader():
+            await update.message.reply_text(msg("digest_now_not_leader", lang))
+        elif digest_lock.locked():
+            await update.message.reply_text(msg("digest_now_busy", lang))
+        else:
+            context.job_queue.run_once(digest_job, 0, data={"force": True})
+            await update.message.reply_text(msg("digest_now_started", lang))
+        return
+    if arg == "off":
+        set_digest_subscription(user_id, lang, False)
+        await update.message.reply_text(msg("digest_off", lang))
+        return
+
+    set_digest_subscription(user_id, lang, True)
+    await update.message.reply_text(msg("digest_on", lang, hour=DIGEST_HOUR_UTC), reply_markup=digest_keyboard(lang))
+
+
+@instrument_handler("my_tickets")
 async def my_tickets_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # команда на всякий случай (кнопки уже нет)
     user_id = update.effective_user.id
     stats = get_user_ticket_stats(user_id)
-    await update.message.reply_text(
-        f"Твои тикеты: {stats['tickets']}\nВсего куплено: {stats['total_ton']:.2f} TON"
-    )
+    await update.message.reply_text(text_ticket_stats(get_user_language(user_id), stats))
 
 
+@instrument_handler("buy_tickets")
 async def buy_tickets_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # просто продублируем поведение кнопки
     fake_update = update
     await footer_buttons_handler(fake_update, context)
 
 
+@instrument_handler("ref_link")
 async def ref_link_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # на случай ручной команды /reflink
     user_id = update.effective_user.id
     me = await context.bot.get_me()
     username = me.username
     ref_url = f"https://t.me/{username}?start={user_id}"
-    await update.message.reply_text(f"Твоя реф. ссылка:\n{ref_url}")
+    await update.message.reply_text(msg("ref_link", get_user_language(user_id), url=ref_url))
 
 
+@instrument_handler("referrals")
 async def referrals_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     lang = get_user_language(user_id)
@@ -1227,46 +2326,16 @@ async def referrals_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ref_url = f"https://t.me/{username}?start={user_id}"
 
     my_count = get_user_referral_count(user_id)
-    top = get_top_referrer()
-
-    lines: List[str] = []
+    top = cached_top_referrer()
 
-    if lang == "en":
-        lines.append("👥 Referrals")
-        lines.append("")
-        lines.append(f"Your referral link:\n{ref_url}")
-        lines.append("")
-        lines.append(f"Your referrals: {my_count}")
-    elif lang == "uk":
-        lines.append("👥 Реферали")
-        lines.append("")
-        lines.append(f"Твоє реферальне посилання:\n{ref_url}")
-        lines.append("")
-        lines.append(f"Твої реферали: {my_count}")
-    else:
-        lines.append("👥 Рефералы")
-        lines.append("")
-        lines.append(f"Твоя реферальная ссылка:\n{ref_url}")
-        lines.append("")
-        lines.append(f"Твои рефералы: {my_count}")
+    lines = [msg("referrals", lang, url=ref_url, count=my_count)]
 
     if top:
         top_id = top["referrer_id"]
         top_count = top["count"]
         # пытаемся получить ник топа
-        try:
-            chat = await context.bot.get_chat(top_id)
-        except Exception as e:
-            print(f"get_chat error for top referrer {top_id}:", e)
-            chat = None
-
-        display_name = None
-        if chat:
-            if getattr(chat, "username", None):
-                display_name = f"@{chat.username}"
-            elif getattr(chat, "full_name", None):
-                display_name = chat.full_name
-
+        display_name = await fetch_display_name(context.bot, top_id)
+        flush_prune_queue()
         if not display_name:
             display_name = f"ID {top_id}"
 
@@ -1275,160 +2344,1706 @@ async def referrals_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         name_link = f'<a href="{link}">{safe_name}</a>'
 
         lines.append("")
-        if lang == "en":
-            lines.append(f"Top referrer: {name_link} — {top_count} referrals")
-        elif lang == "uk":
-            lines.append(f"Топ реферер: {name_link} — {top_count} рефералів")
-        else:
-            lines.append(f"Топ реферер: {name_link} — {top_count} рефералов")
+        lines.append(msg("top_referrer", lang, name=name_link, count=top_count))
     else:
         lines.append("")
-        if lang == "en":
-            lines.append("No referrals yet. Be the first 😉")
-        elif lang == "uk":
-            lines.append("Ще немає рефералів. Будь першим 😉")
-        else:
-            lines.append("Пока нет рефералов. Будь первым 😉")
+        lines.append(msg("no_referrals", lang))
 
     await update.message.reply_text("\n".join(lines), parse_mode="HTML")
 
 
-# -------- ЛИДЕРБОРД --------
-async def top_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lb = get_leaderboard(limit=100)
-    if not lb:
-        await update.message.reply_text("Пока ещё никто не купил тикеты.")
-        return
-
-    current_user_id = update.effective_user.id if update.effective_user else None
-    lang = get_user_language(current_user_id or 0)
+# -------- СВОИ УВЕДОМЛЕНИЯ --------
 
-    lines = ["🏆 Лидерборд по тикетам:", ""]
+def parse_alert_args(args: list[str], current_price: float):
+    # -> (kind, value) или None
+    if not args:
+        return None
 
-    for i, row in enumerate(lb, start=1):
-        uid = row["user_id"]
-        tickets = row["tickets"]
-        total_ton = row["total_ton"]
+    direction = None
+    if args[0].lower() in ("above", "below") and len(args) > 1:
+        direction = args[0].lower()
+        args = args[1:]
 
-        # пытаемся получить данные пользователя
-        try:
-            chat = await context.bot.get_chat(uid)
-        except Exception as e:
-            print(f"get_chat error for {uid}:", e)
-            chat = None
+    raw = args[0].replace(",", ".")
+    try:
+        if raw.endswith("%"):
+            pct = float(raw[:-1])
+            if direction or not 0.1 <= pct <= 100:
+                return None
+            return "pct", pct
 
-        display_name = None
-        if chat:
-            if getattr(chat, "username", None):
-                display_name = f"@{chat.username}"
-            elif getattr(chat, "full_name", None):
-                display_name = chat.full_name
+        price = float(raw.lstrip("$"))
+    except ValueError:
+        return None
 
-        if not display_name:
-            display_name = f"ID {uid}"
+    if price <= 0:
+        return None
+    if direction is None:
+        direction = "above" if price > current_price else "below"
+    return direction, price
 
-        safe_name = html.escape(display_name)
-        link = f"tg://user?id={uid}"
-        name_link = f'<a href="{link}">{safe_name}</a>'
 
-        you = ""
-        if current_user_id is not None and uid == current_user_id:
-            you = " (ты)"
+@instrument_handler("alert")
+async def alert_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    lang = get_user_language(user_id)
 
-        lines.append(
-            f"{i}. {name_link}{you}\n"
-            f"   тикеты: {tickets}, всего куплено: {total_ton:.2f} TON"
-        )
+    if not has_db():
+        await update.message.reply_text(msg("subscriptions_disabled", lang))
+        return
 
-    lines.append("")
+    if not context.args:
+        await update.message.reply_text(msg("alert_usage", lang))
+        return
 
-    # подпись внизу
-    if lang == "en":
-        tagline = (
-            "☝️Want to be here? Buy a ticket 🎫\n"
-            "Want the very top spot? You'll need to outbid the others 🫅🏻"
-        )
-    elif lang == "uk":
-        tagline = (
-            "☝️Хочеш бути тут? Купи квиток 🎫\n"
-            "Хочеш бути на самому верху — доведеться перебити ставку інших 🫅🏻"
-        )
+    # /alert btc 70000 — первым аргументом можно указать монету
+    args = context.args
+    symbol = parse_symbol(args[0]) if len(args) > 1 else None
+    if symbol is not None:
+        args = args[1:]
     else:
-        tagline = (
-            "☝️Хочешь сюда? Купи тикет 🎫\n"
-            "Хочешь быть на самом верхнем месте — придётся перебить ставку других 🫅🏻"
-        )
+        symbol = SYMBOL
 
-    lines.append(tagline)
+    current_price = get_price_usd(symbol)
+    if current_price is None:
+        await update.message.reply_text(msg("price_error", lang, coin=coin_name(symbol)))
+        return
+
+    parsed = parse_alert_args(args, current_price)
+    if parsed is None:
+        await update.message.reply_text(msg("alert_usage", lang))
+        return
+
+    if len(get_user_targets(user_id)) >= MAX_TARGETS_PER_USER:
+        await update.message.reply_text(msg("targets_limit", lang, limit=MAX_TARGETS_PER_USER))
+        return
+
+    kind, value = parsed
+    base_price = current_price if kind == "pct" else None
+    target = add_price_target(user_id, lang, kind, value, base_price, symbol)
+    await update.message.reply_text(text_target_added(lang, target))
+
+
+@instrument_handler("alerts")
+async def alerts_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    lang = get_user_language(user_id)
+
+    if not has_db():
+        await update.message.reply_text(msg("subscriptions_disabled", lang))
+        return
+
+    await update.message.reply_text(text_targets_list(lang, get_user_targets(user_id)))
+
+
+@instrument_handler("alert_del")
+async def alert_del_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    lang = get_user_language(user_id)
+
+    if not has_db():
+        await update.message.reply_text(msg("subscriptions_disabled", lang))
+        return
+
+    if not context.args:
+        await update.message.reply_text(msg("alert_usage", lang))
+        return
+
+    arg = context.args[0].lstrip("#").lower()
+    if arg == "all":
+        removed = delete_user_targets(user_id)
+    else:
+        try:
+            removed = delete_user_targets(user_id, int(arg))
+        except ValueError:
+            await update.message.reply_text(msg("alert_usage", lang))
+            return
+
+    await update.message.reply_text(msg("targets_removed", lang, count=removed))
+
+
+# -------- ЛИДЕРБОРД --------
+@instrument_handler("top")
+async def top_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    current_user_id = update.effective_user.id if update.effective_user else None
+    lang = get_user_language(current_user_id or 0)
+
+    lb = cached_leaderboard()
+    if not lb:
+        await update.message.reply_text(msg("leaderboard_empty", lang))
+        return
+
+    lines = [msg("leaderboard_header", lang), ""]
+
+    for i, row in enumerate(lb, start=1):
+        uid = row["user_id"]
+        tickets = row["tickets"]
+        total_ton = row["total_ton"]
+
+        # пытаемся получить данные пользователя
+        display_name = await fetch_display_name(context.bot, uid)
+        if not display_name:
+            display_name = f"ID {uid}"
+
+        safe_name = html.escape(display_name)
+        link = f"tg://user?id={uid}"
+        name_link = f'<a href="{link}">{safe_name}</a>'
+
+        you = ""
+        if current_user_id is not None and uid == current_user_id:
+            you = msg("leaderboard_you", lang)
+
+        lines.append(msg("leaderboard_row", lang, place=i, name=name_link, you=you,
+                         tickets=tickets, total_ton=total_ton))
+
+    lines.append("")
+
+    # подпись внизу
+    lines.append(msg("leaderboard_tagline", lang))
 
     await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+    flush_prune_queue()
+
+
+@instrument_handler("botstats")
+async def botstats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    ticker = price_service.stats
+    await update.message.reply_text(
+        text_unreachable_stats() + "\n\n" + text_chart_stats() + "\n\n" + text_startup_budget()
+        + f"\n\nBinance ticker: {len(PRICE_SYMBOLS)} пар, запросов {ticker['requests']}, ошибок {ticker['errors']}"
+        + "\n" + text_price_stream_stats()
+        + "\n\n" + text_digest_stats()
+        + "\n" + text_snapshot_stats()
+        + "\n" + text_db_stats()
+        + "\n" + text_change_feed_stats()
+    )
+
+
+profile_lock = asyncio.Lock()
+
+
+async def run_profile(bot, chat_id: int, seconds: float, slow_ms: float):
+    import profiling  # модуль не грузится, пока профилирование не понадобилось
+
+    async with profile_lock:
+        session = profiling.ProfileSession(seconds, slow_ms=slow_ms)
+        try:
+            files = await session.run()
+        except Exception as e:
+            log_profile.error("Profile error", exc_info=True)
+            await bot.send_message(chat_id, f"Профилирование упало: {e}")
+            return
+        await bot.send_message(
+            chat_id,
+            f"Профиль за {seconds:.0f} с: сэмплов {session.sample_count}, "
+            f"блокировок loop > {slow_ms:.0f} мс: {len(session.slow_blocks)}",
+        )
+        for name, data in files.items():
+            await bot.send_document(chat_id, data, filename=name)
+
+
+@instrument_handler("profile")
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /profile [сек] [порог_мс]: сэмплинг event loop, tracemalloc и медленные колбэки;
+    # результаты — файлами. Вне окна ничего не работает.
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    if profile_lock.locked():
+        await update.message.reply_text("Профилирование уже идёт")
+        return
+    try:
+        seconds = float(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+        slow_ms = float(context.args[1]) if len(context.args) > 1 else PROFILE_SLOW_MS
+        # nan проходит сквозь min/max (все сравнения ложны) — отсекаем до зажима
+        if not (math.isfinite(seconds) and math.isfinite(slow_ms)):
+            raise ValueError("non-finite")
+    except ValueError:
+        await update.message.reply_text("/profile [сек] [порог_мс]")
+        return
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+    slow_ms = max(1.0, slow_ms)
+
+    await update.message.reply_text(f"Профилирую {seconds:.0f} с, порог медленного колбэка {slow_ms:.0f} мс…")
+    # апдейты обрабатываются по одному — окно ждём в фоне, не в хендлере
+    context.application.create_task(run_profile(context.bot, update.effective_chat.id, seconds, slow_ms))
+
+
+# ------------------ ИНДЕКС ТРИГГЕРОВ ------------------
+
+class AlertIndex:
+    # Каждый триггер — «спокойный» интервал цены (lower, upper): пока цена
+    # строго внутри, триггер молчит. Отсортированные границы позволяют найти
+    # все сработавшие триггеры за O(log n + k) без скана подписчиков.
+
+    def __init__(self):
+        self._entries: dict = {}  # key -> meta (dict с lower/upper)
+        self._upper_vals: list[float] = []
+        self._upper_keys: list = []
+        self._lower_vals: list[float] = []
+        self._lower_keys: list = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key) -> Optional[dict]:
+        return self._entries.get(key)
+
+    def add(self, key, lower: Optional[float], upper: Optional[float], meta: dict):
+        self.remove(key)
+        entry = dict(meta, lower=lower, upper=upper)
+        self._entries[key] = entry
+        if upper is not None:
+            i = bisect.bisect_right(self._upper_vals, upper)
+            self._upper_vals.insert(i, upper)
+            self._upper_keys.insert(i, key)
+        if lower is not None:
+            i = bisect.bisect_right(self._lower_vals, lower)
+            self._lower_vals.insert(i, lower)
+            self._lower_keys.insert(i, key)
+
+    def remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        if entry["upper"] is not None:
+            self._drop(self._upper_vals, self._upper_keys, entry["upper"], key)
+        if entry["lower"] is not None:
+            self._drop(self._lower_vals, self._lower_keys, entry["lower"], key)
+
+    @staticmethod
+    def _drop(vals: list, keys: list, value: float, key):
+        i = bisect.bisect_left(vals, value)
+        while i < len(vals) and vals[i] == value:
+            if keys[i] == key:
+                del vals[i]
+                del keys[i]
+                return
+            i += 1
+
+    def load(self, items: list):
+        # массовая загрузка: одна сортировка вместо n вставок
+        self.__init__()
+        uppers = []
+        lowers = []
+        for key, lower, upper, meta in items:
+            self._entries[key] = dict(meta, lower=lower, upper=upper)
+            if upper is not None:
+                uppers.append((upper, key))
+            if lower is not None:
+                lowers.append((lower, key))
+        uppers.sort(key=lambda x: x[0])
+        lowers.sort(key=lambda x: x[0])
+        self._upper_vals = [v for v, _ in uppers]
+        self._upper_keys = [k for _, k in uppers]
+        self._lower_vals = [v for v, _ in lowers]
+        self._lower_keys = [k for _, k in lowers]
+
+    def crossed(self, price: float) -> list:
+        # upper <= price или lower >= price
+        hi = bisect.bisect_right(self._upper_vals, price)
+        lo = bisect.bisect_left(self._lower_vals, price)
+        keys = self._upper_keys[:hi] + self._lower_keys[lo:]
+        return list(dict.fromkeys(keys))
+
+    def nearest_distance(self, price: float) -> Optional[float]:
+        # относительное расстояние до ближайшей границы, None — триггеров нет
+        if price <= 0:
+            return None
+        distances = []
+        i = bisect.bisect_right(self._upper_vals, price)
+        if i < len(self._upper_vals):
+            distances.append((self._upper_vals[i] - price) / price)
+        j = bisect.bisect_left(self._lower_vals, price)
+        if j > 0:
+            distances.append((price - self._lower_vals[j - 1]) / price)
+        if not distances:
+            return 0.0 if self._entries else None
+        return max(0.0, min(distances))
+
+
+# symbol -> индекс: у каждой пары своя шкала цен
+alert_indexes: dict[str, AlertIndex] = {}
+
+
+def get_alert_index(symbol: str) -> AlertIndex:
+    index = alert_indexes.get(symbol)
+    if index is None:
+        index = alert_indexes[symbol] = AlertIndex()
+    return index
+
+
+def unindex(key):
+    # ключи уникальны между символами; символов единицы — проще снять везде
+    for index in alert_indexes.values():
+        index.remove(key)
+    outbox_muted.pop(key, None)
+
+
+def _pct_bounds(base_price: float, pct: float):
+    return base_price * (1 - pct), base_price * (1 + pct)
+
+
+def _subscriber_index_item(user_id: int, lang: str, base_price: float, symbol: str):
+    lower, upper = _pct_bounds(base_price, PRICE_ALERT_THRESHOLD)
+    meta = {
+        "kind": "sub",
+        "user_id": user_id,
+        "symbol": symbol,
+        "lang": lang,
+        "base_price": base_price,
+        "pct": PRICE_ALERT_THRESHOLD,
+    }
+    return ("sub", user_id, symbol), lower, upper, meta
+
+
+def _target_index_item(target: dict):
+    kind = target["kind"]
+    if kind == "pct":
+        if target["base_price"] is None:
+            return None
+        lower, upper = _pct_bounds(target["base_price"], target["value"] / 100.0)
+    elif kind == "above":
+        lower, upper = None, target["value"]
+    else:
+        lower, upper = target["value"], None
+    meta = {k: target[k] for k in ("id", "user_id", "symbol", "lang", "kind", "value", "base_price")}
+    return ("target", target["id"]), lower, upper, meta
+
+
+def index_subscriber(user_id: int, lang: str, base_price: Optional[float], symbol: str = SYMBOL):
+    if base_price is None:
+        unindex(("sub", user_id, symbol))
+        return
+    get_alert_index(symbol).add(*_subscriber_index_item(user_id, lang, base_price, symbol))
+
+
+def index_target(target: dict):
+    item = _target_index_item(target)
+    if item is None:
+        unindex(("target", target["id"]))
+        return
+    get_alert_index(target["symbol"]).add(*item)
+
+
+def load_alert_index(subs: Optional[list] = None, targets: Optional[list] = None):
+    # subs/targets — уже прочитанные строки (например, в потоке); иначе читаем сами
+    if not has_db():
+        return
+
+    if subs is None:
+        subs = get_active_subscribers()
+    if targets is None:
+        targets = get_active_targets()
+    items: dict[str, list] = {symbol: [] for symbol in alert_indexes}
+    for sub in subs:
+        if sub["base_price"] is not None:
+            item = _subscriber_index_item(sub["user_id"], sub["lang"], sub["base_price"], sub["symbol"])
+            items.setdefault(sub["symbol"], []).append(item)
+    for target in targets:
+        item = _target_index_item(target)
+        if item is not None:
+            items.setdefault(target["symbol"], []).append(item)
+
+    for symbol, symbol_items in items.items():
+        get_alert_index(symbol).load(symbol_items)
+    loaded = ", ".join(f"{coin_name(s)} {len(i)}" for s, i in alert_indexes.items() if len(i))
+    log_price.info("Alert index: triggers loaded", extra={"triggers": loaded or "none"})
+
+
+# ------------------ ПЛАНИРОВЩИК ПРОВЕРКИ ЦЕНЫ ------------------
+
+def realized_volatility(prices: List[float]) -> float:
+    # стандартное отклонение часовых лог-доходностей
+    rets = [
+        math.log(b / a)
+        for a, b in zip(prices, prices[1:])
+        if a > 0 and b > 0
+    ]
+    if len(rets) < 2:
+        return 0.0
+    return statistics.pstdev(rets)
+
+
+def next_check_interval(index: AlertIndex, price: float, volatility: float) -> float:
+    distance = index.nearest_distance(price)
+    if distance is None or volatility <= 0:
+        return PRICE_CHECK_MAX_INTERVAL
+
+    # за t секунд цена «гуляет» примерно на vol * sqrt(t / 1ч);
+    # выбираем t так, чтобы до триггера оставалось PRICE_CHECK_SIGMAS сигм
+    seconds = 3600.0 * (distance / (PRICE_CHECK_SIGMAS * volatility)) ** 2
+    return min(PRICE_CHECK_MAX_INTERVAL, max(PRICE_CHECK_MIN_INTERVAL, seconds))
+
+
+def schedule_price_check(job_queue, delay: float):
+    job_queue.run_once(check_price_job, when=delay, name="check_price")
+
+
+# ------------------ ЛИДЕР (ADVISORY LOCK) ------------------
+
+def open_lock_conn():
+    # отдельная сессия: advisory lock и LISTEN живут, пока жива сессия;
+    # keepalive ограничивает время, за которое Postgres заметит мёртвую реплику
+    conn = psycopg2.connect(
+        DATABASE_URL,
+        connect_timeout=LEADER_CONNECT_TIMEOUT,
+        keepalives=1,
+        keepalives_idle=10,
+        keepalives_interval=5,
+        keepalives_count=3,
+    )
+    conn.autocommit = True
+    return conn
+
+
+class AdvisoryLease:
+    # Лидерство = session-level pg_try_advisory_lock на выделенном соединении.
+    # Упал процесс или сеть — сессия закрывается, замок освобождается,
+    # и следующий heartbeat другой реплики его забирает.
+
+    def __init__(self, keys: list[int]):
+        self.keys = keys
+        self.held: dict[int, float] = {}  # key -> monotonic ts захвата
+        self.last_ok = 0.0
+        self.conn = None
+
+    def _reset(self):
+        try:
+            if self.conn is not None:
+                self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+        self.held.clear()
+
+    def heartbeat(self, want: int) -> set[int]:
+        # держим до want замков; возвращает только что захваченные
+        acquired = set()
+        if not store.shared:
+            # встроенная база — процесс один, замки выдаём себе без Postgres
+            for key in self.keys[:want]:
+                if key not in self.held:
+                    self.held[key] = time.monotonic()
+                    acquired.add(key)
+            self.last_ok = time.monotonic()
+            return acquired
+        try:
+            if self.conn is None or self.conn.closed:
+                self._reset()
+                self.conn = open_lock_conn()
+
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+                for key in self.keys:
+                    if len(self.held) >= want:
+                        break
+                    if key in self.held:
+                        continue
+                    cur.execute("SELECT pg_try_advisory_lock(%s);", (key,))
+                    if cur.fetchone()[0]:
+                        self.held[key] = time.monotonic()
+                        acquired.add(key)
+            self.last_ok = time.monotonic()
+        except Exception as e:
+            log_leader.warning("Leader heartbeat error", extra={"error": e})
+            self._reset()
+        return acquired
+
+    def release(self, key: int):
+        if key not in self.held:
+            return
+        if not store.shared:
+            del self.held[key]
+            return
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (key,))
+        except Exception as e:
+            log_leader.warning("Leader release error", extra={"error": e})
+            self._reset()
+            return
+        del self.held[key]
+
+    def owned(self) -> set[int]:
+        if time.monotonic() - self.last_ok > LEADER_LEASE:
+            return set()
+        return set(self.held)
+
+
+leader_lease = AdvisoryLease([LEADER_LOCK_KEY])
+
+shard_keys = [LEADER_LOCK_KEY + 1 + i for i in range(PRICE_WATCH_SHARDS)]
+random.shuffle(shard_keys)  # реплики начинают захват с разных шардов
+shard_lease = AdvisoryLease(shard_keys)
+
+
+def is_leader() -> bool:
+    return LEADER_LOCK_KEY in leader_lease.owned()
+
+
+def owned_shards() -> set[int]:
+    return {key - LEADER_LOCK_KEY - 1 for key in shard_lease.owned()}
+
+
+def shard_of(user_id: int) -> int:
+    # та же формула, по которой claim_outbox выбирает строки шардов
+    return storage.shard_of(user_id, PRICE_WATCH_SHARDS)
+
+
+def owns_user(user_id: int) -> bool:
+    if PRICE_WATCH_SHARDS <= 0:
+        return True
+    return shard_of(user_id) in owned_shards()
+
+
+def owns_price_watch() -> bool:
+    if PRICE_WATCH_SHARDS > 0:
+        return bool(owned_shards())
+    return is_leader()
+
+
+def fetch_local_state() -> dict:
+    # блокирующая часть refresh_local_state: только чтение БД, для asyncio.to_thread
+    return {
+        "subs": get_active_subscribers(),
+        "targets": get_active_targets(),
+        "outbox": get_pending_outbox(),
+    }
+
+
+def refresh_local_state(state: Optional[dict] = None):
+    # пока были ведомыми, другие реплики меняли подписки и outbox;
+    # индексы правим на event loop — их читает поток цен
+    state = state or fetch_local_state()
+    load_alert_index(state["subs"], state["targets"])
+    load_outbox_pending(state["outbox"])
+
+
+lease_lock = threading.Lock()
+
+
+def renew_leases() -> bool:
+    # блокирующий (connect + pg_try_advisory_lock на шард): из джоба — через
+    # asyncio.to_thread. True — захвачен новый замок
+    with lease_lock:
+        return _renew_leases()
+
+
+def _renew_leases() -> bool:
+    gained = bool(leader_lease.heartbeat(want=1))
+
+    if PRICE_WATCH_SHARDS > 0:
+        replicas = WORKER_REPLICAS if store.shared else 1
+        fair_share = -(-PRICE_WATCH_SHARDS // replicas)
+        # сначала честная доля, потом — осиротевшие шарды упавших реплик
+        gained |= bool(shard_lease.heartbeat(want=fair_share))
+        gained |= bool(shard_lease.heartbeat(want=PRICE_WATCH_SHARDS))
+
+        now = time.monotonic()
+        surplus = len(shard_lease.held) - fair_share
+        for key, since in sorted(shard_lease.held.items(), key=lambda kv: kv[1]):
+            if surplus <= 0:
+                break
+            if now - since > SHARD_REBALANCE_AFTER:
+                shard_lease.release(key)
+                surplus -= 1
+    return gained
+
+
+async def leader_heartbeat_job(context: ContextTypes.DEFAULT_TYPE):
+    if not has_db():
+        return
+
+    if await asyncio.to_thread(renew_leases):
+        log_leader.info("Leader state changed", extra={"leader": is_leader(), "shards": sorted(owned_shards())})
+        refresh_local_state(await asyncio.to_thread(fetch_local_state))
+
+
+def leader_only(job):
+    # фоновые джобы-синглтоны выполняет только лидер
+    async def wrapper(context: ContextTypes.DEFAULT_TYPE):
+        if not is_leader():
+            return
+        with logconfig.bind(job=job.__name__):
+            await job(context)
+
+    wrapper.__name__ = job.__name__
+    return wrapper
+
+
+# ------------------ ЛЕНТА ИЗМЕНЕНИЙ ------------------
+
+# кеши поверх БД, которые держит в актуальном состоянии лента изменений;
+# пока она не подключена, читаем БД напрямую. Ключ есть — значение загружено
+feed_caches: dict[str, Any] = {}
+
+
+def cached_leaderboard() -> List[Dict[str, Any]]:
+    if not change_feed.live:
+        return get_leaderboard(limit=LEADERBOARD_SIZE)
+    rows = feed_caches.get("leaderboard")
+    cache_hit("leaderboard", rows is not None)
+    if rows is None:
+        rows = feed_caches["leaderboard"] = get_leaderboard(limit=LEADERBOARD_SIZE)
+    return rows
+
+
+def cached_top_referrer() -> Optional[Dict[str, Any]]:
+    if not change_feed.live:
+        return get_top_referrer()
+    cache_hit("top_referrer", "top_referrer" in feed_caches)
+    if "top_referrer" not in feed_caches:
+        feed_caches["top_referrer"] = get_top_referrer()
+    return feed_caches["top_referrer"]
+
+
+def apply_tickets_change(user_id: int, tickets: int, total_ton: float):
+    # тикеты только прибавляются: топ-N обновляется точно, без перечитывания БД.
+    # Список заменяем целиком — top_cmd может сейчас итерировать старый
+    rows = feed_caches.get("leaderboard")
+    if rows is None or total_ton <= 0:
+        return
+    rows = [row for row in rows if row["user_id"] != user_id]
+    if len(rows) >= LEADERBOARD_SIZE and total_ton <= rows[-1]["total_ton"]:
+        return
+    rows.append({"user_id": user_id, "tickets": tickets, "total_ton": total_ton})
+    rows.sort(key=lambda row: row["total_ton"], reverse=True)
+    feed_caches["leaderboard"] = rows[:LEADERBOARD_SIZE]
+
+
+def apply_referral_change(referrer_id: int, count: int):
+    # счётчики тоже только растут
+    if "top_referrer" not in feed_caches:
+        return
+    top = feed_caches["top_referrer"]
+    if top is None or top["referrer_id"] == referrer_id or count > top["count"]:
+        feed_caches["top_referrer"] = {"referrer_id": referrer_id, "count": count}
+
+
+def apply_change(event: dict):
+    # события несут итоговое состояние, а не приращение: повтор или событие,
+    # уже учтённое свежей загрузкой из БД, ничего не портят
+    kind = event["e"]
+    if kind == "sub":
+        index_subscriber(event["u"], event["l"], event["b"], event["s"])
+    elif kind == "target":
+        index_target(event["t"])
+    elif kind == "unindex":
+        for key in event["k"]:
+            unindex(tuple(key))
+    elif kind == "gone":
+        for user_id in event["u"]:
+            unreachable_users.add(user_id)
+            profile_cache.pop(user_id, None)
+    elif kind == "lang":
+        user_lang[event["u"]] = normalize_lang(event["l"])
+        mark_reachable(event["u"])
+    elif kind == "tickets":
+        apply_tickets_change(event["u"], event["t"], event["ton"])
+    elif kind == "ref":
+        apply_referral_change(event["r"], event["n"])
+    # незнакомые события — от реплики новой версии во время выкладки, пропускаем
+
+
+class ChangeFeed:
+    # LISTEN на выделенном соединении (autocommit, keepalive). Сокет отдан event
+    # loop через add_reader: уведомления разбираются в том же потоке, что и
+    # хендлеры, без блокировок. Запросы по этой сессии (подключение, ping,
+    # publish) идут в потоке; на это время сокет у loop забираем. После обрыва —
+    # переподключение с backoff и пересинхронизация: пропущенные события не
+    # восстановить, поэтому кеши сбрасываются, а индекс триггеров перечитывается.
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.conn = None
+        self.fd = None
+        self.loop = None
+        self.live = False
+        self.lost = asyncio.Event()
+        self.io_lock = asyncio.Lock()  # один запрос на сессии за раз
+        self.stats = {"connects": 0, "published": 0, "received": 0, "applied": 0, "own": 0,
+                      "errors": 0, "resyncs": 0}
+
+    def _open(self):
+        conn = open_lock_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {self.channel};")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    async def connect(self):
+        conn = await asyncio.to_thread(self._open)
+        self.conn, self.fd = conn, conn.fileno()
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.fd, self.on_readable)
+        self.lost.clear()
+        self.live = True
+        self.stats["connects"] += 1
+        if self.stats["connects"] > 1:
+            self.resync()
+
+    def drop(self):
+        self.live = False
+        if self.conn is not None:
+            self.loop.remove_reader(self.fd)
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+        self.conn = None
+        feed_caches.clear()
+        self.lost.set()
+
+    def resync(self):
+        feed_caches.clear()
+        if owns_price_watch():
+            load_alert_index()
+        self.stats["resyncs"] += 1
+        log_changes.info("Change feed: reconnected, local state resynced")
+
+    def on_readable(self):
+        try:
+            self.conn.poll()
+        except Exception as e:
+            self.stats["errors"] += 1
+            log_changes.warning("Change feed connection lost", extra={"error": e})
+            self.drop()
+            return
+        self.drain()
+
+    def drain(self):
+        # psycopg2 собирает уведомления и после обычного execute на этом соединении
+        while self.conn is not None and self.conn.notifies:
+            self.handle(self.conn.notifies.pop(0).payload)
+
+    def handle(self, payload: str):
+        self.stats["received"] += 1
+        try:
+            event = json.loads(payload)
+            if event.get("o") == REPLICA_ID:
+                self.stats["own"] += 1
+                return
+            apply_change(event)
+            self.stats["applied"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            log_changes.warning("Change event error", extra={"error": e, "payload": payload[:200]})
+
+    async def execute(self, sql: str, params=()):
+        async with self.io_lock:
+            if not self.live:
+                return False
+            conn = self.conn
+            # пока запрос в потоке, on_readable не должен звать poll() на той же сессии
+            self.loop.remove_reader(self.fd)
+            try:
+                await asyncio.to_thread(self._execute, conn, sql, params)
+            finally:
+                if self.conn is conn:
+                    self.loop.add_reader(self.fd, self.on_readable)
+            self.drain()
+            return True
+
+    @staticmethod
+    def _execute(conn, sql: str, params):
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+
+    async def publish(self, kind: str, **fields):
+        # для изменений без записи в БД (язык): по уже открытой сессии, без транзакции
+        if not self.live:
+            return
+        try:
+            if await self.execute("SELECT pg_notify(%s, %s);", (self.channel, encode_change(kind, fields))):
+                self.stats["published"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            log_changes.warning("Change publish error", extra={"error": e, "kind": kind})
+            self.drop()
+
+    async def ping(self):
+        await self.execute("SELECT 1;")
+
+    async def run(self):
+        delay = STREAM_RECONNECT_MIN
+        while True:
+            try:
+                if not self.live:
+                    await self.connect()
+                    delay = STREAM_RECONNECT_MIN
+                try:
+                    await asyncio.wait_for(self.lost.wait(), timeout=CHANGE_FEED_PING)
+                except asyncio.TimeoutError:
+                    await self.ping()
+                if self.live:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                log_changes.warning("Change feed error", extra={"error": repr(e), "reconnect_in": delay})
+                self.drop()
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(STREAM_RECONNECT_MAX, delay * 2)
+
+
+change_feed = ChangeFeed(CHANGE_CHANNEL)
+
+
+def text_change_feed_stats() -> str:
+    st = change_feed.stats
+    state = "подключена" if change_feed.live else "нет"
+    return (f"Лента изменений: {state}, реплика {REPLICA_ID}, подключений {st['connects']}, "
+            f"отправлено {st['published']}, получено {st['received']} (своих {st['own']}, "
+            f"применено {st['applied']}), ошибок {st['errors']}, пересинхронизаций {st['resyncs']}")
 
 
 # ------------------ ФОНОВЫЙ ДЖОБ ------------------
 
+def build_alert_text(entry: dict, current_price: float) -> str:
+    lang = entry["lang"]
+    coin = coin_name(entry["symbol"])
+    if entry["kind"] in ("sub", "pct"):
+        base_price = entry["base_price"]
+        diff_percent = abs(current_price - base_price) / base_price * 100.0
+        return text_price_alert(lang, base_price, current_price, diff_percent, coin)
+    return text_target_reached(lang, entry["kind"], entry["value"], current_price, coin)
+
+
+def _outbox_index_key(row: dict):
+    if row["ref_kind"] == "sub":
+        return "sub", row["ref_id"], row["symbol"]
+    return "target", row["ref_id"]
+
+
+def settle_index_after_delivery(row: dict):
+    # проценты — от новой базы, абсолютные цели — одноразовые
+    key = _outbox_index_key(row)
+    outbox_pending.pop(key, None)
+    index = get_alert_index(row["symbol"])
+    entry = index.get(key)
+    if entry is None:
+        return
+    if row["ref_kind"] in ("above", "below"):
+        index.remove(key)
+    elif entry["base_price"] == row["old_base"]:
+        if row["ref_kind"] == "sub":
+            index_subscriber(entry["user_id"], entry["lang"], row["new_base"], row["symbol"])
+        else:
+            index_target(dict(entry, base_price=row["new_base"]))
+
+
+def collect_alerts(symbol: str, current_price: float) -> list[dict]:
+    index = get_alert_index(symbol)
+    alerts = []
+    for key in index.crossed(current_price):
+        entry = index.get(key)
+        if entry is None or key in outbox_pending:
+            continue
+        if not owns_user(entry["user_id"]):
+            continue
+        idem_key = alert_idem_key(entry)
+        muted = outbox_muted.get(key)
+        if muted is not None:
+            if muted == idem_key:
+                continue
+            del outbox_muted[key]
+
+        alerts.append(
+            {
+                "index_key": key,
+                "idem_key": idem_key,
+                "user_id": entry["user_id"],
+                "symbol": symbol,
+                "text": build_alert_text(entry, current_price),
+                "ref_kind": entry["kind"],
+                "ref_id": entry["user_id"] if entry["kind"] == "sub" else entry["id"],
+                "old_base": entry.get("base_price"),
+                "new_base": current_price,
+            }
+        )
+    return alerts
+
+
+async def run_price_check(context: ContextTypes.DEFAULT_TYPE) -> float:
+    # возвращает задержку до следующей проверки, сек
+    # один запрос тикера на все символы, сколько бы их ни было;
+    # в поток — только когда снимок устарел и будет запрос к Binance
+    if price_service.stale():
+        prices = await asyncio.to_thread(price_service.get_all)
+    else:
+        prices = price_service.get_all()
+    if not prices:
+        return PRICE_CHECK_RETRY_INTERVAL
+
+    alerts = []
+    delay = PRICE_CHECK_MAX_INTERVAL
+    for symbol, index in list(alert_indexes.items()):
+        current_price = prices.get(symbol)
+        if current_price is None or not len(index):
+            continue
+        alerts.extend(collect_alerts(symbol, current_price))
+
+        # свечи для волатильности — только у символов с триггерами;
+        # устаревший архив досинхронизируем в потоке, не на event loop
+        if get_candles(symbol).stale(VOLATILITY_KLINES_TTL):
+            history = await asyncio.to_thread(get_history_cached, symbol, VOLATILITY_WINDOW_HOURS)
+        else:
+            history = get_history_cached(symbol, VOLATILITY_WINDOW_HOURS)
+        volatility = realized_volatility(history + [current_price])
+        delay = min(delay, next_check_interval(index, current_price, volatility))
+
+    dispatch_alerts(context.job_queue, alerts)
+    PRICE_CHECK_ALERTS.observe(len(alerts))
+    for symbol, index in alert_indexes.items():
+        PRICE_CHECK_TRIGGERS.set(len(index), symbol=symbol)
+
+    if price_stream.connected and price_service.streaming():
+        # триггеры проверяет поток на каждой сделке; таймер — страховочный обход
+        return PRICE_CHECK_MAX_INTERVAL
+    return delay
+
+
+def dispatch_alerts(job_queue, alerts: list[dict]):
+    if not alerts:
+        return
+    # ждём доставки только вставленного: строка с тем же idem_key уже в outbox
+    # (например, 'failed' после всех попыток) повторно не отправится — такой
+    # эпизод глушим, иначе каждая проверка цены снова писала бы его в БД
+    inserted = enqueue_alerts(alerts)
+    for alert in alerts:
+        if alert["idem_key"] in inserted:
+            outbox_pending[alert["index_key"]] = alert["idem_key"]
+        else:
+            outbox_muted[alert["index_key"]] = alert["idem_key"]
+    if inserted:
+        # не ждём следующего опроса outbox
+        job_queue.run_once(drain_alert_outbox, 0)
+
+
 async def check_price_job(context: ContextTypes.DEFAULT_TYPE):
     if not has_db():
         return
 
-    current_price = get_ton_price_usd()
-    if current_price is None:
+    delay = PRICE_CHECK_MAX_INTERVAL
+    try:
+        if owns_price_watch():
+            with PRICE_CHECK_SECONDS.time():
+                delay = await run_price_check(context)
+        else:
+            # ведомая реплика: проверяем, не освободилось ли лидерство
+            delay = LEADER_HEARTBEAT_INTERVAL
+    except Exception:
+        log_price.error("Price check error", exc_info=True)
+        delay = PRICE_CHECK_RETRY_INTERVAL
+    finally:
+        # интервал подстраивается под волатильность и близость триггеров
+        PRICE_CHECK_DELAY.set(delay)
+        schedule_price_check(context.job_queue, delay)
+
+
+outbox_lock = asyncio.Lock()
+
+
+async def drain_alert_outbox(context: ContextTypes.DEFAULT_TYPE):
+    # разбирает тот, кто ставит алерты в outbox: лидер или, в режиме шардов, каждый
+    # владелец шардов — свои строки
+    if not has_db() or outbox_lock.locked() or not owns_price_watch():
         return
 
-    subscribers = get_active_subscribers()
-    if not subscribers:
+    with logconfig.bind(job="drain_alert_outbox"):
+        await drain_outbox_batches(context)
+
+
+async def drain_outbox_batches(context: ContextTypes.DEFAULT_TYPE):
+    async with outbox_lock:
+        while True:
+            batch = claim_outbox_batch()
+            if not batch:
+                return
+
+            delivered = []
+            throttled = None
+            expired = False
+            claimed_at = time.monotonic()
+            for i, row in enumerate(batch):
+                if time.monotonic() - claimed_at > OUTBOX_SENDING_LEASE / 2:
+                    # медленная пачка (ретраи, лимиты): до конца аренды другой
+                    # разбор заберёт строки и отправит их повторно — возвращаем
+                    # остаток в очередь, его заберёт следующий claim со свежей арендой
+                    release_outbox_rows(batch[i:], 0)
+                    expired = True
+                    break
+                try:
+                    await context.bot.send_message(chat_id=row["user_id"], text=row["text"])
+                    delivered.append(row)
+                    OUTBOX_MESSAGES.inc(result="sent")
+                    if len(delivered) >= OUTBOX_COMPLETE_CHUNK:
+                        complete_outbox_deliveries(delivered)
+                        delivered = []
+                except RetryAfter as e:
+                    OUTBOX_MESSAGES.inc(result="throttled")
+                    # флуд-лимит: остаток пачки откладываем без штрафа к попыткам
+                    throttled = float(e.retry_after)
+                    release_outbox_rows(batch[i:], throttled)
+                    break
+                except Exception as e:
+                    log_outbox.warning("Notify send error", extra={"chat_id": row["user_id"], "error": e})
+                    reason = classify_unreachable(e)
+                    OUTBOX_MESSAGES.inc(result="unreachable" if reason else "failed")
+                    if reason:
+                        # ретраи бессмысленны: строки outbox уйдут в 'dropped'
+                        mark_unreachable(row["user_id"], reason)
+                    else:
+                        fail_outbox_delivery(row, str(e))
+
+            complete_outbox_deliveries(delivered)
+            flush_prune_queue()
+
+            if throttled is not None or (len(batch) < OUTBOX_BATCH_SIZE and not expired):
+                return
+
+
+# ------------------ ЕЖЕДНЕВНЫЙ ДАЙДЖЕСТ ------------------
+
+digest_lock = asyncio.Lock()
+digest_stats: dict[str, Any] = {
+    "day": None,
+    "recipients": 0,
+    "sent": 0,
+    "failed": 0,
+    "unreachable": 0,
+    "throttled": 0,
+    "renders": 0,
+    "uploads": 0,
+    "build_ms": 0.0,
+    "send_s": 0.0,
+}
+
+
+def digest_keyboard(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(msg("btn_digest_off", lang), callback_data="digest:off")]])
+
+
+def build_digest_payloads() -> Optional[dict]:
+    # Всё тяжёлое — один раз на рассылку: цена, свечи, Мемляндия, график.
+    # Текст и клавиатура — по одному на язык, картинка — одна на всех.
+    # Выполняется в потоке: свечи тянутся без общих замков, под render_lock —
+    # только сам рендер, так что хендлеры графика его не ждут.
+    price = get_price_usd(SYMBOL)
+    if price is None:
+        return None
+    history = get_history_cached(SYMBOL, 25)
+    change = (price / history[0] - 1) * 100 if history and history[0] else 0.0
+
+    movers = sorted(fetch_memelandia_top(limit=DIGEST_MOVERS_POOL) or [],
+                    key=lambda c: abs(c["change_24"]), reverse=True)[:DIGEST_MOVERS]
+
+    renders = 0
+    try:
+        # картинку, уже загруженную в Telegram, шлём по file_id — без рендера
+        photo = cached_chart_file_id(SYMBOL, DIGEST_TIMEFRAME)
+        cache_hit("chart_file_id", photo is not None)
+        if photo is None:
+            photo, rendered = price_chart(SYMBOL, DIGEST_TIMEFRAME)
+            renders += rendered
+    except Exception:
+        log_digest.warning("Digest chart error", exc_info=True)
+        photo = None
+
+    payloads = {}
+    for lang in LANGS:
+        parts = [msg("digest", lang, coin=coin_name(SYMBOL), price=price, change=change)]
+        if movers:
+            lines = [msg("digest_movers", lang)]
+            lines.extend(msg("digest_mover", lang, symbol=c["symbol"], change=c["change_24"]) for c in movers)
+            parts.append("\n".join(lines))
+        payloads[lang] = {"text": "\n\n".join(parts), "reply_markup": digest_keyboard(lang)}
+    digest_stats["renders"] = renders
+    return {"photo": photo, "langs": payloads}
+
+
+async def send_digest_one(bot, user_id: int, payload: dict, lang_payload: dict):
+    if payload["photo"] is None:
+        return await bot.send_message(user_id, lang_payload["text"], reply_markup=lang_payload["reply_markup"])
+    sent = await bot.send_photo(user_id, payload["photo"], caption=lang_payload["text"],
+                                reply_markup=lang_payload["reply_markup"])
+    if not isinstance(payload["photo"], str) and getattr(sent, "photo", None):
+        # картинка загружена один раз — дальше всем по file_id
+        payload["photo"] = sent.photo[-1].file_id
+        digest_stats["uploads"] += 1
+    return sent
+
+
+async def broadcast_digest(bot, recipients: list[tuple], payload: dict, day):
+    # Ровный темп вместо залпа: интервал растягивает рассылку на DIGEST_WINDOW,
+    # но не быстрее DIGEST_MAX_RATE. Отставание (флуд-лимит, медленный API) не
+    # догоняем пачкой — просто продолжаем с тем же шагом.
+    interval = max(1 / DIGEST_MAX_RATE, DIGEST_WINDOW / max(1, len(recipients)))
+    started = time.monotonic()
+    next_at = started
+    done: list[int] = []
+
+    for user_id, lang in recipients:
+        lang_payload = payload["langs"].get(lang) or payload["langs"][DEFAULT_LANG]
+        for _ in range(3):
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_at = max(next_at, time.monotonic()) + interval
+            try:
+                await send_digest_one(bot, user_id, payload, lang_payload)
+                digest_stats["sent"] += 1
+                done.append(user_id)
+            except RetryAfter as e:
+                digest_stats["throttled"] += 1
+                next_at = time.monotonic() + float(e.retry_after)
+                continue
+            except Exception as e:
+                reason = classify_unreachable(e)
+                if reason:
+                    digest_stats["unreachable"] += 1
+                    mark_unreachable(user_id, reason)
+                else:
+                    log_digest.warning("Digest send error", extra={"chat_id": user_id, "error": e})
+                    digest_stats["failed"] += 1
+            break
+        else:
+            digest_stats["failed"] += 1
+
+        if len(done) >= DIGEST_MARK_BATCH:
+            mark_digest_sent(done, day)
+            done = []
+            flush_prune_queue()
+
+    mark_digest_sent(done, day)
+    flush_prune_queue()
+    digest_stats["send_s"] = round(time.monotonic() - started, 1)
+
+
+@leader_only
+async def digest_job(context: ContextTypes.DEFAULT_TYPE):
+    if not has_db() or digest_lock.locked():
         return
 
-    to_update: list[int] = []
+    # /digest now — не ждём DIGEST_HOUR_UTC
+    force = bool(context.job and context.job.data and context.job.data.get("force"))
+    async with digest_lock:
+        now = datetime.now(timezone.utc)
+        if now.hour < DIGEST_HOUR_UTC and not force:
+            return  # дозапуск после рестарта — только если сегодняшняя рассылка уже должна была начаться
+        day = now.date()
+        recipients = get_digest_recipients(day)
+        if not recipients:
+            return
 
-    for sub in subscribers:
-        base_price = sub["base_price"]
-        if base_price is None:
-            continue
+        started = time.perf_counter()
+        payload = await asyncio.to_thread(build_digest_payloads)
+        if payload is None:
+            log_digest.warning("Digest: no price, skipped")
+            return
+        digest_stats.update(day=day.isoformat(), recipients=len(recipients), sent=0, failed=0,
+                            unreachable=0, throttled=0, uploads=0,
+                            build_ms=round((time.perf_counter() - started) * 1000, 1))
+        log_digest.info("Digest: payloads built", extra={"recipients": len(recipients), "build_ms": digest_stats["build_ms"]})
+        await broadcast_digest(context.bot, recipients, payload, day)
+        log_digest.info("Digest: sent", extra={"sent": digest_stats["sent"], "failed": digest_stats["failed"],
+                                                "send_s": digest_stats["send_s"]})
+
+
+def text_digest_stats() -> str:
+    s = digest_stats
+    return (
+        f"Digest {s['day'] or '—'}: получателей {s['recipients']}, отправлено {s['sent']}, "
+        f"ошибок {s['failed']}, недоступны {s['unreachable']}, RetryAfter {s['throttled']}\n"
+        f"рендеров {s['renders']}, загрузок картинки {s['uploads']}, "
+        f"сборка {s['build_ms']:.0f} мс, рассылка {s['send_s']} с"
+    )
 
-        diff = abs(current_price - base_price) / base_price
-        if diff >= 0.10:
-            diff_percent = diff * 100.0
-            lang = sub["lang"]
-            user_id = sub["user_id"]
 
-            text = text_price_alert(lang, base_price, current_price, diff_percent)
+# ------------------ ПОТОК ЦЕН ------------------
+
+class PriceStream:
+    # Долгоживущее подключение к комбинированному потоку Binance. Каждая сделка
+    # обновляет снимок цен и сразу проверяет триггеры символа (O(log n), без БД,
+    # пока ничего не пересечено); свеча kline_1m дописывается в архив.
+    # После обрыва — переподключение с backoff и дозаливка пропуска по REST.
+
+    def __init__(self, url: str, symbols: list[str]):
+        self.url = url
+        self.symbols = list(symbols)
+        self.connected = False
+        self.stats = {"connects": 0, "messages": 0, "alerts": 0, "backfills": 0, "errors": 0}
+        self.last_event_lag = None  # мс от события на бирже до обработки
+        self.resyncs: dict[str, asyncio.Task] = {}  # symbol -> дозаливка дыры в свечах
+
+    def stream_url(self) -> str:
+        streams = []
+        for symbol in self.symbols:
+            streams += [f"{symbol.lower()}@aggTrade", f"{symbol.lower()}@kline_1m"]
+        return f"{self.url}?streams={'/'.join(streams)}"
+
+    def backfill(self):
+        # пропущенные за время обрыва минуты — одним запросом klines на символ,
+        # и только для архивов, которые уже кто-то использует. Блокирующий:
+        # run() зовёт его через asyncio.to_thread
+        for archive in list(candle_archives.values()):
+            if len(archive.levels["1m"]["t"]):
+                try:
+                    archive.sync(max_age=0)
+                except Exception as e:
+                    log_stream.warning("Candle backfill error", extra={"error": e})
+        self.stats["backfills"] += 1
+
+    def on_trade(self, app: Application, symbol: str, price: float, event_ms: int):
+        price_service.update(symbol, price)
+        self.last_event_lag = time.time() * 1000 - event_ms
+
+        index = alert_indexes.get(symbol)
+        if index is None or not len(index) or not has_db() or not owns_price_watch():
+            return
+        alerts = collect_alerts(symbol, price)
+        if alerts:
+            self.stats["alerts"] += len(alerts)
+            dispatch_alerts(app.job_queue, alerts)
+
+    def on_kline(self, symbol: str, kline: dict):
+        archive = candle_archives.get(symbol)
+        if archive is not None and not archive.apply_kline(kline):
+            self.resync(archive)
+
+    def resync(self, archive: CandleArchive):
+        # дыру дозаливаем по REST в потоке: приём сообщений сеть не ждёт;
+        # пока дозаливка идёт, следующие свечи с той же дырой её не дублируют
+        task = self.resyncs.get(archive.symbol)
+        if task is not None and not task.done():
+            return
+        self.resyncs[archive.symbol] = asyncio.get_running_loop().create_task(self.resync_archive(archive))
+
+    async def resync_archive(self, archive: CandleArchive):
+        try:
+            await asyncio.to_thread(archive.sync, 0)
+        except Exception as e:
+            self.stats["errors"] += 1
+            log_stream.warning("Candle resync error", extra={"error": e})
+
+    def handle(self, app: Application, raw: str):
+        payload = json.loads(raw)
+        data = payload.get("data", payload)
+        event = data.get("e")
+        self.stats["messages"] += 1
+        if event == "aggTrade":
+            self.on_trade(app, data["s"], float(data["p"]), int(data["E"]))
+        elif event == "kline":
+            self.on_kline(data["s"], data["k"])
+
+    async def run(self, app: Application):
+        try:
+            import websockets
+        except ImportError:
+            log_stream.warning("websockets не установлен — цены только по REST")
+            return
+
+        delay = STREAM_RECONNECT_MIN
+        while True:
             try:
-                await context.bot.send_message(chat_id=user_id, text=text)
-                to_update.append(user_id)
+                async with websockets.connect(self.stream_url(), ping_interval=20, max_queue=None) as ws:
+                    self.connected = True
+                    self.stats["connects"] += 1
+                    delay = STREAM_RECONNECT_MIN
+                    if self.stats["connects"] > 1:
+                        log_stream.info("Price stream: reconnected")
+                        await asyncio.to_thread(self.backfill)
+                    while True:
+                        raw = await asyncio.wait_for(ws.recv(), timeout=STREAM_STALE_AFTER)
+                        try:
+                            self.handle(app, raw)
+                        except Exception as e:
+                            self.stats["errors"] += 1
+                            log_stream.warning("Price stream message error", extra={"error": e})
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                print(f"Notify send error for {user_id}:", e)
+                self.stats["errors"] += 1
+                log_stream.warning("Price stream error", extra={"error": repr(e), "reconnect_in": delay})
+            finally:
+                self.connected = False
+            # пока потока нет, PriceService сам откатывается на REST-снимок
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(STREAM_RECONNECT_MAX, delay * 2)
+
+
+price_stream = PriceStream(BINANCE_STREAM_URL, PRICE_SYMBOLS)
+
+
+def text_price_stream_stats() -> str:
+    st = price_stream.stats
+    lag = "—" if price_stream.last_event_lag is None else f"{price_stream.last_event_lag:.0f} мс"
+    return (
+        f"Поток цен: {'онлайн' if price_stream.connected else 'офлайн (REST)'}, "
+        f"подключений {st['connects']}, сообщений {st['messages']}, алертов {st['alerts']}, "
+        f"дозаливок {st['backfills']}, ошибок {st['errors']}, задержка {lag}"
+    )
+
+
+# ------------------ СНИМОК СОСТОЯНИЯ ------------------
+
+snapshot_lock = asyncio.Lock()
+snapshot_stats: dict[str, Any] = {"written": 0, "bytes": 0, "write_ms": 0.0, "restored": {}}
+
+
+def collect_snapshot_state() -> dict:
+    # на event loop: только поверхностные копии, массивы собирает поток
+    return {
+        "mono": time.monotonic(),
+        "user_lang": dict(user_lang),
+        "prices": dict(price_service.prices),
+        "prices_fetched_at": price_service.fetched_at,
+        "charts": dict(chart_cache),
+        "file_ids": dict(chart_file_ids),
+        "profiles": dict(profile_cache),
+        "unreachable": list(unreachable_users),
+        "archives": {symbol: (dict(a.levels), a.synced_at) for symbol, a in candle_archives.items()},
+    }
+
+
+def snapshot_layout() -> list:
+    # раскладка массивов снимка: версия формата и уровни свечей
+    return [SNAPSHOT_VERSION, LEVEL_MS]
+
+
+def drop_restored_caches():
+    # при старте, если снимок не подошёл: кеши греются заново, как без снимка
+    unreachable_users.clear()
+    profile_cache.clear()
+    chart_cache.clear()
+    chart_file_ids.clear()
+    candle_archives.clear()
+    with price_service.lock:
+        price_service.prices = {}
+        price_service.fetched_at = 0.0
+
+
+def write_snapshot(state: dict, path: str = SNAPSHOT_PATH) -> int:
+    # монотонные отметки сохраняем как возраст на момент записи
+    mono = state["mono"]
+    codes = {lang: i for i, lang in enumerate(LANGS)}
+    arrays, blobs = {}, {}
+    meta = {"langs": list(LANGS), "chart_profile": [CHART_PROFILE["name"], CHART_PROFILE["format"]],
+            "layout": snapshot_layout()}
+
+    users = state["user_lang"]
+    arrays["user_lang.ids"] = np.fromiter(users.keys(), dtype=np.int64, count=len(users))
+    arrays["user_lang.codes"] = np.fromiter((codes.get(lang, 0) for lang in users.values()),
+                                            dtype=np.uint8, count=len(users))
+    arrays["unreachable"] = np.array(state["unreachable"], dtype=np.int64)
+
+    profiles = state["profiles"]
+    arrays["profiles.ids"] = np.fromiter(profiles.keys(), dtype=np.int64, count=len(profiles))
+    arrays["profiles.ages"] = np.fromiter((mono - ts for _, ts in profiles.values()),
+                                          dtype=np.float64, count=len(profiles))
+    # None (имени нет) — пустая строка: настоящие имена не пустые
+    blobs["profiles.names"] = "\0".join(name or "" for name, _ in profiles.values()).encode()
+
+    meta["prices"] = state["prices"]
+    meta["prices_age"] = mono - state["prices_fetched_at"]
+
+    meta["charts"] = []
+    for (symbol, timeframe), (ts, img) in state["charts"].items():
+        file_id = state["file_ids"].get((symbol, timeframe))
+        meta["charts"].append({
+            "symbol": symbol, "timeframe": timeframe, "age": mono - ts,
+            # file_id годен только для той же картинки
+            "file_id": file_id[1] if file_id and file_id[0] == ts else None,
+        })
+        blobs[f"chart.{symbol}.{timeframe}"] = img
+
+    meta["archives"] = {}
+    for symbol, (levels, synced_at) in state["archives"].items():
+        meta["archives"][symbol] = {"synced_age": mono - synced_at}
+        for level, candles in levels.items():
+            for key, values in candles.items():
+                arrays[f"candles.{symbol}.{level}.{key}"] = values
+
+    return snapshot.write(path, meta, arrays, blobs)
+
+
+def restore_snapshot(path: str = SNAPSHOT_PATH) -> dict:
+    # -> что поднято; отметки времени переводим в монотонные часы нового процесса
+    # с учётом простоя, поэтому TTL кешей продолжают тикать, как без рестарта
+    try:
+        snap = snapshot.Snapshot(path)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log_snapshot.warning("Snapshot unreadable, starting cold", extra={"error": e, "path": path})
+        return {}
 
-    for user_id in to_update:
-        update_base_price(user_id, current_price)
+    try:
+        return _restore_snapshot(snap)
+    except Exception as e:
+        # снимок другой раскладки без отметки layout (KeyError, IndexError…) — не повод не стартовать
+        log_snapshot.warning("Snapshot does not match, caches start cold", extra={"error": e, "path": path})
+        drop_restored_caches()
+        return {"user_lang": len(user_lang)}
+
+
+def _restore_snapshot(snap: snapshot.Snapshot) -> dict:
+    downtime = max(0.0, snap.age)
+    now = time.monotonic()
+    meta = snap.meta
+    restored = {"age_s": round(downtime)}
+
+    def since(age: float) -> float:
+        return now - age - downtime
+
+    # язык — настройка пользователя, а не кеш: поднимаем при любом возрасте
+    langs = meta["langs"]
+    ids = snap.array("user_lang.ids").tolist()
+    codes = snap.array("user_lang.codes").tolist()
+    for user_id, code in zip(ids, codes):
+        user_lang.setdefault(user_id, normalize_lang(langs[code]))
+    restored["user_lang"] = len(ids)
+
+    if downtime > SNAPSHOT_MAX_AGE:
+        log_snapshot.info("Snapshot too old, caches skipped", extra=restored)
+        return restored
+    if meta.get("layout") != snapshot_layout():
+        log_snapshot.info("Snapshot layout changed, caches skipped", extra=restored)
+        return restored
+
+    unreachable_users.update(snap.array("unreachable").tolist())
+    restored["unreachable"] = len(unreachable_users)
+
+    if meta["prices"] and meta["prices_age"] + downtime < price_service.ttl:
+        with price_service.lock:
+            price_service.prices = {s: p for s, p in meta["prices"].items() if s in PRICE_SYMBOLS}
+            price_service.fetched_at = since(meta["prices_age"])
+        restored["prices"] = len(price_service.prices)
+
+    profiles = 0
+    names = snap.blob("profiles.names").decode().split("\0")
+    for user_id, age, name in zip(snap.array("profiles.ids").tolist(), snap.array("profiles.ages").tolist(), names):
+        if age + downtime < PROFILE_CACHE_TTL:
+            profile_cache[user_id] = (name or None, since(age))
+            profiles += 1
+    restored["profiles"] = profiles
+
+    charts = file_ids = 0
+    # картинки другого профиля (размер, формат) не подходят
+    if meta["chart_profile"] == [CHART_PROFILE["name"], CHART_PROFILE["format"]]:
+        for entry in meta["charts"]:
+            symbol, timeframe = entry["symbol"], entry["timeframe"]
+            tf = CHART_TIMEFRAMES.get(timeframe)
+            if tf is None or symbol not in PRICE_SYMBOLS or entry["age"] + downtime >= tf["ttl"]:
+                continue
+            ts = since(entry["age"])
+            chart_cache[(symbol, timeframe)] = (ts, snap.blob(f"chart.{symbol}.{timeframe}"))
+            charts += 1
+            if entry["file_id"]:
+                chart_file_ids[(symbol, timeframe)] = (ts, entry["file_id"])
+                file_ids += 1
+    restored["charts"] = charts
+    restored["file_ids"] = file_ids
+
+    archives = 0
+    now_ms = time.time() * 1000
+    for symbol, info in meta["archives"].items():
+        if symbol not in PRICE_SYMBOLS:
+            continue
+        levels = {
+            level: {key: snap.array(f"candles.{symbol}.{level}.{key}") for key in ("t", "o", "h", "l", "c")}
+            for level in LEVEL_MS
+        }
+        minutes = levels["1m"]["t"]
+        # дыру длиннее одного запроса sync() всё равно перезальёт целиком
+        if len(minutes) == 0 or (now_ms - minutes[-1]) / LEVEL_MS["1m"] >= LEVEL_SEED["1m"]:
+            continue
+        archive = CandleArchive(symbol)
+        archive.levels = levels  # массивы — окна в mmap, merge_candles создаёт новые
+        archive.synced_at = since(info["synced_age"])
+        candle_archives[symbol] = archive
+        archives += 1
+    restored["archives"] = archives
+
+    log_snapshot.info("Snapshot restored", extra=restored)
+    return restored
+
+
+async def save_snapshot():
+    if not SNAPSHOT_PATH:
+        return
+    async with snapshot_lock:
+        state = collect_snapshot_state()
+        started = time.perf_counter()
+        try:
+            size = await asyncio.to_thread(write_snapshot, state)
+        except Exception as e:
+            log_snapshot.error("Snapshot write error", extra={"error": e, "path": SNAPSHOT_PATH})
+            return
+        snapshot_stats.update(written=snapshot_stats["written"] + 1, bytes=size,
+                              write_ms=round((time.perf_counter() - started) * 1000, 1))
+        log_snapshot.info("Snapshot written", extra={"bytes": size, "write_ms": snapshot_stats["write_ms"],
+                                                     "users": len(state["user_lang"])})
+
+
+async def snapshot_job(context: ContextTypes.DEFAULT_TYPE):
+    await save_snapshot()
+
+
+def text_snapshot_stats() -> str:
+    if not SNAPSHOT_PATH:
+        return "Снимок состояния: выключен"
+    restored = ", ".join(f"{k} {v}" for k, v in snapshot_stats["restored"].items()) or "—"
+    return (
+        f"Снимок состояния: поднято при старте: {restored}; записей {snapshot_stats['written']}, "
+        f"{snapshot_stats['bytes'] / 1024:.0f} КБ за {snapshot_stats['write_ms']:.0f} мс"
+    )
 
 
 # ------------------ MAIN ------------------
 
-def main():
-    init_db()
+startup_budget: dict[str, float] = {}  # этап -> мс
+
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+def budget_mark(stage: str, since: float = BOOT_STARTED):
+    startup_budget[stage] = round((time.perf_counter() - since) * 1000, 1)
+
+
+def text_startup_budget() -> str:
+    lines = ["Старт (мс от запуска процесса / длительность фона):"]
+    for stage, ms in startup_budget.items():
+        lines.append(f"• {stage}: {ms:.0f}")
+    return "\n".join(lines)
+
+
+async def mark_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if "first_update" in startup_budget:
+        return
+    budget_mark("first_update")
+    log_startup.info("Startup: first update", extra={"after_ms": round(startup_budget["first_update"])})
+
+
+def start_background_jobs(app: Application):
+    if app.job_queue is not None and has_db():
+        app.job_queue.run_repeating(leader_heartbeat_job, interval=LEADER_HEARTBEAT_INTERVAL, first=0)
+        schedule_price_check(app.job_queue, 60)
+        app.job_queue.run_repeating(drain_alert_outbox, interval=OUTBOX_POLL_INTERVAL, first=5)
+        app.job_queue.run_daily(digest_job, time=dtime(hour=DIGEST_HOUR_UTC, tzinfo=timezone.utc))
+        # рестарт посреди рассылки: недоотправленным дошлём, когда лидерство уже взято
+        app.job_queue.run_once(digest_job, LEADER_HEARTBEAT_INTERVAL * 3)
+    else:
+        log_startup.warning("Job queue or DB not available — background notifications disabled")
+
+
+async def warmup(app: Application):
+    # всё тяжёлое — после того, как бот начал принимать апдейты
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(init_db)
+    except Exception:
+        log_startup.error("init_db error", exc_info=True)
+    budget_mark("init_db", started)
+    # слушаем ленту до загрузки индекса: события за время загрузки не теряются
+    if has_db() and store.shared and CHANGE_FEED_ENABLED:
+        try:
+            await change_feed.connect()
+        except Exception as e:
+            log_changes.warning("Change feed connect error", extra={"error": e})
+        app.create_task(change_feed.run())
+    # индекс триггеров и outbox грузятся при захвате лидерства
+    start_background_jobs(app)
+    if SNAPSHOT_PATH and app.job_queue is not None:
+        app.job_queue.run_repeating(snapshot_job, interval=SNAPSHOT_INTERVAL, first=SNAPSHOT_INTERVAL)
+    if PRICE_STREAM_ENABLED:
+        app.create_task(price_stream.run(app))
+
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(prewarm_charts)
+    except Exception:
+        log_startup.error("Chart prewarm error", exc_info=True)
+    budget_mark("charts_prewarm", started)
+    log_startup.info("Startup: background warmup done", extra={
+        "init_db_ms": round(startup_budget["init_db"]),
+        "charts_prewarm_ms": round(startup_budget["charts_prewarm"]),
+    })
+
+
+async def post_init(app: Application):
+    budget_mark("ready")
+    log_startup.info("Startup: ready to poll", extra={
+        "imports_ms": round(startup_budget["imports"]),
+        "app_build_ms": round(startup_budget["app_build"]),
+        "ready_ms": round(startup_budget["ready"]),
+    })
+    app.create_task(warmup(app))
+
+
+async def post_shutdown(app: Application):
+    # остановка по SIGTERM при деплое: следующий процесс стартует с тёплыми кешами
+    await save_snapshot()
+    if store is not None:
+        write_buffer.flush()
+        store.close()
+
+
+def register_handlers(app: Application):
+    # общий набор для main() и нагрузочного стенда (bench/loadgen.py)
+    app.add_handler(TypeHandler(Update, mark_first_update), group=-1)
+    # в группе срабатывает один хендлер — отдельная группа
+    app.add_handler(TypeHandler(Update, mark_reachable_update), group=-2)
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("price", price_cmd))
     app.add_handler(CommandHandler("chart", chart_cmd))
+    app.add_handler(CommandHandler("subscribe", subscribe_cmd))
+    app.add_handler(CommandHandler("digest", digest_cmd))
     app.add_handler(CommandHandler("mytickets", my_tickets_cmd))
     app.add_handler(CommandHandler("buytickets", buy_tickets_cmd))
     app.add_handler(CommandHandler("reflink", ref_link_cmd))
     app.add_handler(CommandHandler("top", top_cmd))
     app.add_handler(CommandHandler("referrals", referrals_cmd))
+    app.add_handler(CommandHandler("alert", alert_cmd))
+    app.add_handler(CommandHandler("alerts", alerts_cmd))
+    app.add_handler(CommandHandler("alert_del", alert_del_cmd))
+    app.add_handler(CommandHandler("botstats", botstats_cmd))
+    app.add_handler(CommandHandler("profile", profile_cmd))
 
     app.add_handler(CallbackQueryHandler(callback_handler))
+    app.add_handler(InlineQueryHandler(inline_query_handler))
 
     app.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND, footer_buttons_handler)
     )
 
-    if app.job_queue is not None and has_db():
-        app.job_queue.run_repeating(check_price_job, interval=300, first=60)
-    else:
-        print("Job queue or DB not available — background notifications disabled")
 
+def main():
+    global store
+    logconfig.setup()
+    budget_mark("imports")
+    store = open_store()
+    started = time.perf_counter()
+    if SNAPSHOT_PATH:
+        snapshot_stats["restored"] = restore_snapshot()
+        budget_mark("snapshot_restore", started)
+        started = time.perf_counter()
+    app = ApplicationBuilder().token(BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
+    register_handlers(app)
+
+    if METRICS_PORT:
+        try:
+            metrics.start_http_server(METRICS_PORT, METRICS_HOST)
+            log_startup.info("Metrics endpoint started", extra={"url": f"http://{METRICS_HOST}:{METRICS_PORT}/metrics"})
+        except OSError as e:
+            log_startup.error("Metrics server error", extra={"error": e})
+
+    budget_mark("app_build", started)
     app.run_polling()
 
 
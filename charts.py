@@ -0,0 +1,186 @@
+import io
+import threading
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+import matplotlib.dates as mdates  # noqa: E402
+from matplotlib.figure import Figure  # noqa: E402
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: E402
+
+# Рендер графиков через matplotlib. Модуль импортируется лениво (bot.get_charts):
+# импорт matplotlib и сборка кеша шрифтов не должны задерживать старт бота.
+
+
+def reset_subplot_params(fig: Figure):
+    # tight_layout считает поля от текущей раскладки — начинаем всегда с дефолтной,
+    # иначе переиспользуемая фигура даст другие пиксели, чем свежая
+    params = matplotlib.rcParams
+    fig.subplots_adjust(
+        left=params["figure.subplot.left"],
+        right=params["figure.subplot.right"],
+        bottom=params["figure.subplot.bottom"],
+        top=params["figure.subplot.top"],
+        wspace=params["figure.subplot.wspace"],
+        hspace=params["figure.subplot.hspace"],
+    )
+
+
+def figure_size(profile: dict, aspect: float) -> tuple:
+    width = profile["width"] / profile["dpi"]
+    return width, width * aspect
+
+
+def encode_figure(fig: Figure, profile: dict) -> bytes:
+    buf = io.BytesIO()
+    fmt = profile["format"]
+
+    if fmt in ("jpeg", "webp"):
+        fig.savefig(
+            buf,
+            format=fmt,
+            bbox_inches="tight",
+            pil_kwargs={"quality": profile["quality"], "optimize": True} if fmt == "jpeg"
+            else {"quality": profile["quality"], "method": 4},
+        )
+        return buf.getvalue()
+
+    if profile["colors"]:
+        # палитра: рендерим без сжатия, квантуем и жмём уже индексированную картинку
+        from PIL import Image
+
+        fig.savefig(buf, format="png", bbox_inches="tight", pil_kwargs={"compress_level": 0})
+        buf.seek(0)
+        image = Image.open(buf).convert("RGB").quantize(colors=profile["colors"])
+        out = io.BytesIO()
+        image.save(out, format="PNG", optimize=True, compress_level=profile["compress_level"] or 6)
+        return out.getvalue()
+
+    if profile["compress_level"] is None:
+        fig.savefig(buf, format="png", bbox_inches="tight")
+    else:
+        fig.savefig(buf, format="png", bbox_inches="tight",
+                    pil_kwargs={"compress_level": profile["compress_level"]})
+    return buf.getvalue()
+
+
+class MemelandiaChartRenderer:
+    # Фигура, оси и подписи строятся один раз; на рендер меняются только
+    # длины/цвета баров, подписи тикеров и текст процентов.
+
+    def __init__(self, profile: dict):
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.fig = Figure(figsize=figure_size(profile, 5 / 9), dpi=profile["dpi"])
+        FigureCanvasAgg(self.fig)
+        self.fig.patch.set_facecolor("#FFFFFF")
+
+        self.ax = self.fig.add_subplot()
+        self.ax.set_facecolor("#F5FAFF")
+        self.ax.axvline(0, color="#9CA3AF", linewidth=0.8)
+        self.ax.set_xlabel("24h %")
+        self.ax.set_title("Memelandia Top-5 — 24h change")
+
+        self.bars = None
+        self.labels = []
+
+    def _build_bars(self, count: int):
+        if self.bars is not None:
+            self.bars.remove()
+            for label in self.labels:
+                label.remove()
+        positions = range(count)
+        self.bars = self.ax.barh(positions, [0] * count)
+        self.ax.set_yticks(positions)
+        self.labels = [
+            self.ax.text(0, i, "", va="center", fontsize=8) for i in positions
+        ]
+
+    def render(self, coins: list[dict]) -> bytes:
+        labels = [c["symbol"] for c in coins]
+        values = [c["change_24"] for c in coins]
+
+        with self.lock:
+            if self.bars is None or len(self.bars) != len(values):
+                self._build_bars(len(values))
+
+            for bar, label, v in zip(self.bars, self.labels, values):
+                bar.set_width(v)
+                bar.set_facecolor("#EF4444" if v < 0 else "#22C55E")
+                label.set_x(v + (0.3 if v >= 0 else -0.3))
+                label.set_text(f"{v:+.1f}%")
+                label.set_ha("left" if v >= 0 else "right")
+            self.ax.set_yticklabels(labels)
+
+            self.ax.relim()
+            self.ax.autoscale_view()
+
+            reset_subplot_params(self.fig)
+            self.fig.tight_layout()
+            return encode_figure(self.fig, self.profile)
+
+
+class PriceChartRenderer:
+    # Стилизованная фигура живёт между рендерами: на каждый график меняем
+    # только данные линии и заливки, пределы осей и подпись цены.
+
+    line_color = "#3B82F6"
+
+    def __init__(self, profile: dict):
+        self.profile = profile
+        self.lock = threading.Lock()
+        plt.style.use("default")
+        self.fig = Figure(figsize=figure_size(profile, 6 / 9), dpi=profile["dpi"])
+        FigureCanvasAgg(self.fig)
+        self.fig.patch.set_facecolor("#FFFFFF")
+
+        ax = self.ax = self.fig.add_subplot()
+        ax.set_facecolor("#F5FAFF")
+
+        self.line = None
+        self.fill = None
+
+        ax.grid(True, linewidth=0.3, alpha=0.25)
+
+        ax.spines["top"].set_visible(False)
+        ax.spines["right"].set_visible(False)
+        ax.spines["bottom"].set_color("#D0D7E2")
+        ax.spines["left"].set_color("#D0D7E2")
+
+        ax.tick_params(axis="x", colors="#6B7280", labelsize=8)
+        ax.tick_params(axis="y", colors="#6B7280", labelsize=8)
+
+        self.label = self.fig.text(0.01, -0.04, "", fontsize=12, color="#111827", ha="left")
+
+    def _set_data(self, times, prices):
+        ax = self.ax
+        baseline = min(prices)
+        if self.line is None:
+            # первый рендер: ось X получает конвертер дат от реальных данных
+            (self.line,) = ax.plot(times, prices, linewidth=2.3, color=self.line_color)
+            self.fill = ax.fill_between(times, prices, baseline, color=self.line_color, alpha=0.22)
+            # подписи дат не налезают друг на друга на длинных таймфреймах
+            locator = mdates.AutoDateLocator()
+            ax.xaxis.set_major_locator(locator)
+            ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+            return
+
+        self.line.set_data(times, prices)
+        if hasattr(self.fill, "set_data"):
+            self.fill.set_data(times, prices, baseline)
+        else:
+            # matplotlib < 3.10: у заливки нет set_data
+            self.fill.remove()
+            self.fill = ax.fill_between(times, prices, baseline, color=self.line_color, alpha=0.22)
+        ax.relim()
+        ax.autoscale_view()
+
+    def render(self, times, prices, label: str) -> bytes:
+        with self.lock:
+            self._set_data(times, prices)
+            self.label.set_text(label)
+
+            reset_subplot_params(self.fig)
+            self.fig.tight_layout(pad=1.5)
+            return encode_figure(self.fig, self.profile)
@@ -0,0 +1,188 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Логи в JSON (по строке на запись) через очередь: event loop только кладёт
+# запись в SimpleQueue, форматирует и пишет в stdout фоновый поток QueueListener.
+#
+# Контекст запроса (user_id, action, ...) — в contextvars: каждая задача asyncio
+# видит свой. Фильтр в потоке вызова копирует его в запись и добавляет latency_ms
+# от начала запроса. Повторяющиеся предупреждения и ошибки с одного места
+# (логгер + шаблон сообщения + тип ошибки) прореживаются: в окне
+# LOG_SAMPLE_WINDOW пропускаем первые LOG_SAMPLE_BURST, остальные считаем, и
+# следующая пропущенная запись несёт suppressed=N.
+#
+#   LOG_FORMAT=json|text, LOG_LEVEL=INFO, LOG_LEVELS="price=DEBUG,outbox=WARNING"
+
+ROOT = "tonmetric"
+# библиотечный шум: httpx пишет INFO на каждый запрос к Bot API
+LIBRARY_LEVELS = {"httpx": logging.WARNING, "telegram": logging.WARNING, "apscheduler": logging.WARNING}
+
+request_context: contextvars.ContextVar = contextvars.ContextVar("request_context", default=None)
+
+# атрибуты LogRecord, которые не считаем «полями» записи
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def get_logger(subsystem: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{subsystem}")
+
+
+@contextmanager
+def bind(**fields):
+    # поля наследуются вложенными bind и задачами, созданными внутри
+    parent = request_context.get()
+    context = dict(parent or {}, **fields)
+    context.setdefault("_started", time.perf_counter())
+    token = request_context.set(context)
+    try:
+        yield context
+    finally:
+        request_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    def __init__(self, window: float = 60.0, burst: int = 5):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.lock = threading.Lock()  # пишут и из asyncio.to_thread
+        self.seen: dict[tuple, list] = {}  # key -> [начало окна, пропущено в окне, подавлено]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = request_context.get()
+        if context:
+            for key, value in context.items():
+                if key == "_started":
+                    record.latency_ms = round((time.perf_counter() - value) * 1000, 1)
+                elif not hasattr(record, key):
+                    setattr(record, key, value)
+        if record.levelno < logging.WARNING:
+            return True
+
+        error = getattr(record, "error", None)
+        exc_type = record.exc_info[0].__name__ if record.exc_info else type(error).__name__ if error is not None else ""
+        key = (record.name, record.msg, exc_type)
+        now = time.monotonic()
+        with self.lock:
+            state = self.seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                state = self.seen[key] = [now, 0, 0]
+                if len(self.seen) > 10_000:  # шаблонов конечное число; страховка от утечки
+                    self.seen = {key: state}
+            else:
+                suppressed = 0
+            if state[1] >= self.burst:
+                state[2] += 1
+                return False
+            state[1] += 1
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+JsonFormatter.converter = time.gmtime
+
+
+class TextFormatter(logging.Formatter):
+    # для локального запуска: «сообщение key=value ...»
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname[0]} {record.name}: {record.getMessage()}"
+        fields = [f"{k}={v}" for k, v in record.__dict__.items() if k not in _RECORD_ATTRS and not k.startswith("_")]
+        if fields:
+            line += " " + " ".join(fields)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # в потоке вызова — только подстановка аргументов; трейсбек форматирует слушатель
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def parse_levels(raw: str) -> dict[str, int]:
+    levels = {}
+    for part in raw.split(","):
+        name, _, level = part.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+listener = None
+
+
+def setup(level: str = None, levels: str = None, fmt: str = None, stream=None):
+    global listener
+    if listener is not None:
+        return listener
+
+    formatter = TextFormatter() if (fmt or os.getenv("LOG_FORMAT", "json")) == "text" else JsonFormatter()
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    handler = AsyncQueueHandler(log_queue)
+    handler.addFilter(ContextFilter(
+        window=float(os.getenv("LOG_SAMPLE_WINDOW", "60")),
+        burst=int(os.getenv("LOG_SAMPLE_BURST", "5")),
+    ))
+
+    # в потоке вызова не собираем то, что в JSON не попадает: файл и строку вызова
+    # (обход стека на каждую запись), pid, имя процесса, задачу asyncio
+    logging._srcfile = None
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging.logAsyncioTasks = False
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(logging.WARNING)
+    logging.getLogger(ROOT).setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    for name, value in LIBRARY_LEVELS.items():
+        logging.getLogger(name).setLevel(value)
+    # подсистемы: price, outbox, chart, db, leader, digest, stream, payments, users, handlers, ...
+    for name, value in parse_levels(levels if levels is not None else os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name if name in LIBRARY_LEVELS else f"{ROOT}.{name}").setLevel(value)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(shutdown)
+    return listener
+
+
+def shutdown():
+    # дописываем хвост очереди перед выходом
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
@@ -0,0 +1,452 @@
+import math
+import string
+
+# Каталог сообщений: шаблоны по языкам компилируются один раз при импорте.
+# Поиск — один dict-lookup по (key, lang); фолбэки (нет языка, нет перевода)
+# разрешены заранее, при компиляции. Новый язык — новые строки здесь, без правки хендлеров.
+#
+# Параметры — как в str.format: {name}, {name:.2f}. Свои преобразования:
+#   {x!p} — цена (format_price), {x!d} — изменение в % со знаком, «+» только у роста.
+
+LANGS = ("ru", "en", "uk")
+DEFAULT_LANG = "ru"
+
+CATALOG = {
+    # ---- язык и меню
+    "choose_language": {
+        "ru": "Выберите язык / Select language / Оберіть мову:",
+    },
+    "lang_confirm": {
+        "en": "Language: English ✅\nLoading TON price and chart…",
+        "uk": "Мова: Українська ✅\nЗавантажую курс та графік TON…",
+        "ru": "Язык: Русский ✅\nЗагружаю курс и график TON…",
+    },
+    "menu_prompt": {
+        "en": "Choose an action:",
+        "uk": "Оберіть дію:",
+        "ru": "Выберите действие:",
+    },
+    "btn_price_ton": {"en": "TON price $", "uk": "Курс $TON", "ru": "Курс $TON"},
+    "btn_notify": {"en": "Notifications", "uk": "Сповіщення", "ru": "Уведомления"},
+    "btn_wallet": {"en": "Wallet", "uk": "Гаманець", "ru": "Кошелёк"},
+    "btn_referrals": {"en": "Referrals", "uk": "Реферали", "ru": "Рефералы"},
+    "btn_memland": {"en": "Memelandia🦄", "uk": "Мемляндія🦄", "ru": "Мемляндия🦄"},
+    "btn_buy_tickets": {"en": "Buy tickets 🎫", "uk": "Купити квитки 🎫", "ru": "Купить тикеты 🎫"},
+    "btn_leaderboard": {"ru": "🏆"},
+    "btn_unsubscribe": {"en": "Unsubscribe", "uk": "Відписатися", "ru": "Отписаться"},
+    "wallet_link": {
+        "en": "Open wallet: http://t.me/send?start=r-71wfg",
+        "uk": "Відкрити гаманець: http://t.me/send?start=r-71wfg",
+        "ru": "Открыть кошелёк: http://t.me/send?start=r-71wfg",
+    },
+
+    # ---- цена и графики
+    "price_ok": {"ru": "1 {coin} = {price!p} $"},
+    "price_usage": {"ru": "/price [{coins} | all]\n/chart [{coins}] [{timeframes}]"},
+    "price_error": {
+        "en": "Can't get {coin} price now 🙈",
+        "uk": "Не можу отримати курс {coin} 🙈",
+        "ru": "Не могу получить курс {coin} 🙈",
+    },
+    "chart_build": {
+        "en": "Building {coin} chart… 📈",
+        "uk": "Будую графік {coin}… 📈",
+        "ru": "Строю график {coin}… 📈",
+    },
+    "chart_error": {
+        "en": "Can't build chart 🙈",
+        "uk": "Не вдалося побудувати графік 🙈",
+        "ru": "Не удалось построить график 🙈",
+    },
+
+    # ---- подписка ±10%
+    "subscribed": {
+        "en": (
+            "Notifications are ON ✅\n\n"
+            "We will notify you when {coin} price changes more than 10% from {base!p} $.\n\n"
+            "To stop notifications, press «Unsubscribe»."
+        ),
+        "uk": (
+            "Сповіщення увімкнено ✅\n\n"
+            "Ми повідомимо, коли ціна {coin} зміниться більш ніж на 10% від {base!p} $.\n\n"
+            "Щоб вимкнути сповіщення, натисніть «Відписатися»."
+        ),
+        "ru": (
+            "Уведомления включены ✅\n\n"
+            "Мы сообщим, когда цена {coin} изменится более чем на 10% от {base!p} $.\n\n"
+            "Чтобы выключить уведомления, нажмите «Отписаться»."
+        ),
+    },
+    "already_subscribed": {
+        "en": "Notifications are already ON ✅",
+        "uk": "Сповіщення вже увімкнено ✅",
+        "ru": "Уведомления уже включены ✅",
+    },
+    "subscriptions_disabled": {
+        "en": "Notifications are temporarily unavailable 🙈",
+        "uk": "Сповіщення тимчасово недоступні 🙈",
+        "ru": "Уведомления временно недоступны 🙈",
+    },
+    "unsubscribed": {
+        "en": "Notifications are OFF ❌",
+        "uk": "Сповіщення вимкнено ❌",
+        "ru": "Уведомления отключены ❌",
+    },
+    "coin_not_tracked": {
+        "en": "{coin} is no longer tracked — nothing to unsubscribe from",
+        "uk": "{coin} більше не відстежується — відписуватися нема від чого",
+        "ru": "{coin} больше не отслеживается — отписываться не от чего",
+    },
+    "price_alert": {
+        "en": "{arrow} {coin} price changed by {diff:.1f}%\n\nWas: {old!p} $\nNow: {new!p} $",
+        "uk": "{arrow} Ціна {coin} змінилася на {diff:.1f}%\n\nБуло: {old!p} $\nЗараз: {new!p} $",
+        "ru": "{arrow} Цена {coin} изменилась на {diff:.1f}%\n\nБыло: {old!p} $\nСейчас: {new!p} $",
+    },
+
+    # ---- свои уведомления
+    "target_reached": {
+        "en": "🎯 {arrow} {coin} reached {new!p} $\n\nYour target: {target!p} $",
+        "uk": "🎯 {arrow} {coin} досяг {new!p} $\n\nТвоя ціль: {target!p} $",
+        "ru": "🎯 {arrow} {coin} достиг {new!p} $\n\nТвоя цель: {target!p} $",
+    },
+    "alert_usage": {
+        "en": (
+            "Custom alerts:\n"
+            "/alert 5% — notify on a 5% move from the current price\n"
+            "/alert 3.5 — notify when TON reaches 3.5 $\n"
+            "/alert above 3.5 or /alert below 2 — explicit direction\n"
+            "/alert btc 70000 — same for another coin\n"
+            "/alerts — list your alerts\n"
+            "/alert_del <id> or /alert_del all — remove alerts"
+        ),
+        "uk": (
+            "Власні сповіщення:\n"
+            "/alert 5% — сповістити при русі на 5% від поточної ціни\n"
+            "/alert 3.5 — сповістити, коли TON досягне 3.5 $\n"
+            "/alert above 3.5 або /alert below 2 — явний напрямок\n"
+            "/alert btc 70000 — те саме для іншої монети\n"
+            "/alerts — список твоїх сповіщень\n"
+            "/alert_del <id> або /alert_del all — видалити сповіщення"
+        ),
+        "ru": (
+            "Свои уведомления:\n"
+            "/alert 5% — сообщить при движении на 5% от текущей цены\n"
+            "/alert 3.5 — сообщить, когда TON достигнет 3.5 $\n"
+            "/alert above 3.5 или /alert below 2 — явное направление\n"
+            "/alert btc 70000 — то же для другой монеты\n"
+            "/alerts — список твоих уведомлений\n"
+            "/alert_del <id> или /alert_del all — удалить уведомления"
+        ),
+    },
+    "target_pct": {
+        "en": "{coin} ±{value:g}% from {base!p} $",
+        "uk": "{coin} ±{value:g}% від {base!p} $",
+        "ru": "{coin} ±{value:g}% от {base!p} $",
+    },
+    "target_level": {"ru": "{coin} {arrow} {value!p} $"},
+    "target_added": {
+        "en": "Alert #{id} added ✅\n{desc}",
+        "uk": "Сповіщення #{id} додано ✅\n{desc}",
+        "ru": "Уведомление #{id} добавлено ✅\n{desc}",
+    },
+    "targets_empty": {
+        "en": "You have no custom alerts. Send /alert to add one.",
+        "uk": "У тебе немає власних сповіщень. Надішли /alert, щоб додати.",
+        "ru": "У тебя нет своих уведомлений. Отправь /alert, чтобы добавить.",
+    },
+    "targets_header": {
+        "en": "Your alerts:",
+        "uk": "Твої сповіщення:",
+        "ru": "Твои уведомления:",
+    },
+    "targets_item": {"ru": "#{id}: {desc}"},
+    "targets_removed": {
+        "en": "Alerts removed: {count}",
+        "uk": "Видалено сповіщень: {count}",
+        "ru": "Удалено уведомлений: {count}",
+    },
+    "targets_limit": {
+        "en": "Too many alerts (max {limit}). Remove some with /alert_del.",
+        "uk": "Забагато сповіщень (макс. {limit}). Видали зайві через /alert_del.",
+        "ru": "Слишком много уведомлений (макс. {limit}). Удали лишние через /alert_del.",
+    },
+
+    # ---- Мемляндия
+    "memelandia_header": {
+        "en": "Top-5 Memelandia 🦄",
+        "uk": "ТОП-5 Мемляндії 🦄",
+        "ru": "ТОП-5 Мемляндии 🦄",
+    },
+    "memelandia_error": {
+        "en": "Can't get Memelandia data now 🙈",
+        "uk": "Не вдалось отримати дані Мемляндії 🙈",
+        "ru": "Не удалось получить данные Мемляндии 🙈",
+    },
+    "memelandia_coin": {"ru": "{idx}. {symbol}\n   price: {price:.6f} $\n   24h: {ch24!d}, 7d: {ch7!d}"},
+    "memelandia_holders": {"ru": "   holders: {holders}"},
+    "memelandia_mcap": {"ru": "   mcap: {mcap:,.0f} $"},
+    "memelandia_caption": {"ru": "Top-5 Memelandia — 24h %"},
+
+    # ---- ежедневный дайджест
+    "digest": {
+        "en": "☀️ Daily digest\n\n1 {coin} = {price!p} $\n24h: {change!d}",
+        "uk": "☀️ Щоденний дайджест\n\n1 {coin} = {price!p} $\nЗа 24h: {change!d}",
+        "ru": "☀️ Ежедневный дайджест\n\n1 {coin} = {price!p} $\nЗа 24h: {change!d}",
+    },
+    "digest_movers": {
+        "en": "Memelandia movers 🦄",
+        "uk": "Рухи Мемляндії 🦄",
+        "ru": "Движение в Мемляндии 🦄",
+    },
+    "digest_mover": {"ru": "{symbol}: {change!d}"},
+    "digest_on": {
+        "en": "Daily digest is ON ✅\nEvery day at {hour:02d}:00 UTC: TON price, 24h change and Memelandia movers.",
+        "uk": "Щоденний дайджест увімкнено ✅\nЩодня о {hour:02d}:00 UTC: курс TON, зміна за 24h і рухи Мемляндії.",
+        "ru": "Ежедневный дайджест включён ✅\nКаждый день в {hour:02d}:00 UTC: курс TON, изменение за 24h и движение в Мемляндии.",
+    },
+    "digest_off": {
+        "en": "Daily digest is OFF ❌\nTurn it back on with /digest.",
+        "uk": "Щоденний дайджест вимкнено ❌\nУвімкнути знову — /digest.",
+        "ru": "Ежедневный дайджест выключен ❌\nВключить снова — /digest.",
+    },
+    "digest_now_started": {
+        "en": "Digest: broadcast started",
+        "uk": "Дайджест: розсилку запущено",
+        "ru": "Дайджест: рассылка запущена",
+    },
+    "digest_now_busy": {
+        "en": "Digest: a broadcast is already running",
+        "uk": "Дайджест: розсилка вже йде",
+        "ru": "Дайджест: рассылка уже идёт",
+    },
+    "digest_now_not_leader": {
+        "en": "Digest: this replica is not the leader — the broadcast runs on the leader only",
+        "uk": "Дайджест: ця репліка не лідер — розсилку веде лише лідер",
+        "ru": "Дайджест: эта реплика не лидер — рассылку ведёт только лидер",
+    },
+    "btn_digest_off": {"en": "Turn off digest", "uk": "Вимкнути дайджест", "ru": "Выключить дайджест"},
+
+    # ---- тикеты и оплата
+    "tickets_unavailable": {
+        "en": "Ticket sales are temporarily unavailable 🙈",
+        "uk": "Купівля квитків тимчасово недоступна 🙈",
+        "ru": "Покупка тикетов временно недоступна 🙈",
+    },
+    "invoice_create_error": {
+        "en": "Couldn't create an invoice 🙈",
+        "uk": "Не вдалося створити рахунок 🙈",
+        "ru": "Не удалось создать счёт 🙈",
+    },
+    "ticket_stats": {
+        "en": "Your tickets: {tickets}\nTotal bought: {total_ton:.2f} TON",
+        "uk": "Твої квитки: {tickets}\nВсього куплено: {total_ton:.2f} TON",
+        "ru": "Твои тикеты: {tickets}\nВсего куплено: {total_ton:.2f} TON",
+    },
+    "invoice_created": {
+        "en": (
+            "Invoice created ✅\n\n"
+            "Amount: {amount:.2f} TON\n"
+            "Tickets: {tickets}\n\n"
+            "After payment press “Check payment”.\n\n"
+            "Want to be on the leaderboard? Buy a ticket 🙂\n\n"
+            "{stats}"
+        ),
+        "uk": (
+            "Рахунок створено ✅\n\n"
+            "Сума: {amount:.2f} TON\n"
+            "Квитків: {tickets}\n\n"
+            "Після оплати натисни «Перевірити оплату».\n\n"
+            "Хочеш у лідерборд? Купи квиток 🙂\n\n"
+            "{stats}"
+        ),
+        "ru": (
+            "Счёт создан ✅\n\n"
+            "Сумма: {amount:.2f} TON\n"
+            "Тикетов: {tickets}\n\n"
+            "После оплаты нажми «Проверить оплату».\n\n"
+            "Хочешь в лидерборд? Купи тикет 🙂\n\n"
+            "{stats}"
+        ),
+    },
+    "btn_pay": {"en": "Pay in CryptoBot", "uk": "Оплатити в CryptoBot", "ru": "Оплатить в CryptoBot"},
+    "btn_check_payment": {"en": "Check payment", "uk": "Перевірити оплату", "ru": "Проверить оплату"},
+    "invoice_bad_id": {
+        "en": "Invalid invoice ID 🙈",
+        "uk": "Некоректний ID рахунку 🙈",
+        "ru": "Некорректный ID инвойса 🙈",
+    },
+    "db_unavailable": {
+        "en": "Database is unavailable 🙈",
+        "uk": "База даних недоступна 🙈",
+        "ru": "База данных недоступна 🙈",
+    },
+    "payment_check_error": {
+        "en": "Couldn't check the payment 🙈",
+        "uk": "Не вдалося перевірити оплату 🙈",
+        "ru": "Не удалось проверить оплату 🙈",
+    },
+    "payment_pending": {
+        "en": "Not paid yet. Try again in a minute.",
+        "uk": "Поки не оплачено. Спробуй ще раз за хвилину.",
+        "ru": "Пока не оплачено. Попробуй через минуту ещё раз.",
+    },
+    "invoice_already_paid": {
+        "en": "This invoice has already been credited ✅",
+        "uk": "Цей рахунок уже зараховано ✅",
+        "ru": "Этот счёт уже был зачислен ✅",
+    },
+    "payment_received": {
+        "en": "Payment received ✅\nTickets credited: {tickets}.",
+        "uk": "Оплату отримано ✅\nТобі зараховано квитків: {tickets}.",
+        "ru": "Оплата получена ✅\nТебе начислено: {tickets} тикетов.",
+    },
+
+    # ---- рефералы
+    "ref_link": {
+        "en": "Your referral link:\n{url}",
+        "uk": "Твоє реферальне посилання:\n{url}",
+        "ru": "Твоя реф. ссылка:\n{url}",
+    },
+    "referrals": {
+        "en": "👥 Referrals\n\nYour referral link:\n{url}\n\nYour referrals: {count}",
+        "uk": "👥 Реферали\n\nТвоє реферальне посилання:\n{url}\n\nТвої реферали: {count}",
+        "ru": "👥 Рефералы\n\nТвоя реферальная ссылка:\n{url}\n\nТвои рефералы: {count}",
+    },
+    "top_referrer": {
+        "en": "Top referrer: {name} — {count} referrals",
+        "uk": "Топ реферер: {name} — {count} рефералів",
+        "ru": "Топ реферер: {name} — {count} рефералов",
+    },
+    "no_referrals": {
+        "en": "No referrals yet. Be the first 😉",
+        "uk": "Ще немає рефералів. Будь першим 😉",
+        "ru": "Пока нет рефералов. Будь первым 😉",
+    },
+
+    # ---- лидерборд
+    "leaderboard_empty": {
+        "en": "Nobody has bought tickets yet.",
+        "uk": "Ще ніхто не купив квитки.",
+        "ru": "Пока ещё никто не купил тикеты.",
+    },
+    "leaderboard_header": {
+        "en": "🏆 Ticket leaderboard:",
+        "uk": "🏆 Лідерборд за квитками:",
+        "ru": "🏆 Лидерборд по тикетам:",
+    },
+    "leaderboard_row": {
+        "en": "{place}. {name}{you}\n   tickets: {tickets}, total bought: {total_ton:.2f} TON",
+        "uk": "{place}. {name}{you}\n   квитки: {tickets}, всього куплено: {total_ton:.2f} TON",
+        "ru": "{place}. {name}{you}\n   тикеты: {tickets}, всего куплено: {total_ton:.2f} TON",
+    },
+    "leaderboard_you": {"en": " (you)", "uk": " (ти)", "ru": " (ты)"},
+    "leaderboard_tagline": {
+        "en": (
+            "☝️Want to be here? Buy a ticket 🎫\n"
+            "Want the very top spot? You'll need to outbid the others 🫅🏻"
+        ),
+        "uk": (
+            "☝️Хочеш бути тут? Купи квиток 🎫\n"
+            "Хочеш бути на самому верху — доведеться перебити ставку інших 🫅🏻"
+        ),
+        "ru": (
+            "☝️Хочешь сюда? Купи тикет 🎫\n"
+            "Хочешь быть на самом верхнем месте — придётся перебить ставку других 🫅🏻"
+        ),
+    },
+}
+
+
+def price_decimals(value: float) -> int:
+    # TON привычно с тремя знаками; дешёвым монетам нужны значащие цифры
+    if value >= 1000:
+        return 2
+    if value >= 0.1 or value <= 0:
+        return 3
+    return min(10, 2 - math.floor(math.log10(value)))
+
+
+def format_price(value: float) -> str:
+    return f"{value:.{price_decimals(value)}f}"
+
+
+def format_delta(value: float) -> str:
+    sign = "+" if value > 0 else ""
+    return f"{sign}{value:.1f}%"
+
+
+CONVERSIONS = {
+    "p": format_price,
+    "d": format_delta,
+}
+
+
+class Message:
+    # Шаблон, разобранный и проверенный один раз и скомпилированный в функцию
+    # с f-строкой: рендер стоит как написанный руками f"...".
+
+    __slots__ = ("key", "lang", "fields", "render")
+
+    def __init__(self, key: str, lang: str, template: str):
+        self.key, self.lang = key, lang
+        body = []
+        fields = []
+        namespace = {}
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            body.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is None:
+                continue
+            if not field.isidentifier() or field.startswith("_"):
+                raise ValueError(f"{key}/{lang}: только простые имена полей, а не {field!r}")
+            if spec and any(ch in spec for ch in "{}'\"\\"):
+                raise ValueError(f"{key}/{lang}: вложенные поля и кавычки в формате не поддерживаются")
+            expr = field
+            if conversion in CONVERSIONS:
+                namespace[f"_{conversion}"] = CONVERSIONS[conversion]
+                expr = f"_{conversion}({field})"
+            elif conversion in ("s", "r"):
+                expr += f"!{conversion}"
+            elif conversion is not None:
+                raise ValueError(f"{key}/{lang}: неизвестное преобразование !{conversion}")
+            if field not in fields:
+                fields.append(field)
+            body.append("{" + expr + (f":{spec}" if spec else "") + "}")
+        self.fields = frozenset(fields)
+        # лишние параметры игнорируем, отсутствующий — TypeError с именем поля
+        source = f"def render({''.join(f + ', ' for f in fields)}**_):\n    return f{''.join(body)!r}\n"
+        exec(compile(source, f"<message {key}/{lang}>", "exec"), namespace)
+        self.render = namespace["render"]
+
+
+def compile_catalog(catalog: dict) -> dict:
+    # (key, lang) -> Message для каждого языка из LANGS; нет перевода — шаблон DEFAULT_LANG,
+    # нет и его — первый имеющийся. Поля переводов сверяем с основным шаблоном.
+    compiled = {}
+    for key, templates in catalog.items():
+        base_lang = DEFAULT_LANG if DEFAULT_LANG in templates else next(iter(templates))
+        base = Message(key, base_lang, templates[base_lang])
+        for lang in LANGS:
+            if lang in templates and lang != base_lang:
+                message = Message(key, lang, templates[lang])
+                if message.fields != base.fields:
+                    raise ValueError(f"{key}/{lang}: поля {sorted(message.fields)} != {sorted(base.fields)}")
+            else:
+                message = base
+            compiled[(key, lang)] = message
+    return compiled
+
+
+COMPILED = compile_catalog(CATALOG)
+
+
+def normalize_lang(lang: str) -> str:
+    # language_code Telegram ("en-US", "uk") и всё неизвестное -> язык каталога
+    lang = (lang or DEFAULT_LANG).split("-")[0].lower()
+    return lang if lang in LANGS else DEFAULT_LANG
+
+
+def msg(key: str, lang: str, **params) -> str:
+    message = COMPILED.get((key, lang))
+    if message is None:
+        message = COMPILED[(key, normalize_lang(lang))]
+    return message.render(**params)
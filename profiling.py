@@ -0,0 +1,167 @@
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import logconfig
+
+# Профилирование живого бота на ограниченное окно. Пока сессия не запущена,
+# ничего не установлено: ни потоков, ни хуков, ни tracemalloc.
+#
+# Сэмплер — отдельный поток: раз в interval снимает стек потока event loop
+# (sys._current_frames) и копит их в collapsed-формате (flamegraph.pl, speedscope).
+# Детектор медленных колбэков: корутина-пульс обновляет отметку каждые ~slow/4 мс;
+# если сэмплер видит, что отметка старше порога, loop чем-то заблокирован —
+# стек в этот момент и есть виновник (хендлер, шаг джоба, синхронный запрос).
+
+log = logconfig.get_logger("profile")
+
+MAX_STACK_DEPTH = 64
+# «свой» код — его кадр и называем виновником блокировки
+OWN_FILES = ("bot.py", "charts.py", "sparkline.py", "messages.py", "metrics.py")
+
+
+def frame_stack(frame) -> list[str]:
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class ProfileSession:
+    def __init__(self, duration: float, interval: float = 0.005, slow_ms: float = 100,
+                 trace_memory: bool = True):
+        self.duration = duration
+        self.interval = interval
+        self.slow = slow_ms / 1000
+        self.trace_memory = trace_memory
+        self.samples: collections.Counter = collections.Counter()
+        self.sample_count = 0
+        self.slow_blocks: list[dict] = []
+        self.block = None
+        self.beat = 0.0
+        self.stop = threading.Event()
+        self.loop_thread = None
+
+    # --- сэмплер (отдельный поток)
+
+    def _sample_loop(self):
+        while not self.stop.wait(self.interval):
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = frame_stack(frame)
+            self.samples[";".join(stack)] += 1
+            self.sample_count += 1
+
+            lag = time.monotonic() - self.beat
+            if lag > self.slow:
+                if self.block is None:
+                    self.block = {"started": self.beat, "stacks": collections.Counter()}
+                self.block["stacks"][";".join(stack)] += 1
+                self.block["lag"] = lag
+            elif self.block is not None:
+                self._close_block()
+
+    def _close_block(self):
+        block, self.block = self.block, None
+        stack, _ = block["stacks"].most_common(1)[0]
+        frames = stack.split(";")
+        # верх стека — где стоим; нам интереснее ближайший «свой» кадр
+        culprit = next((f for f in reversed(frames) if f.split("(")[-1].split(":")[0] in OWN_FILES), frames[-1])
+        self.slow_blocks.append({"ms": round(block["lag"] * 1000, 1), "culprit": culprit, "stack": frames})
+        log.warning("Slow loop", extra={"blocked_ms": round(block["lag"] * 1000), "culprit": culprit})
+
+    # --- пульс (в event loop)
+
+    async def _heartbeat(self):
+        step = max(0.002, self.slow / 4)
+        while not self.stop.is_set():
+            self.beat = time.monotonic()
+            await asyncio.sleep(step)
+
+    async def run(self) -> dict[str, bytes]:
+        # -> имя файла -> содержимое
+        self.loop_thread = threading.get_ident()
+        started_tracing = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(16)
+            started_tracing = True
+        before = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+        self.beat = time.monotonic()
+        heartbeat = asyncio.create_task(self._heartbeat())
+        sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        sampler.start()
+        try:
+            await asyncio.sleep(self.duration)
+        finally:
+            self.stop.set()
+            await asyncio.to_thread(sampler.join)
+            heartbeat.cancel()
+            if self.block is not None:
+                self._close_block()
+            memory = None
+            if before is not None:
+                memory = memory_report(before, tracemalloc.take_snapshot())
+            if started_tracing:
+                tracemalloc.stop()
+
+        files = {
+            "profile.collapsed.txt": self.collapsed().encode(),
+            "profile.top.txt": self.top().encode(),
+            "slow_callbacks.txt": self.slow_report().encode(),
+        }
+        if memory is not None:
+            files["tracemalloc.txt"] = memory.encode()
+        return files
+
+    # --- отчёты
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+    def top(self, limit: int = 40) -> str:
+        # self — кадр на вершине стека, total — кадр где угодно в стеке
+        own, total = collections.Counter(), collections.Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        n = max(1, self.sample_count)
+        lines = [f"samples: {self.sample_count}, interval {self.interval * 1000:.0f} ms, window {self.duration:.0f} s", ""]
+        lines.append("self%   total%  frame")
+        for frame, count in own.most_common(limit):
+            lines.append(f"{count / n * 100:5.1f}  {total[frame] / n * 100:6.1f}  {frame}")
+        lines += ["", "by total:"]
+        for frame, count in total.most_common(limit):
+            lines.append(f"{count / n * 100:6.1f}  {frame}")
+        return "\n".join(lines) + "\n"
+
+    def slow_report(self) -> str:
+        lines = [f"loop blocked longer than {self.slow * 1000:.0f} ms: {len(self.slow_blocks)} times", ""]
+        for block in sorted(self.slow_blocks, key=lambda b: -b["ms"]):
+            lines.append(f">= {block['ms']} ms  {block['culprit']}")
+            lines.extend("    " + frame for frame in block["stack"][-15:])
+            lines.append("")
+        return "\n".join(lines)
+
+
+def memory_report(before, after, limit: int = 40) -> str:
+    current, peak = tracemalloc.get_traced_memory()
+    total = sum(stat.size for stat in after.statistics("filename"))
+    lines = [f"traced now: {total / 1024:.0f} KiB (tracemalloc current {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB)", ""]
+    lines.append("growth during window (by line):")
+    for stat in after.compare_to(before, "lineno")[:limit]:
+        lines.append(str(stat))
+    lines += ["", "largest allocations (by line):"]
+    for stat in after.statistics("lineno")[:limit]:
+        lines.append(str(stat))
+    return "\n".join(lines) + "\n"
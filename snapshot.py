@@ -0,0 +1,99 @@
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+# Снимок состояния процесса в одном файле, который читается через mmap:
+#
+#   MAGIC | u64 длина заголовка | заголовок (JSON) | данные
+#
+# Заголовок — метаданные и оглавление: имя -> (смещение, размер, dtype, shape).
+# Данные — сырые numpy-массивы и байтовые блобы, каждый с границы 64 байт, так что
+# массив читается как np.frombuffer над mmap без копирования и без разбора.
+# Пишем во временный файл и переименовываем: читатель видит старый снимок или
+# новый целиком, а уже открытый mmap старого остаётся валидным.
+
+MAGIC = b"TMSNAP1\0"
+ALIGN = 64
+
+
+def _pad(n: int) -> int:
+    return -n % ALIGN
+
+
+def write(path: str, meta: dict, arrays: dict[str, np.ndarray] = None, blobs: dict[str, bytes] = None) -> int:
+    # -> размер файла
+    entries, chunks, offset = {}, [], 0
+    crc = 0
+    items = [(name, "array", np.ascontiguousarray(a)) for name, a in (arrays or {}).items()]
+    items += [(name, "bytes", bytes(b)) for name, b in (blobs or {}).items()]
+    for name, kind, value in items:
+        data = value.tobytes() if kind == "array" else value
+        entry = {"kind": kind, "offset": offset, "nbytes": len(data)}
+        if kind == "array":
+            entry["dtype"] = value.dtype.str
+            entry["shape"] = list(value.shape)
+        entries[name] = entry
+        chunks.append(data)
+        chunks.append(b"\0" * _pad(len(data)))
+        crc = zlib.crc32(data, crc)
+        offset += len(data) + _pad(len(data))
+
+    header = json.dumps({"version": 1, "written_at": time.time(), "crc32": crc,
+                         "entries": entries, "meta": meta}, separators=(",", ":")).encode()
+    prefix = MAGIC + struct.pack("<Q", len(header)) + header
+    prefix += b"\0" * _pad(len(prefix))
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(prefix)
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(prefix) + offset
+
+
+class Snapshot:
+    def __init__(self, path: str, verify: bool = True):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a snapshot file")
+        (length,) = struct.unpack_from("<Q", self.mm, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self.mm[start:start + length])
+        self.base = start + length + _pad(start + length)
+        self.entries: dict = header["entries"]
+        self.meta: dict = header["meta"]
+        self.written_at: float = header["written_at"]
+        if verify:
+            crc = 0
+            for entry in self.entries.values():
+                crc = zlib.crc32(self._view(entry), crc)
+            if crc != header["crc32"]:
+                raise ValueError("snapshot checksum mismatch")
+
+    def _view(self, entry: dict) -> memoryview:
+        start = self.base + entry["offset"]
+        return memoryview(self.mm)[start:start + entry["nbytes"]]
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.written_at
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def array(self, name: str) -> np.ndarray:
+        # только чтение, без копии: страницы подтягиваются по мере обращения
+        entry = self.entries[name]
+        return np.frombuffer(self._view(entry), dtype=np.dtype(entry["dtype"])).reshape(entry["shape"])
+
+    def blob(self, name: str) -> bytes:
+        return bytes(self._view(self.entries[name]))
@@ -0,0 +1,249 @@
+import struct
+import zlib
+
+import numpy as np
+
+# Быстрый растровый график без matplotlib: линия, заливка и подпись цены
+# рисуются прямо в numpy-буфер и кодируются в PNG через zlib (JPEG/WebP — через PIL).
+
+BG = (255, 255, 255)
+PLOT_BG = (245, 250, 255)  # #F5FAFF
+LINE = (59, 130, 246)  # #3B82F6
+GRID = (222, 228, 236)
+AXIS = (208, 215, 226)  # #D0D7E2
+TEXT = (17, 24, 39)  # #111827
+TICK_TEXT = (107, 114, 128)  # #6B7280
+FILL_ALPHA = 0.22
+
+# 5x7 битмап-шрифт: только символы, которые встречаются в подписях (тикеры — A-Z)
+GLYPHS = {
+    "0": ["01110", "10001", "10011", "10101", "11001", "10001", "01110"],
+    "1": ["00100", "01100", "00100", "00100", "00100", "00100", "01110"],
+    "2": ["01110", "10001", "00001", "00010", "00100", "01000", "11111"],
+    "3": ["11110", "00001", "00001", "01110", "00001", "00001", "11110"],
+    "4": ["00010", "00110", "01010", "10010", "11111", "00010", "00010"],
+    "5": ["11111", "10000", "11110", "00001", "00001", "10001", "01110"],
+    "6": ["00110", "01000", "10000", "11110", "10001", "10001", "01110"],
+    "7": ["11111", "00001", "00010", "00100", "01000", "01000", "01000"],
+    "8": ["01110", "10001", "10001", "01110", "10001", "10001", "01110"],
+    "9": ["01110", "10001", "10001", "01111", "00001", "00010", "01100"],
+    ".": ["00000", "00000", "00000", "00000", "00000", "01100", "01100"],
+    ",": ["00000", "00000", "00000", "00000", "01100", "00100", "01000"],
+    "-": ["00000", "00000", "00000", "11111", "00000", "00000", "00000"],
+    "+": ["00000", "00100", "00100", "11111", "00100", "00100", "00000"],
+    "%": ["11000", "11001", "00010", "00100", "01000", "10011", "00011"],
+    "=": ["00000", "00000", "11111", "00000", "11111", "00000", "00000"],
+    "$": ["00100", "01111", "10100", "01110", "00101", "11110", "00100"],
+    " ": ["00000", "00000", "00000", "00000", "00000", "00000", "00000"],
+    "A": ["01110", "10001", "10001", "11111", "10001", "10001", "10001"],
+    "B": ["11110", "10001", "10001", "11110", "10001", "10001", "11110"],
+    "C": ["01110", "10001", "10000", "10000", "10000", "10001", "01110"],
+    "D": ["11100", "10010", "10001", "10001", "10001", "10010", "11100"],
+    "E": ["11111", "10000", "10000", "11110", "10000", "10000", "11111"],
+    "F": ["11111", "10000", "10000", "11110", "10000", "10000", "10000"],
+    "G": ["01110", "10001", "10000", "10111", "10001", "10001", "01111"],
+    "H": ["10001", "10001", "10001", "11111", "10001", "10001", "10001"],
+    "I": ["01110", "00100", "00100", "00100", "00100", "00100", "01110"],
+    "J": ["00111", "00010", "00010", "00010", "00010", "10010", "01100"],
+    "K": ["10001", "10010", "10100", "11000", "10100", "10010", "10001"],
+    "L": ["10000", "10000", "10000", "10000", "10000", "10000", "11111"],
+    "M": ["10001", "11011", "10101", "10101", "10001", "10001", "10001"],
+    "N": ["10001", "11001", "10101", "10011", "10001", "10001", "10001"],
+    "O": ["01110", "10001", "10001", "10001", "10001", "10001", "01110"],
+    "P": ["11110", "10001", "10001", "11110", "10000", "10000", "10000"],
+    "Q": ["01110", "10001", "10001", "10001", "10101", "10010", "01101"],
+    "R": ["11110", "10001", "10001", "11110", "10100", "10010", "10001"],
+    "S": ["01111", "10000", "10000", "01110", "00001", "00001", "11110"],
+    "T": ["11111", "00100", "00100", "00100", "00100", "00100", "00100"],
+    "U": ["10001", "10001", "10001", "10001", "10001", "10001", "01110"],
+    "V": ["10001", "10001", "10001", "10001", "10001", "01010", "00100"],
+    "W": ["10001", "10001", "10001", "10101", "10101", "10101", "01010"],
+    "X": ["10001", "10001", "01010", "00100", "01010", "10001", "10001"],
+    "Y": ["10001", "10001", "01010", "00100", "00100", "00100", "00100"],
+    "Z": ["11111", "00001", "00010", "00100", "01000", "10000", "11111"],
+    "h": ["10000", "10000", "10110", "11001", "10001", "10001", "10001"],
+    "d": ["00001", "00001", "01101", "10011", "10001", "10011", "01101"],
+}
+GLYPH_BITMAPS = {
+    ch: np.array([[c == "1" for c in row] for row in rows], dtype=bool)
+    for ch, rows in GLYPHS.items()
+}
+
+
+def text_width(text: str, scale: int) -> int:
+    return len(text) * 6 * scale - scale
+
+
+def draw_text(img: np.ndarray, text: str, x: int, y: int, scale: int, color):
+    h, w, _ = img.shape
+    for ch in text:
+        glyph = GLYPH_BITMAPS.get(ch)
+        if glyph is not None:
+            big = np.kron(glyph, np.ones((scale, scale), dtype=bool))
+            gh, gw = big.shape
+            y0, x0 = max(y, 0), max(x, 0)
+            y1, x1 = min(y + gh, h), min(x + gw, w)
+            if y1 > y0 and x1 > x0:
+                region = img[y0:y1, x0:x1]
+                region[big[y0 - y:y1 - y, x0 - x:x1 - x]] = color
+        x += 6 * scale
+
+
+def encode_png(img: np.ndarray, compress_level: int = 6) -> bytes:
+    h, w, _ = img.shape
+    flat = img.reshape(h, w * 3)
+    raw = np.empty((h, w * 3 + 1), dtype=np.uint8)
+    # фильтр Up (2): разница с предыдущей строкой — у графика почти нули,
+    # zlib жмёт такое и быстрее, и сильнее
+    raw[:, 0] = 2
+    raw[0, 1:] = flat[0]
+    np.subtract(flat[1:], flat[:-1], out=raw[1:, 1:])
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    return b"".join(
+        [
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)),
+            chunk(b"IDAT", zlib.compress(raw.tobytes(), compress_level)),
+            chunk(b"IEND", b""),
+        ]
+    )
+
+
+def encode_image(img: np.ndarray, fmt: str = "png", compress_level: int = 6, quality: int = 90) -> bytes:
+    if fmt == "png":
+        return encode_png(img, compress_level)
+    # те же параметры, что у charts.encode_figure; PIL приходит с matplotlib
+    import io
+    from PIL import Image
+
+    out = io.BytesIO()
+    options = {"quality": quality, "optimize": True} if fmt == "jpeg" else {"quality": quality, "method": 4}
+    Image.fromarray(img).save(out, format=fmt.upper(), **options)
+    return out.getvalue()
+
+
+class Layout:
+    # Всё, что не зависит от данных: поля, сетка, оси и тот же фон с заливкой.
+    # Крайние значения ряда всегда попадают в одни и те же строки,
+    # поэтому сетку можно нарисовать заранее.
+
+    GRID_LINES = 5
+    PAD = 0.05  # поля по цене сверху и снизу
+
+    def __init__(self, width: int, height: int):
+        self.width, self.height = width, height
+        self.left, self.right = int(width * 0.08), int(width * 0.97)
+        self.top, self.bottom = int(height * 0.04), int(height * 0.84)
+        self.pw, self.ph = self.right - self.left, self.bottom - self.top
+
+        # строки min/max ряда внутри области графика
+        span = 1 + 2 * self.PAD
+        self.row_hi = self.PAD / span * (self.ph - 1)
+        self.row_lo = (1 + self.PAD) / span * (self.ph - 1)
+        self.grid_rows = np.linspace(self.row_hi, self.row_lo, self.GRID_LINES)
+
+        canvas = np.empty((height, width, 3), dtype=np.uint8)
+        canvas[:] = BG
+        plot = canvas[self.top:self.bottom, self.left:self.right]
+        plot[:] = PLOT_BG
+        for r in self.grid_rows:
+            plot[int(round(r))] = GRID
+        canvas[self.bottom, self.left:self.right] = AXIS
+        canvas[self.top:self.bottom, self.left - 1] = AXIS
+        self.canvas = canvas
+
+        filled = plot.astype(np.float32) * (1 - FILL_ALPHA) + np.float32(FILL_ALPHA) * np.array(LINE, dtype=np.float32)
+        self.filled_plot = (filled + 0.5).astype(np.uint8)
+        self.rows = np.arange(self.ph, dtype=np.float32)[:, None]
+
+
+_layouts: dict = {}
+
+
+def get_layout(width: int, height: int) -> Layout:
+    layout = _layouts.get((width, height))
+    if layout is None:
+        layout = _layouts[(width, height)] = Layout(width, height)
+    return layout
+
+
+def render_sparkline(
+    times: np.ndarray,
+    prices: np.ndarray,
+    width: int = 1280,
+    height: int = 853,
+    label: str = "",
+    compress_level: int = 6,
+    tick_decimals: int = 3,
+    fmt: str = "png",
+    quality: int = 90,
+) -> bytes:
+    lay = get_layout(width, height)
+    img = lay.canvas.copy()
+    plot = img[lay.top:lay.bottom, lay.left:lay.right]
+
+    x = np.asarray(times, dtype=np.float64)
+    y = np.asarray(prices, dtype=np.float64)
+    lo, hi = float(y.min()), float(y.max())
+    x_span = (x[-1] - x[0]) or 1.0
+
+    def to_row(v):
+        if hi == lo:
+            return (lay.row_hi + lay.row_lo) / 2 + 0 * v
+        return lay.row_lo - (v - lo) / (hi - lo) * (lay.row_lo - lay.row_hi)
+
+    # координаты линии по столбцам
+    cols = np.arange(lay.pw, dtype=np.float64)
+    px = x[0] + (cols + 0.5) / lay.pw * x_span
+    line_rows = to_row(np.interp(px, x, y)).astype(np.float32)
+    base_row = np.float32(to_row(lo))
+
+    # заливка от линии до минимума: берём заранее смешанный фон
+    fill = (lay.rows >= line_rows[None, :]) & (lay.rows <= base_row)
+    np.copyto(plot, lay.filled_plot, where=fill[:, :, None])
+
+    # линия: для каждого столбца — отрезок до соседнего, расширенный на полтолщины
+    # и объединённый с соседями (иначе крутые участки были бы в один столбец)
+    thickness = max(2.0, width / 1280 * 3.0)
+    r = int(thickness // 2)
+    prev_rows = np.r_[line_rows[0], line_rows[:-1]]
+    span_lo = np.minimum(prev_rows, line_rows)
+    span_hi = np.maximum(prev_rows, line_rows)
+    win_lo, win_hi = span_lo.copy(), span_hi.copy()
+    for shift in range(1, r + 1):
+        np.minimum(win_lo[shift:], span_lo[:-shift], out=win_lo[shift:])
+        np.minimum(win_lo[:-shift], span_lo[shift:], out=win_lo[:-shift])
+        np.maximum(win_hi[shift:], span_hi[:-shift], out=win_hi[shift:])
+        np.maximum(win_hi[:-shift], span_hi[shift:], out=win_hi[:-shift])
+    win_lo -= thickness / 2
+    win_hi += thickness / 2
+
+    # рисуем только пиксели полосы вокруг линии; край — по вертикальному покрытию
+    start = np.clip(np.floor(win_lo).astype(np.int64) - 1, 0, lay.ph - 1)
+    stop = np.clip(np.ceil(win_hi).astype(np.int64) + 1, 0, lay.ph - 1)
+    lengths = stop - start + 1
+    col_idx = np.repeat(np.arange(lay.pw), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    row_idx = np.repeat(start, lengths) + offsets
+    rows_f = row_idx.astype(np.float32)
+    dist = np.maximum(win_lo[col_idx] - rows_f, rows_f - win_hi[col_idx])
+    alpha = np.clip(0.5 - dist, 0, 1)[:, None]
+    pixels = plot[row_idx, col_idx].astype(np.float32)
+    pixels += alpha * (np.array(LINE, dtype=np.float32) - pixels)
+    plot[row_idx, col_idx] = (pixels + 0.5).astype(np.uint8)
+
+    tick_scale = max(1, round(height / 400))
+    for row, v in zip(lay.grid_rows, np.linspace(hi, lo, Layout.GRID_LINES)):
+        text = f"{v:.{tick_decimals}f}"
+        y0 = lay.top + int(round(row)) - 7 * tick_scale // 2
+        draw_text(img, text, max(1, lay.left - text_width(text, tick_scale) - 4 * tick_scale), y0, tick_scale, TICK_TEXT)
+
+    if label:
+        label_scale = max(2, round(height / 250))
+        draw_text(img, label, int(width * 0.02), int(height * 0.90), label_scale, TEXT)
+
+    return encode_image(img, fmt, compress_level, quality)
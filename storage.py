@@ -0,0 +1,1359 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from decimal import Decimal
+
+import psycopg2
+
+import metrics
+
+# Хранилище бота за одним интерфейсом: подписки, пороги, outbox уведомлений,
+# дайджест, тикеты, рефералы. Методы возвращают сырые строки (кортежи) в порядке
+# колонок из SELECT/RETURNING — в dict их собирают хелперы bot.py.
+#
+#   PostgresStorage — DATABASE_URL: общая база нескольких реплик (лидерство,
+#                     лента изменений через NOTIFY в транзакции записи).
+#   SqliteStorage   — встроенный файл для одного процесса: WAL, свой поток записи.
+#
+# Время в SQLite — unix-секунды (REAL): NOW() там — функция Python на соединении.
+
+PG_STATEMENTS = metrics.Counter(
+    "tonmetric_pg_statements_total", "Выполнения именованных запросов Postgres", ("query", "cache"))
+
+NOTIFY_CHUNK = 150  # элементов в одном событии: payload NOTIFY ограничен 8000 байт
+
+# База недоступна (обрыв соединения, рестарт, SQLite занята) — данные запроса не
+# виноваты, его можно повторить позже
+UNAVAILABLE_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, sqlite3.OperationalError)
+
+# Шард пользователя: одна формула в Python и в SQL — outbox своих шардов реплика
+# выбирает запросом. Мультипликативный хеш, чтобы соседние id не попадали в один
+# шард; user_id сперва сводим к 31 биту, чтобы произведение влезало в int64.
+SHARD_SQL = "abs(user_id) % 2147483647 * 2654435761 % 4294967296"
+
+
+def shard_of(user_id: int, shards: int) -> int:
+    return abs(user_id) % 2147483647 * 2654435761 % 4294967296 % shards
+
+
+class Storage:
+    name = "base"
+    shared = False  # базу делят несколько процессов: нужны лидерство и лента изменений
+
+    def init(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    # --- подписки по цене
+
+    def subscribe_many(self, rows: list):
+        # rows: [(user_id, symbol, lang, base_price)], ключи (user_id, symbol) без повторов
+        raise NotImplementedError
+
+    def get_subscription(self, user_id: int, symbol: str):
+        # -> (user_id, lang, base_price, active) | None
+        raise NotImplementedError
+
+    def unsubscribe(self, user_id: int, symbol: str):
+        raise NotImplementedError
+
+    def active_subscribers(self) -> list:
+        # -> [(user_id, symbol, lang, base_price)]
+        raise NotImplementedError
+
+    # --- пороги и цели; строка цели: (id, user_id, lang, kind, value, base_price, symbol)
+
+    def add_target(self, user_id: int, lang: str, kind: str, value: float, base_price, symbol: str):
+        raise NotImplementedError
+
+    def user_targets(self, user_id: int) -> list:
+        raise NotImplementedError
+
+    def active_targets(self) -> list:
+        raise NotImplementedError
+
+    def delete_targets(self, user_id: int, target_id=None) -> list:
+        # -> id снятых целей
+        raise NotImplementedError
+
+    # --- outbox; строка: (id, idem_key, user_id, text, ref_kind, ref_id, old_base, new_base, attempts, symbol)
+
+    def enqueue_alerts(self, rows: list) -> list:
+        # rows: [(idem_key, user_id, symbol, text, ref_kind, ref_id, old_base, new_base)]
+        # -> idem_key вставленных; уже существующие (в том числе 'failed') пропускаются
+        raise NotImplementedError
+
+    def claim_outbox(self, limit: int, lease: float, shards: list = None, shard_count: int = 0) -> list:
+        # shards — только строки пользователей этих шардов (из shard_count)
+        raise NotImplementedError
+
+    def complete_outbox(self, ids: list, subs: list, pcts: list, done: list):
+        # subs: [(user_id, symbol, new_base, old_base)], pcts: [(id, new_base, old_base)], done: [id]
+        raise NotImplementedError
+
+    def fail_outbox(self, row_id: int, status: str, attempts: int, error: str, delay: float):
+        raise NotImplementedError
+
+    def release_outbox(self, ids: list, delay: float):
+        raise NotImplementedError
+
+    def pending_outbox(self) -> list:
+        # -> [(idem_key, ref_kind, ref_id, symbol)]
+        raise NotImplementedError
+
+    def deactivate_users(self, user_ids: list) -> dict:
+        # -> {"subs": [(user_id, symbol)], "targets": [id], "dropped_alerts": n, "pruned_digests": n}
+        raise NotImplementedError
+
+    # --- дайджест
+
+    def set_digest(self, user_id: int, lang: str, active: bool):
+        raise NotImplementedError
+
+    def digest_recipients(self, day) -> list:
+        # -> [(user_id, lang)]
+        raise NotImplementedError
+
+    def mark_digest_sent(self, user_ids: list, day):
+        raise NotImplementedError
+
+    # --- тикеты
+
+    def add_tickets(self, user_id: int, tickets: int, amount_ton: float) -> tuple:
+        # -> (total_tickets, total_ton) после зачисления
+        raise NotImplementedError
+
+    def save_invoices(self, rows: list):
+        # rows: [(invoice_id, user_id, tickets, amount_ton, status)], invoice_id без повторов
+        raise NotImplementedError
+
+    def invoice_status(self, invoice_id: int):
+        raise NotImplementedError
+
+    def mark_invoice_paid(self, invoice_id: int):
+        raise NotImplementedError
+
+    def ticket_stats(self, user_id: int):
+        # -> (total_tickets, total_ton) | None
+        raise NotImplementedError
+
+    def leaderboard(self, limit: int) -> list:
+        # -> [(user_id, total_tickets, total_ton)]
+        raise NotImplementedError
+
+    # --- рефералы
+
+    def add_referrals(self, rows: list) -> dict:
+        # rows: [(referrer_id, referred_id)]; уже чьи-то рефералы пропускаются
+        # -> {referrer_id: новое число рефералов} для тех, у кого прибавилось
+        raise NotImplementedError
+
+    def referral_count(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    def top_referrer(self):
+        # -> (referrer_id, count) | None
+        raise NotImplementedError
+
+
+# ------------------ POSTGRES ------------------
+
+# Все запросы горячего пути — здесь, под именами: имя -> (типы параметров, SQL).
+# На каждом соединении пула выражение готовится (PREPARE) при первом вызове и
+# дальше выполняется по имени (EXECUTE): разбор и план не повторяются.
+# Пачки строк передаются массивами через unnest — текст запроса не зависит от их числа.
+PG_QUERIES = {
+    # подписки по цене
+    "sub_upsert": (("bigint[]", "text[]", "text[]", "numeric[]"), """
+        INSERT INTO subscribers (user_id, symbol, lang, base_price, active, created_at, updated_at)
+        SELECT v.user_id, v.symbol, v.lang, v.base_price, TRUE, NOW(), NOW()
+        FROM unnest($1, $2, $3, $4) AS v(user_id, symbol, lang, base_price)
+        ON CONFLICT (user_id, symbol) DO UPDATE
+        SET lang = EXCLUDED.lang,
+            base_price = EXCLUDED.base_price,
+            active = TRUE,
+            updated_at = NOW()"""),
+    "sub_get": (("bigint", "text"), """
+        SELECT user_id, lang, base_price, active FROM subscribers
+        WHERE user_id = $1 AND symbol = $2"""),
+    "sub_off": (("bigint", "text"), """
+        UPDATE subscribers SET active = FALSE, updated_at = NOW()
+        WHERE user_id = $1 AND symbol = $2"""),
+    "sub_active": ((), """
+        SELECT user_id, symbol, lang, base_price FROM subscribers WHERE active = TRUE"""),
+    # base_price меняем, только если его не перезаписали (переподписка)
+    "sub_rebase": (("bigint[]", "text[]", "numeric[]", "numeric[]"), """
+        UPDATE subscribers AS s
+        SET base_price = v.new_base, updated_at = NOW()
+        FROM unnest($1, $2, $3, $4) AS v(user_id, symbol, new_base, old_base)
+        WHERE s.user_id = v.user_id AND s.symbol = v.symbol AND s.base_price = v.old_base"""),
+    # пороги и цели
+    "target_add": (("bigint", "text", "text", "numeric", "numeric", "text"), """
+        INSERT INTO price_targets (user_id, lang, kind, value, base_price, symbol)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        RETURNING id, user_id, lang, kind, value, base_price, symbol"""),
+    "target_list": (("bigint",), """
+        SELECT id, user_id, lang, kind, value, base_price, symbol
+        FROM price_targets
+        WHERE user_id = $1 AND active = TRUE
+        ORDER BY id"""),
+    "target_active": ((), """
+        SELECT id, user_id, lang, kind, value, base_price, symbol
+        FROM price_targets WHERE active = TRUE"""),
+    "target_off_all": (("bigint",), """
+        UPDATE price_targets SET active = FALSE, updated_at = NOW()
+        WHERE user_id = $1 AND active = TRUE
+        RETURNING id"""),
+    "target_off": (("bigint", "bigint"), """
+        UPDATE price_targets SET active = FALSE, updated_at = NOW()
+        WHERE user_id = $1 AND id = $2 AND active = TRUE
+        RETURNING id"""),
+    "target_rebase": (("bigint[]", "numeric[]", "numeric[]"), """
+        UPDATE price_targets AS t
+        SET base_price = v.new_base, updated_at = NOW()
+        FROM unnest($1, $2, $3) AS v(id, new_base, old_base)
+        WHERE t.id = v.id AND t.base_price = v.old_base"""),
+    "target_done": (("bigint[]",), """
+        UPDATE price_targets SET active = FALSE, updated_at = NOW() WHERE id = ANY($1)"""),
+    # outbox
+    "outbox_enqueue": (("text[]", "bigint[]", "text[]", "text[]", "text[]", "bigint[]", "numeric[]", "numeric[]"), """
+        INSERT INTO alert_outbox (idem_key, user_id, symbol, text, ref_kind, ref_id, old_base, new_base)
+        SELECT * FROM unnest($1, $2, $3, $4, $5, $6, $7, $8)
+        ON CONFLICT (idem_key) DO NOTHING
+        RETURNING idem_key"""),
+    # упавший посреди отправки процесс оставляет строки в 'sending'
+    "outbox_reclaim": (("float8",), """
+        UPDATE alert_outbox SET status = 'pending'
+        WHERE status = 'sending' AND claimed_at < NOW() - make_interval(secs => $1)"""),
+    "outbox_claim": (("integer",), """
+        UPDATE alert_outbox SET status = 'sending', claimed_at = NOW()
+        WHERE id IN (
+            SELECT id FROM alert_outbox
+            WHERE status = 'pending' AND next_attempt_at <= NOW()
+            ORDER BY id
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, idem_key, user_id, text, ref_kind, ref_id, old_base, new_base, attempts, symbol"""),
+    "outbox_claim_shards": (("integer", "integer", "integer[]"), f"""
+        UPDATE alert_outbox SET status = 'sending', claimed_at = NOW()
+        WHERE id IN (
+            SELECT id FROM alert_outbox
+            WHERE status = 'pending' AND next_attempt_at <= NOW()
+              AND {SHARD_SQL} % $2 = ANY($3)
+            ORDER BY id
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, idem_key, user_id, text, ref_kind, ref_id, old_base, new_base, attempts, symbol"""),
+    "outbox_sent": (("bigint[]",), """
+        UPDATE alert_outbox SET status = 'sent', sent_at = NOW() WHERE id = ANY($1)"""),
+    "outbox_fail": (("text", "integer", "text", "float8", "bigint"), """
+        UPDATE alert_outbox
+        SET status = $1, attempts = $2, last_error = $3,
+            next_attempt_at = NOW() + make_interval(secs => $4)
+        WHERE id = $5"""),
+    "outbox_release": (("float8", "bigint[]"), """
+        UPDATE alert_outbox
+        SET status = 'pending', next_attempt_at = NOW() + make_interval(secs => $1)
+        WHERE id = ANY($2)"""),
+    "outbox_pending": ((), """
+        SELECT idem_key, ref_kind, ref_id, symbol FROM alert_outbox
+        WHERE status IN ('pending', 'sending')"""),
+    # недоступные пользователи
+    "gone_subs": (("bigint[]",), """
+        UPDATE subscribers SET active = FALSE, updated_at = NOW()
+        WHERE user_id = ANY($1) AND active = TRUE
+        RETURNING user_id, symbol"""),
+    "gone_targets": (("bigint[]",), """
+        UPDATE price_targets SET active = FALSE, updated_at = NOW()
+        WHERE user_id = ANY($1) AND active = TRUE
+        RETURNING id"""),
+    "gone_outbox": (("bigint[]",), """
+        UPDATE alert_outbox SET status = 'dropped', last_error = 'unreachable'
+        WHERE user_id = ANY($1) AND status IN ('pending', 'sending')"""),
+    "gone_digests": (("bigint[]",), """
+        UPDATE digest_subscribers SET active = FALSE, updated_at = NOW()
+        WHERE user_id = ANY($1) AND active = TRUE"""),
+    # дайджест
+    "digest_set": (("bigint", "text", "boolean"), """
+        INSERT INTO digest_subscribers (user_id, lang, active)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (user_id) DO UPDATE
+        SET lang = EXCLUDED.lang, active = EXCLUDED.active, updated_at = NOW()"""),
+    "digest_due": (("date",), """
+        SELECT user_id, lang FROM digest_subscribers
+        WHERE active = TRUE AND (last_sent_on IS NULL OR last_sent_on < $1)
+        ORDER BY user_id"""),
+    "digest_sent": (("date", "bigint[]"), """
+        UPDATE digest_subscribers SET last_sent_on = $1 WHERE user_id = ANY($2)"""),
+    # тикеты
+    "tickets_add": (("bigint", "numeric", "integer"), """
+        INSERT INTO ticket_users (user_id, total_ton, total_tickets, created_at, updated_at)
+        VALUES ($1, $2, $3, NOW(), NOW())
+        ON CONFLICT (user_id) DO UPDATE
+        SET total_ton = ticket_users.total_ton + EXCLUDED.total_ton,
+            total_tickets = ticket_users.total_tickets + EXCLUDED.total_tickets,
+            updated_at = NOW()
+        RETURNING total_tickets, total_ton"""),
+    "ticket_stats": (("bigint",), """
+        SELECT total_tickets, total_ton FROM ticket_users WHERE user_id = $1"""),
+    "leaderboard": (("integer",), """
+        SELECT user_id, total_tickets, total_ton
+        FROM ticket_users
+        WHERE total_ton > 0
+        ORDER BY total_ton DESC
+        LIMIT $1"""),
+    "invoice_upsert": (("bigint[]", "bigint[]", "integer[]", "numeric[]", "text[]"), """
+        INSERT INTO ticket_invoices (invoice_id, user_id, tickets, amount_ton, status)
+        SELECT * FROM unnest($1, $2, $3, $4, $5)
+        ON CONFLICT (invoice_id) DO UPDATE
+        SET status = EXCLUDED.status,
+            updated_at = NOW()"""),
+    "invoice_status": (("bigint",), """
+        SELECT status FROM ticket_invoices WHERE invoice_id = $1"""),
+    "invoice_paid": (("bigint",), """
+        UPDATE ticket_invoices SET status = 'paid', updated_at = NOW() WHERE invoice_id = $1"""),
+    # рефералы
+    "referral_add": (("bigint[]", "bigint[]"), """
+        INSERT INTO referrals (referrer_id, referred_id)
+        SELECT * FROM unnest($1, $2)
+        ON CONFLICT (referred_id) DO NOTHING
+        RETURNING referrer_id"""),
+    "referral_counts": (("bigint[]",), """
+        SELECT referrer_id, COUNT(*) FROM referrals WHERE referrer_id = ANY($1) GROUP BY referrer_id"""),
+    "referral_count": (("bigint",), """
+        SELECT COUNT(*) FROM referrals WHERE referrer_id = $1"""),
+    "referral_top": ((), """
+        SELECT referrer_id, COUNT(*) AS cnt
+        FROM referrals
+        GROUP BY referrer_id
+        ORDER BY cnt DESC
+        LIMIT 1"""),
+    # лента изменений: NOTIFY в транзакции записи, пачка событий — один вызов
+    "notify": (("text", "text[]"), """
+        SELECT pg_notify($1, payload) FROM unnest($2) AS payload"""),
+}
+
+
+def _columns(rows: list, width: int) -> list:
+    # [(a, b), (c, d)] -> [[a, c], [b, d]] — параметры для unnest
+    return [list(column) for column in zip(*rows)] if rows else [[] for _ in range(width)]
+
+
+class PostgresStorage(Storage):
+    name = "postgres"
+    shared = True
+    IDLE_PING_AFTER = 30.0  # сек простоя в пуле, после которых соединение проверяем SELECT 1
+
+    def __init__(self, dsn: str, channel: str = None, encode=None, pool_size: int = 4):
+        self.dsn = dsn
+        # encode([(kind, fields)]) -> [payload] — события ленты изменений для NOTIFY в channel
+        self.channel = channel
+        self.encode = encode
+        self.pool_size = pool_size  # сколько свободных соединений держать открытыми
+        self.idle: list = []
+        self.idle_since: dict = {}  # соединение -> time.monotonic() возврата в пул
+        self.prepared: dict = {}  # соединение -> имена подготовленных на нём выражений
+        self.lock = threading.Lock()
+        # EXECUTE с явным приведением: ARRAY[NULL] или '{}' без типа не сопоставятся с параметром
+        self.executes = {
+            name: f"EXECUTE {name}" + (" (" + ", ".join(f"%s::{t}" for t in types) + ")" if types else "")
+            for name, (types, _) in PG_QUERIES.items()
+        }
+        self.stats = {"connects": 0, "prepares": 0, "executes": 0, "discarded": 0}
+
+    def _getconn(self):
+        conn = None
+        with self.lock:
+            while self.idle:
+                conn = self.idle.pop()
+                since = self.idle_since.pop(conn, 0.0)
+                if not conn.closed:
+                    break
+                self.prepared.pop(conn, None)
+                conn = None
+        if conn is not None:
+            if time.monotonic() - since < self.IDLE_PING_AFTER or self._alive(conn):
+                return conn
+            # соединение умерло в пуле (рестарт базы, таймаут на балансировщике) —
+            # остальные свободные, скорее всего, тоже: выбрасываем и повторяем на новом
+            self._putconn(conn, False)
+            self._drop_idle()
+        with self.lock:
+            self.stats["connects"] += 1
+        conn = psycopg2.connect(self.dsn)
+        with self.lock:
+            self.prepared[conn] = set()
+        return conn
+
+    def _putconn(self, conn, ok: bool):
+        with self.lock:
+            if ok and not conn.closed and len(self.idle) < self.pool_size:
+                self.idle.append(conn)
+                self.idle_since[conn] = time.monotonic()
+                return
+            # после ошибки соединение не переиспользуем: проще, чем разбирать,
+            # какие PREPARE пережили откат
+            self.prepared.pop(conn, None)
+            if not ok:
+                self.stats["discarded"] += 1
+        conn.close()
+
+    def _alive(self, conn) -> bool:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    @contextmanager
+    def cursor(self):
+        conn = self._getconn()
+        ok = False
+        try:
+            with conn:  # COMMIT, при исключении — ROLLBACK
+                with conn.cursor() as cur:
+                    yield cur
+            ok = True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # база перезапущена или сеть рвалась — свободные соединения, скорее всего, тоже мёртвые
+            self._drop_idle()
+            raise
+        finally:
+            self._putconn(conn, ok)
+
+    def _drop_idle(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+            for conn in idle:
+                self.prepared.pop(conn, None)
+                self.idle_since.pop(conn, None)
+        for conn in idle:
+            conn.close()
+
+    def close(self):
+        self._drop_idle()
+
+    def run(self, cur, name: str, params=()):
+        prepared = self.prepared[cur.connection]
+        if name not in prepared:
+            types, sql = PG_QUERIES[name]
+            cur.execute(f"PREPARE {name} ({', '.join(types)}) AS {sql};" if types else f"PREPARE {name} AS {sql};")
+            prepared.add(name)
+            self.stats["prepares"] += 1
+            PG_STATEMENTS.inc(query=name, cache="miss")
+        else:
+            PG_STATEMENTS.inc(query=name, cache="hit")
+        self.stats["executes"] += 1
+        cur.execute(self.executes[name], params)
+
+    def _notify(self, cur, kind: str, **fields):
+        self._notify_many(cur, [(kind, fields)])
+
+    def _notify_many(self, cur, events: list):
+        if self.encode is not None and events:
+            self.run(cur, "notify", (self.channel, self.encode(events)))
+
+    def _notify_chunked(self, cur, kind: str, field: str, items: list):
+        self._notify_many(cur, [(kind, {field: items[i:i + NOTIFY_CHUNK]})
+                                for i in range(0, len(items), NOTIFY_CHUNK)])
+
+    def init(self):
+        with self.cursor() as cur:
+            # подписки по цене
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS subscribers (
+                    user_id    BIGINT NOT NULL,
+                    symbol     TEXT NOT NULL DEFAULT 'TONUSDT',
+                    lang       TEXT NOT NULL,
+                    base_price NUMERIC,
+                    active     BOOLEAN NOT NULL DEFAULT TRUE,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (user_id, symbol)
+                );
+                """
+            )
+            # старые базы: подписка была одна (на TON), ключ — только user_id
+            cur.execute(
+                """
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'subscribers' AND column_name = 'symbol';
+                """
+            )
+            if cur.fetchone() is None:
+                cur.execute(
+                    """
+                    ALTER TABLE subscribers ADD COLUMN symbol TEXT NOT NULL DEFAULT 'TONUSDT';
+                    ALTER TABLE subscribers DROP CONSTRAINT subscribers_pkey;
+                    ALTER TABLE subscribers ADD PRIMARY KEY (user_id, symbol);
+                    """
+                )
+            # тикеты и статистика
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ticket_users (
+                    user_id       BIGINT PRIMARY KEY,
+                    total_ton     NUMERIC NOT NULL DEFAULT 0,
+                    total_tickets INTEGER NOT NULL DEFAULT 0,
+                    created_at    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    updated_at    TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ticket_invoices (
+                    invoice_id BIGINT PRIMARY KEY,
+                    user_id    BIGINT NOT NULL,
+                    tickets    INTEGER NOT NULL,
+                    amount_ton NUMERIC NOT NULL,
+                    status     TEXT   NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """
+            )
+            # пользовательские пороги и цели по цене
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS price_targets (
+                    id         BIGSERIAL PRIMARY KEY,
+                    user_id    BIGINT NOT NULL,
+                    symbol     TEXT NOT NULL DEFAULT 'TONUSDT',
+                    lang       TEXT NOT NULL,
+                    kind       TEXT NOT NULL,
+                    value      NUMERIC NOT NULL,
+                    base_price NUMERIC,
+                    active     BOOLEAN NOT NULL DEFAULT TRUE,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """
+            )
+            cur.execute(
+                "ALTER TABLE price_targets ADD COLUMN IF NOT EXISTS symbol TEXT NOT NULL DEFAULT 'TONUSDT';"
+            )
+            cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS price_targets_user_active
+                ON price_targets (user_id) WHERE active;
+                """
+            )
+            # очередь уведомлений: idem_key защищает от повторной отправки
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS alert_outbox (
+                    id              BIGSERIAL PRIMARY KEY,
+                    idem_key        TEXT NOT NULL UNIQUE,
+                    user_id         BIGINT NOT NULL,
+                    symbol          TEXT NOT NULL DEFAULT 'TONUSDT',
+                    text            TEXT NOT NULL,
+                    ref_kind        TEXT NOT NULL,
+                    ref_id          BIGINT NOT NULL,
+                    old_base        NUMERIC,
+                    new_base        NUMERIC,
+                    status          TEXT NOT NULL DEFAULT 'pending',
+                    attempts        INTEGER NOT NULL DEFAULT 0,
+                    last_error      TEXT,
+                    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    claimed_at      TIMESTAMPTZ,
+                    created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    sent_at         TIMESTAMPTZ
+                );
+                """
+            )
+            cur.execute(
+                "ALTER TABLE alert_outbox ADD COLUMN IF NOT EXISTS symbol TEXT NOT NULL DEFAULT 'TONUSDT';"
+            )
+            cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS alert_outbox_pending
+                ON alert_outbox (next_attempt_at) WHERE status IN ('pending', 'sending');
+                """
+            )
+            # ежедневный дайджест: last_sent_on делает рассылку продолжаемой после рестарта
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS digest_subscribers (
+                    user_id      BIGINT PRIMARY KEY,
+                    lang         TEXT NOT NULL,
+                    active       BOOLEAN NOT NULL DEFAULT TRUE,
+                    last_sent_on DATE,
+                    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    updated_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """
+            )
+            # рефералы
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS referrals (
+                    referrer_id BIGINT NOT NULL,
+                    referred_id BIGINT PRIMARY KEY,
+                    created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """
+            )
+            # счётчик рефералов считается в add_referral на каждую запись
+            cur.execute(
+                "CREATE INDEX IF NOT EXISTS referrals_referrer ON referrals (referrer_id);"
+            )
+
+    # --- подписки по цене
+
+    def subscribe_many(self, rows):
+        with self.cursor() as cur:
+            self.run(cur, "sub_upsert", _columns(rows, 4))
+            self._notify_many(cur, [("sub", {"u": user_id, "s": symbol, "l": lang, "b": base_price})
+                                    for user_id, symbol, lang, base_price in rows])
+
+    def get_subscription(self, user_id, symbol):
+        with self.cursor() as cur:
+            self.run(cur, "sub_get", (user_id, symbol))
+            return cur.fetchone()
+
+    def unsubscribe(self, user_id, symbol):
+        with self.cursor() as cur:
+            self.run(cur, "sub_off", (user_id, symbol))
+            self._notify(cur, "unindex", k=[("sub", user_id, symbol)])
+
+    def active_subscribers(self):
+        with self.cursor() as cur:
+            self.run(cur, "sub_active")
+            return cur.fetchall()
+
+    # --- пороги и цели
+
+    def add_target(self, user_id, lang, kind, value, base_price, symbol):
+        with self.cursor() as cur:
+            self.run(cur, "target_add", (user_id, lang, kind, Decimal(str(value)), base_price, symbol))
+            row = cur.fetchone()
+            target = dict(zip(("id", "user_id", "lang", "kind", "value", "base_price", "symbol"), row))
+            target["value"] = float(target["value"])
+            if target["base_price"] is not None:
+                target["base_price"] = float(target["base_price"])
+            self._notify(cur, "target", t=target)
+        return row
+
+    def user_targets(self, user_id):
+        with self.cursor() as cur:
+            self.run(cur, "target_list", (user_id,))
+            return cur.fetchall()
+
+    def active_targets(self):
+        with self.cursor() as cur:
+            self.run(cur, "target_active")
+            return cur.fetchall()
+
+    def delete_targets(self, user_id, target_id=None):
+        with self.cursor() as cur:
+            if target_id is None:
+                self.run(cur, "target_off_all", (user_id,))
+            else:
+                self.run(cur, "target_off", (user_id, target_id))
+            removed = [int(r[0]) for r in cur.fetchall()]
+            if removed:
+                self._notify(cur, "unindex", k=[("target", tid) for tid in removed])
+        return removed
+
+    # --- outbox
+
+    def enqueue_alerts(self, rows):
+        with self.cursor() as cur:
+            self.run(cur, "outbox_enqueue", _columns(rows, 8))
+            return [r[0] for r in cur.fetchall()]
+
+    def claim_outbox(self, limit, lease, shards=None, shard_count=0):
+        with self.cursor() as cur:
+            self.run(cur, "outbox_reclaim", (lease,))
+            if shards is None:
+                self.run(cur, "outbox_claim", (limit,))
+            else:
+                self.run(cur, "outbox_claim_shards", (limit, shard_count, list(shards)))
+            return cur.fetchall()
+
+    def complete_outbox(self, ids, subs, pcts, done):
+        with self.cursor() as cur:
+            self.run(cur, "outbox_sent", (list(ids),))
+            if subs:
+                self.run(cur, "sub_rebase", _columns(subs, 4))
+            if pcts:
+                self.run(cur, "target_rebase", _columns(pcts, 3))
+            if done:
+                self.run(cur, "target_done", (list(done),))
+
+    def fail_outbox(self, row_id, status, attempts, error, delay):
+        with self.cursor() as cur:
+            self.run(cur, "outbox_fail", (status, attempts, error, delay, row_id))
+
+    def release_outbox(self, ids, delay):
+        with self.cursor() as cur:
+            self.run(cur, "outbox_release", (delay, list(ids)))
+
+    def pending_outbox(self):
+        with self.cursor() as cur:
+            self.run(cur, "outbox_pending")
+            return cur.fetchall()
+
+    def deactivate_users(self, user_ids):
+        user_ids = list(user_ids)
+        with self.cursor() as cur:
+            self.run(cur, "gone_subs", (user_ids,))
+            subs = [(int(r[0]), r[1]) for r in cur.fetchall()]
+            self.run(cur, "gone_targets", (user_ids,))
+            targets = [int(r[0]) for r in cur.fetchall()]
+            self.run(cur, "gone_outbox", (user_ids,))
+            dropped = cur.rowcount
+            self.run(cur, "gone_digests", (user_ids,))
+            digests = cur.rowcount
+            self._notify_chunked(cur, "gone", "u", user_ids)
+            keys = [("sub", user_id, symbol) for user_id, symbol in subs] + [("target", t) for t in targets]
+            self._notify_chunked(cur, "unindex", "k", keys)
+        return {"subs": subs, "targets": targets, "dropped_alerts": dropped, "pruned_digests": digests}
+
+    # --- дайджест
+
+    def set_digest(self, user_id, lang, active):
+        with self.cursor() as cur:
+            self.run(cur, "digest_set", (user_id, lang, active))
+
+    def digest_recipients(self, day):
+        with self.cursor() as cur:
+            self.run(cur, "digest_due", (day,))
+            return cur.fetchall()
+
+    def mark_digest_sent(self, user_ids, day):
+        with self.cursor() as cur:
+            self.run(cur, "digest_sent", (day, list(user_ids)))
+
+    # --- тикеты
+
+    def add_tickets(self, user_id, tickets, amount_ton):
+        with self.cursor() as cur:
+            self.run(cur, "tickets_add", (user_id, Decimal(str(amount_ton)), tickets))
+            total_tickets, total_ton = cur.fetchone()
+            total_tickets, total_ton = int(total_tickets), float(total_ton or 0)
+            self._notify(cur, "tickets", u=user_id, t=total_tickets, ton=total_ton)
+        return total_tickets, total_ton
+
+    def save_invoices(self, rows):
+        with self.cursor() as cur:
+            self.run(cur, "invoice_upsert", _columns(
+                [(invoice_id, user_id, tickets, Decimal(str(amount_ton)), status)
+                 for invoice_id, user_id, tickets, amount_ton, status in rows], 5))
+
+    def invoice_status(self, invoice_id):
+        with self.cursor() as cur:
+            self.run(cur, "invoice_status", (invoice_id,))
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def mark_invoice_paid(self, invoice_id):
+        with self.cursor() as cur:
+            self.run(cur, "invoice_paid", (invoice_id,))
+
+    def ticket_stats(self, user_id):
+        with self.cursor() as cur:
+            self.run(cur, "ticket_stats", (user_id,))
+            return cur.fetchone()
+
+    def leaderboard(self, limit):
+        with self.cursor() as cur:
+            self.run(cur, "leaderboard", (limit,))
+            return cur.fetchall()
+
+    # --- рефералы
+
+    def add_referrals(self, rows):
+        with self.cursor() as cur:
+            self.run(cur, "referral_add", _columns(rows, 2))
+            referrers = sorted({int(r[0]) for r in cur.fetchall()})
+            if not referrers:
+                return {}
+            self.run(cur, "referral_counts", (referrers,))
+            counts = {int(r[0]): int(r[1]) for r in cur.fetchall()}
+            self._notify_many(cur, [("ref", {"r": r, "n": n}) for r, n in counts.items()])
+        return counts
+
+    def referral_count(self, user_id):
+        with self.cursor() as cur:
+            self.run(cur, "referral_count", (user_id,))
+            row = cur.fetchone()
+        return int(row[0]) if row else 0
+
+    def top_referrer(self):
+        with self.cursor() as cur:
+            self.run(cur, "referral_top")
+            return cur.fetchone()
+
+
+# ------------------ SQLITE ------------------
+
+SQLITE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS subscribers (
+        user_id    INTEGER NOT NULL,
+        symbol     TEXT NOT NULL DEFAULT 'TONUSDT',
+        lang       TEXT NOT NULL,
+        base_price REAL,
+        active     INTEGER NOT NULL DEFAULT 1,
+        created_at REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+        updated_at REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+        PRIMARY KEY (user_id, symbol)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ticket_users (
+        user_id       INTEGER PRIMARY KEY,
+        total_ton     REAL NOT NULL DEFAULT 0,
+        total_tickets INTEGER NOT NULL DEFAULT 0,
+        created_at    REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+        updated_at    REAL NOT NULL DEFAULT (strftime('%s', 'now'))
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS ticket_users_total_ton ON ticket_users (total_ton DESC) WHERE total_ton > 0;",
+    """
+    CREATE TABLE IF NOT EXISTS ticket_invoices (
+        invoice_id INTEGER PRIMARY KEY,
+        user_id    INTEGER NOT NULL,
+        tickets    INTEGER NOT NULL,
+        amount_ton REAL NOT NULL,
+        status     TEXT NOT NULL,
+        created_at REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+        updated_at REAL NOT NULL DEFAULT (strftime('%s', 'now'))
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS price_targets (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id    INTEGER NOT NULL,
+        symbol     TEXT NOT NULL DEFAULT 'TONUSDT',
+        lang       TEXT NOT NULL,
+        kind       TEXT NOT NULL,
+        value      REAL NOT NULL,
+        base_price REAL,
+        active     INTEGER NOT NULL DEFAULT 1,
+        created_at REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+        updated_at REAL NOT NULL DEFAULT (strftime('%s', 'now'))
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS price_targets_user_active ON price_targets (user_id) WHERE active;",
+    """
+    CREATE TABLE IF NOT EXISTS alert_outbox (
+        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+        idem_key        TEXT NOT NULL UNIQUE,
+        user_id         INTEGER NOT NULL,
+        symbol          TEXT NOT NULL DEFAULT 'TONUSDT',
+        text            TEXT NOT NULL,
+        ref_kind        TEXT NOT NULL,
+        ref_id          INTEGER NOT NULL,
+        old_base        REAL,
+        new_base        REAL,
+        status          TEXT NOT NULL DEFAULT 'pending',
+        attempts        INTEGER NOT NULL DEFAULT 0,
+        last_error      TEXT,
+        next_attempt_at REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+        claimed_at      REAL,
+        created_at      REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+        sent_at         REAL
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS alert_outbox_pending
+    ON alert_outbox (next_attempt_at) WHERE status IN ('pending', 'sending');
+    """,
+    "CREATE INDEX IF NOT EXISTS alert_outbox_user ON alert_outbox (user_id);",
+    """
+    CREATE TABLE IF NOT EXISTS digest_subscribers (
+        user_id      INTEGER PRIMARY KEY,
+        lang         TEXT NOT NULL,
+        active       INTEGER NOT NULL DEFAULT 1,
+        last_sent_on TEXT,
+        created_at   REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+        updated_at   REAL NOT NULL DEFAULT (strftime('%s', 'now'))
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS referrals (
+        referrer_id INTEGER NOT NULL,
+        referred_id INTEGER PRIMARY KEY,
+        created_at  REAL NOT NULL DEFAULT (strftime('%s', 'now'))
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS referrals_referrer ON referrals (referrer_id);",
+)
+
+# списки id передаём одним параметром: IN (SELECT value FROM json_each(?))
+IN_JSON = "IN (SELECT value FROM json_each(?))"
+
+
+class SqliteStorage(Storage):
+    # Встроенная база для одного процесса (нужен SQLite >= 3.35: RETURNING).
+    # WAL: чтения не ждут запись и идут с соединения своего потока. Все записи —
+    # через очередь в один поток со своим соединением: нет SQLITE_BUSY между
+    # писателями, а накопившиеся в очереди операции уходят одним COMMIT
+    # (каждая в своём SAVEPOINT — ошибка одной не откатывает соседние).
+    # Запросы — константные строки: sqlite3 держит их скомпилированными в кеше
+    # подготовленных выражений соединения, повторный вызов не парсит SQL.
+
+    name = "sqlite"
+    shared = False
+    WRITE_GROUP_MAX = 256
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.writes = queue.SimpleQueue()
+        self.stats = {"reads": 0, "writes": 0, "commits": 0}
+        self.closed = False
+        self.close_lock = threading.Lock()  # проверка closed и постановка в очередь — атомарно
+        self.writer = threading.Thread(target=self._writer_loop, name="sqlite-writer", daemon=True)
+        self.writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               cached_statements=256)
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")  # в WAL: fsync на чекпоинте, не на каждом COMMIT
+        conn.execute("PRAGMA busy_timeout = 5000;")
+        conn.create_function("NOW", 0, time.time)
+        return conn
+
+    def _read(self, sql: str, params=()) -> list:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = self._connect()
+            conn.execute("PRAGMA query_only = ON;")
+        self.stats["reads"] += 1
+        return conn.execute(sql, params).fetchall()
+
+    def _write(self, fn):
+        # fn(conn) выполняется в потоке записи внутри транзакции; ждём COMMIT
+        future = Future()
+        with self.close_lock:
+            if self.closed:
+                # поток записи уже остановлен: ждать ответа было бы некому
+                raise sqlite3.ProgrammingError("storage is closed")
+            self.writes.put((fn, future))
+        return future.result()
+
+    def _writer_loop(self):
+        conn = self._connect()
+        while True:
+            jobs = [self.writes.get()]
+            while len(jobs) < self.WRITE_GROUP_MAX:
+                try:
+                    jobs.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(job is None for job in jobs)
+            jobs = [job for job in jobs if job is not None]
+
+            finished = []
+            try:
+                conn.execute("BEGIN IMMEDIATE;")
+            except Exception as e:
+                for _, future in jobs:
+                    future.set_exception(e)
+                jobs = []
+            for fn, future in jobs:
+                conn.execute("SAVEPOINT job;")
+                try:
+                    result = fn(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job;")
+                    conn.execute("RELEASE job;")
+                    future.set_exception(e)
+                else:
+                    conn.execute("RELEASE job;")
+                    finished.append((future, result))
+            try:
+                if conn.in_transaction:
+                    conn.execute("COMMIT;")
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK;")
+                for future, _ in finished:
+                    future.set_exception(e)
+            else:
+                if finished:
+                    self.stats["writes"] += len(finished)
+                    self.stats["commits"] += 1
+                for future, result in finished:
+                    future.set_result(result)
+            if stop:
+                conn.close()
+                return
+
+    def close(self):
+        with self.close_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.writes.put(None)
+        self.writer.join(timeout=5)
+        if self.writer.is_alive():
+            return  # ещё дописывает: очередь до остановки он выполнит сам
+        # что осталось в очереди после остановки потока, уже не выполнится
+        while True:
+            try:
+                job = self.writes.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[1].set_exception(sqlite3.ProgrammingError("storage is closed"))
+
+    def init(self):
+        def run(conn):
+            for statement in SQLITE_SCHEMA:
+                conn.execute(statement)
+        self._write(run)
+
+    # --- подписки по цене
+
+    def subscribe_many(self, rows):
+        self._write(lambda conn: conn.executemany(
+            """
+            INSERT INTO subscribers (user_id, symbol, lang, base_price, active, created_at, updated_at)
+            VALUES (?, ?, ?, ?, TRUE, NOW(), NOW())
+            ON CONFLICT (user_id, symbol) DO UPDATE
+            SET lang = excluded.lang,
+                base_price = excluded.base_price,
+                active = TRUE,
+                updated_at = NOW();
+            """,
+            rows,
+        ))
+
+    def get_subscription(self, user_id, symbol):
+        rows = self._read(
+            "SELECT user_id, lang, base_price, active FROM subscribers WHERE user_id = ? AND symbol = ?;",
+            (user_id, symbol),
+        )
+        return rows[0] if rows else None
+
+    def unsubscribe(self, user_id, symbol):
+        self._write(lambda conn: conn.execute(
+            "UPDATE subscribers SET active = FALSE, updated_at = NOW() WHERE user_id = ? AND symbol = ?;",
+            (user_id, symbol),
+        ))
+
+    def active_subscribers(self):
+        return self._read("SELECT user_id, symbol, lang, base_price FROM subscribers WHERE active = TRUE;")
+
+    # --- пороги и цели
+
+    def add_target(self, user_id, lang, kind, value, base_price, symbol):
+        return self._write(lambda conn: conn.execute(
+            """
+            INSERT INTO price_targets (user_id, lang, kind, value, base_price, symbol)
+            VALUES (?, ?, ?, ?, ?, ?)
+            RETURNING id, user_id, lang, kind, value, base_price, symbol;
+            """,
+            (user_id, lang, kind, value, base_price, symbol),
+        ).fetchone())
+
+    def user_targets(self, user_id):
+        return self._read(
+            """
+            SELECT id, user_id, lang, kind, value, base_price, symbol
+            FROM price_targets WHERE user_id = ? AND active = TRUE ORDER BY id;
+            """,
+            (user_id,),
+        )
+
+    def active_targets(self):
+        return self._read(
+            "SELECT id, user_id, lang, kind, value, base_price, symbol FROM price_targets WHERE active = TRUE;"
+        )
+
+    def delete_targets(self, user_id, target_id=None):
+        def run(conn):
+            if target_id is None:
+                cur = conn.execute(
+                    """
+                    UPDATE price_targets SET active = FALSE, updated_at = NOW()
+                    WHERE user_id = ? AND active = TRUE RETURNING id;
+                    """,
+                    (user_id,),
+                )
+            else:
+                cur = conn.execute(
+                    """
+                    UPDATE price_targets SET active = FALSE, updated_at = NOW()
+                    WHERE user_id = ? AND id = ? AND active = TRUE RETURNING id;
+                    """,
+                    (user_id, target_id),
+                )
+            return [int(r[0]) for r in cur.fetchall()]
+        return self._write(run)
+
+    # --- outbox
+
+    def enqueue_alerts(self, rows):
+        def run(conn):
+            inserted = []
+            for row in rows:
+                cur = conn.execute(
+                    """
+                    INSERT INTO alert_outbox (idem_key, user_id, symbol, text, ref_kind, ref_id, old_base, new_base)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (idem_key) DO NOTHING;
+                    """,
+                    row,
+                )
+                if cur.rowcount:
+                    inserted.append(row[0])
+            return inserted
+        return self._write(run)
+
+    def claim_outbox(self, limit, lease, shards=None, shard_count=0):
+        def run(conn):
+            # упавший посреди отправки процесс оставляет строки в 'sending'
+            conn.execute(
+                "UPDATE alert_outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < NOW() - ?;",
+                (lease,),
+            )
+            if shards is None:
+                return conn.execute(
+                    """
+                    UPDATE alert_outbox SET status = 'sending', claimed_at = NOW()
+                    WHERE id IN (
+                        SELECT id FROM alert_outbox
+                        WHERE status = 'pending' AND next_attempt_at <= NOW()
+                        ORDER BY id
+                        LIMIT ?
+                    )
+                    RETURNING id, idem_key, user_id, text, ref_kind, ref_id, old_base, new_base, attempts, symbol;
+                    """,
+                    (limit,),
+                ).fetchall()
+            return conn.execute(
+                f"""
+                UPDATE alert_outbox SET status = 'sending', claimed_at = NOW()
+                WHERE id IN (
+                    SELECT id FROM alert_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= NOW()
+                      AND {SHARD_SQL} % ? {IN_JSON}
+                    ORDER BY id
+                    LIMIT ?
+                )
+                RETURNING id, idem_key, user_id, text, ref_kind, ref_id, old_base, new_base, attempts, symbol;
+                """,
+                (shard_count, json.dumps(sorted(shards)), limit),
+            ).fetchall()
+        return self._write(run)
+
+    def complete_outbox(self, ids, subs, pcts, done):
+        def run(conn):
+            conn.execute(
+                f"UPDATE alert_outbox SET status = 'sent', sent_at = NOW() WHERE id {IN_JSON};",
+                (json.dumps(ids),),
+            )
+            # base_price меняем, только если его не перезаписали (переподписка)
+            conn.executemany(
+                """
+                UPDATE subscribers SET base_price = ?, updated_at = NOW()
+                WHERE user_id = ? AND symbol = ? AND base_price = ?;
+                """,
+                [(new_base, user_id, symbol, old_base) for user_id, symbol, new_base, old_base in subs],
+            )
+            conn.executemany(
+                "UPDATE price_targets SET base_price = ?, updated_at = NOW() WHERE id = ? AND base_price = ?;",
+                [(new_base, target_id, old_base) for target_id, new_base, old_base in pcts],
+            )
+            if done:
+                conn.execute(
+                    f"UPDATE price_targets SET active = FALSE, updated_at = NOW() WHERE id {IN_JSON};",
+                    (json.dumps(done),),
+                )
+        self._write(run)
+
+    def fail_outbox(self, row_id, status, attempts, error, delay):
+        self._write(lambda conn: conn.execute(
+            """
+            UPDATE alert_outbox
+            SET status = ?, attempts = ?, last_error = ?, next_attempt_at = NOW() + ?
+            WHERE id = ?;
+            """,
+            (status, attempts, error, delay, row_id),
+        ))
+
+    def release_outbox(self, ids, delay):
+        self._write(lambda conn: conn.execute(
+            f"UPDATE alert_outbox SET status = 'pending', next_attempt_at = NOW() + ? WHERE id {IN_JSON};",
+            (delay, json.dumps(ids)),
+        ))
+
+    def pending_outbox(self):
+        return self._read(
+            "SELECT idem_key, ref_kind, ref_id, symbol FROM alert_outbox WHERE status IN ('pending', 'sending');"
+        )
+
+    def deactivate_users(self, user_ids):
+        def run(conn):
+            ids = json.dumps(user_ids)
+            subs = conn.execute(
+                f"""
+                UPDATE subscribers SET active = FALSE, updated_at = NOW()
+                WHERE user_id {IN_JSON} AND active = TRUE
+                RETURNING user_id, symbol;
+                """,
+                (ids,),
+            ).fetchall()
+            targets = conn.execute(
+                f"""
+                UPDATE price_targets SET active = FALSE, updated_at = NOW()
+                WHERE user_id {IN_JSON} AND active = TRUE
+                RETURNING id;
+                """,
+                (ids,),
+            ).fetchall()
+            dropped = conn.execute(
+                f"""
+                UPDATE alert_outbox SET status = 'dropped', last_error = 'unreachable'
+                WHERE user_id {IN_JSON} AND status IN ('pending', 'sending');
+                """,
+                (ids,),
+            ).rowcount
+            digests = conn.execute(
+                f"""
+                UPDATE digest_subscribers SET active = FALSE, updated_at = NOW()
+                WHERE user_id {IN_JSON} AND active = TRUE;
+                """,
+                (ids,),
+            ).rowcount
+            return {
+                "subs": [(int(r[0]), r[1]) for r in subs],
+                "targets": [int(r[0]) for r in targets],
+                "dropped_alerts": dropped,
+                "pruned_digests": digests,
+            }
+        return self._write(run)
+
+    # --- дайджест
+
+    def set_digest(self, user_id, lang, active):
+        self._write(lambda conn: conn.execute(
+            """
+            INSERT INTO digest_subscribers (user_id, lang, active)
+            VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE
+            SET lang = excluded.lang, active = excluded.active, updated_at = NOW();
+            """,
+            (user_id, lang, active),
+        ))
+
+    def digest_recipients(self, day):
+        # даты — ISO-строки: сравнение строк совпадает со сравнением дат
+        return self._read(
+            """
+            SELECT user_id, lang FROM digest_subscribers
+            WHERE active = TRUE AND (last_sent_on IS NULL OR last_sent_on < ?)
+            ORDER BY user_id;
+            """,
+            (day.isoformat(),),
+        )
+
+    def mark_digest_sent(self, user_ids, day):
+        self._write(lambda conn: conn.execute(
+            f"UPDATE digest_subscribers SET last_sent_on = ? WHERE user_id {IN_JSON};",
+            (day.isoformat(), json.dumps(user_ids)),
+        ))
+
+    # --- тикеты
+
+    def add_tickets(self, user_id, tickets, amount_ton):
+        total_tickets, total_ton = self._write(lambda conn: conn.execute(
+            """
+            INSERT INTO ticket_users (user_id, total_ton, total_tickets, created_at, updated_at)
+            VALUES (?, ?, ?, NOW(), NOW())
+            ON CONFLICT (user_id) DO UPDATE
+            SET total_ton = ticket_users.total_ton + excluded.total_ton,
+                total_tickets = ticket_users.total_tickets + excluded.total_tickets,
+                updated_at = NOW()
+            RETURNING total_tickets, total_ton;
+            """,
+            (user_id, amount_ton, tickets),
+        ).fetchone())
+        return int(total_tickets), float(total_ton or 0)
+
+    def save_invoices(self, rows):
+        self._write(lambda conn: conn.executemany(
+            """
+            INSERT INTO ticket_invoices (invoice_id, user_id, tickets, amount_ton, status)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (invoice_id) DO UPDATE
+            SET status = excluded.status, updated_at = NOW();
+            """,
+            rows,
+        ))
+
+    def invoice_status(self, invoice_id):
+        rows = self._read("SELECT status FROM ticket_invoices WHERE invoice_id = ?;", (invoice_id,))
+        return rows[0][0] if rows else None
+
+    def mark_invoice_paid(self, invoice_id):
+        self._write(lambda conn: conn.execute(
+            "UPDATE ticket_invoices SET status = 'paid', updated_at = NOW() WHERE invoice_id = ?;",
+            (invoice_id,),
+        ))
+
+    def ticket_stats(self, user_id):
+        rows = self._read("SELECT total_tickets, total_ton FROM ticket_users WHERE user_id = ?;", (user_id,))
+        return rows[0] if rows else None
+
+    def leaderboard(self, limit):
+        return self._read(
+            """
+            SELECT user_id, total_tickets, total_ton FROM ticket_users
+            WHERE total_ton > 0
+            ORDER BY total_ton DESC
+            LIMIT ?;
+            """,
+            (limit,),
+        )
+
+    # --- рефералы
+
+    def add_referrals(self, rows):
+        def run(conn):
+            referrers = set()
+            for referrer_id, referred_id in rows:
+                if conn.execute(
+                    "INSERT INTO referrals (referrer_id, referred_id) VALUES (?, ?) ON CONFLICT (referred_id) DO NOTHING;",
+                    (referrer_id, referred_id),
+                ).rowcount:
+                    referrers.add(referrer_id)
+            if not referrers:
+                return {}
+            return dict(conn.execute(
+                f"SELECT referrer_id, COUNT(*) FROM referrals WHERE referrer_id {IN_JSON} GROUP BY referrer_id;",
+                (json.dumps(sorted(referrers)),),
+            ).fetchall())
+        return self._write(run)
+
+    def referral_count(self, user_id):
+        return self._read("SELECT COUNT(*) FROM referrals WHERE referrer_id = ?;", (user_id,))[0][0]
+
+    def top_referrer(self):
+        rows = self._read(
+            """
+            SELECT referrer_id, COUNT(*) AS cnt FROM referrals
+            GROUP BY referrer_id
+            ORDER BY cnt DESC
+            LIMIT 1;
+            """
+        )
+        return rows[0] if rows else None
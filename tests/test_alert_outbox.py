@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "1:test")
+
+import bot  # noqa: E402
+import storage  # noqa: E402
+
+
+class JobQueue:
+    def __init__(self):
+        self.runs = []
+
+    def run_once(self, callback, when, *args, **kwargs):
+        self.runs.append(callback)
+
+
+class FailedOutboxRowTest(unittest.TestCase):
+    # строка outbox в 'failed' больше не уйдёт: тот же эпизод триггера не должен
+    # снова писаться в БД и будить разбор outbox на каждой проверке цены
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = storage.SqliteStorage(os.path.join(self.dir.name, "bot.db"))
+        self.store.init()
+        self.enqueues = 0
+        enqueue = self.store.enqueue_alerts
+
+        def counted(rows):
+            self.enqueues += 1
+            return enqueue(rows)
+
+        self.store.enqueue_alerts = counted
+        bot.store = self.store
+        bot.alert_indexes.clear()
+        bot.outbox_pending.clear()
+        bot.outbox_muted.clear()
+        bot.index_subscriber(1, "en", 100.0, bot.SYMBOL)
+
+    def tearDown(self):
+        bot.store = None
+        bot.alert_indexes.clear()
+        bot.outbox_pending.clear()
+        bot.outbox_muted.clear()
+        self.store.close()
+        self.dir.cleanup()
+
+    def fail_for_good(self):
+        jobs = JobQueue()
+        bot.dispatch_alerts(jobs, bot.collect_alerts(bot.SYMBOL, 120.0))
+        self.assertEqual(len(jobs.runs), 1)
+        rows = bot.claim_outbox_batch()
+        self.assertEqual(len(rows), 1)
+        bot.fail_outbox_delivery(dict(rows[0], attempts=bot.OUTBOX_MAX_ATTEMPTS - 1), "Forbidden")
+
+    def test_failed_row_is_not_retriggered(self):
+        self.fail_for_good()
+        enqueues = self.enqueues
+
+        jobs = JobQueue()
+        for _ in range(3):
+            alerts = bot.collect_alerts(bot.SYMBOL, 121.0)
+            self.assertEqual(alerts, [])
+            bot.dispatch_alerts(jobs, alerts)
+        self.assertEqual(self.enqueues, enqueues)
+        self.assertEqual(jobs.runs, [])
+
+    def test_failed_row_from_another_process_is_muted_after_one_conflict(self):
+        self.fail_for_good()
+        bot.outbox_muted.clear()  # как после рестарта: о 'failed' знает только БД
+        enqueues = self.enqueues
+
+        jobs = JobQueue()
+        bot.dispatch_alerts(jobs, bot.collect_alerts(bot.SYMBOL, 121.0))
+        self.assertEqual(self.enqueues, enqueues + 1)
+        self.assertNotIn(("sub", 1, bot.SYMBOL), bot.outbox_pending)
+
+        self.assertEqual(bot.collect_alerts(bot.SYMBOL, 122.0), [])
+        self.assertEqual(self.enqueues, enqueues + 1)
+        self.assertEqual(jobs.runs, [])
+
+    def test_new_base_starts_new_episode(self):
+        self.fail_for_good()
+        bot.index_subscriber(1, "en", 120.0, bot.SYMBOL)
+
+        jobs = JobQueue()
+        bot.dispatch_alerts(jobs, bot.collect_alerts(bot.SYMBOL, 140.0))
+        self.assertIn(("sub", 1, bot.SYMBOL), bot.outbox_pending)
+        self.assertEqual(len(jobs.runs), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()